@@ -16,7 +16,7 @@ import telegram
 from langdetect import detect, lang_detect_exception
 from telegram import BotCommand, LinkPreviewOptions, MenuButtonCommands, Update
 from telegram.constants import ParseMode, ChatType
-from telegram.ext import Application, CommandHandler, ContextTypes, Defaults, filters, MessageHandler
+from telegram.ext import Application, ChatMemberHandler, CommandHandler, ContextTypes, Defaults, filters, MessageHandler
 
 from common.bot import reply, send
 
@@ -28,10 +28,11 @@ logging.basicConfig(format="[%(asctime)s %(levelname)s %(name)s %(filename)s:%(l
                     level=logging.INFO)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-from common import db, i18n
+from common import db, i18n, members
 from common.admin import get_main_keyboard
 from common.checks import is_admin, is_member_of_chat
 from common.messaging_helpers import safe_delete_message, self_destructing_reply
+from common.persistence import SQLitePersistence
 from common.settings import settings
 from features import antispam, glossary, moderation, services
 
@@ -61,6 +62,10 @@ async def talking_private(update: Update, context: ContextTypes.DEFAULT_TYPE, re
 async def greet_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show the welcome message to the user that has just joined the main chat"""
 
+    if antispam.is_raid_in_progress():
+        logging.info("Not greeting new users during a raid")
+        return
+
     for user in update.message.new_chat_members:
         if user.is_bot:
             continue
@@ -219,6 +224,10 @@ async def handle_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> No
                     error_uuid=error_uuid))
 
 
+async def evict_idle_users(context: ContextTypes.DEFAULT_TYPE) -> None:
+    context.application.persistence.evict_idle_users(context.application)
+
+
 async def post_init(application: Application) -> None:
     # noinspection PyUnresolvedReferences
     bot = application.bot
@@ -232,6 +241,9 @@ async def post_init(application: Application) -> None:
     for administrator in settings.ADMINISTRATORS:
         await bot.set_chat_menu_button(administrator["id"], MenuButtonCommands())
 
+    if settings.PERSISTENCE_IDLE_USER_TTL_MINUTES > 0:
+        application.job_queue.run_repeating(evict_idle_users, interval=settings.PERSISTENCE_IDLE_USER_TTL_MINUTES * 60)
+
     services.post_init(application)
     antispam.post_init(application, 1)
     glossary.post_init(application, 4)
@@ -240,24 +252,37 @@ async def post_init(application: Application) -> None:
         await send(application, settings.DEVELOPER_CHAT_ID, i18n.default().gettext("MESSAGE_ADMIN_HELLO_ON_STARTUP"))
 
 
+async def post_shutdown(application: Application) -> None:
+    services.post_shutdown(application)
+
+
 def main() -> None:
     """Run the bot"""
 
     logging.info("The bot starts in {m} mode".format(m="service" if settings.SERVICE_MODE else "direct"))
 
     db.connect()
+    members.load()
 
     application = (Application.builder()
                    .token(settings.BOT_TOKEN)
                    .defaults(Defaults(link_preview_options=LinkPreviewOptions(is_disabled=True),
                                       parse_mode=ParseMode.HTML))
+                   .persistence(SQLitePersistence())
                    .post_init(post_init)
+                   .post_shutdown(post_shutdown)
                    .build())
 
     # ------------------------------------------------------------------------------------------------------------------
     # The services feature has stateful conversation handlers, and they should go first, to act correctly if the user
     # does something unexpected during the conversation.
 
+    # Keep the roster of chat members up to date before any other handlers see the update.
+    application.add_handler(ChatMemberHandler(members.handle_chat_member, ChatMemberHandler.CHAT_MEMBER), group=-1)
+    application.add_handler(MessageHandler(
+        filters.StatusUpdate.NEW_CHAT_MEMBERS | filters.StatusUpdate.LEFT_CHAT_MEMBER, members.handle_status_update),
+        group=-1)
+
     application.add_handler(CommandHandler(COMMAND_START, handle_command_start))
     application.add_handler(CommandHandler(COMMAND_HELP, handle_command_help))
     application.add_handler(CommandHandler(COMMAND_ADMIN, handle_command_admin))
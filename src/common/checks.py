@@ -4,9 +4,10 @@ Functions for checking whether the update meets certain criteria
 
 import logging
 
-from telegram import ChatMember, ChatMemberLeft, ChatMemberBanned, User
+from telegram import User
 from telegram.ext import ContextTypes
 
+from common import members
 from common.settings import settings
 
 logger = logging.getLogger(__name__)
@@ -14,16 +15,8 @@ logger = logging.getLogger(__name__)
 async def is_member_of_chat(chat_id: int, user: User, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Helper for handlers that require that the user would be a member of the main chat"""
 
-    def should_be_blocked(chat_member: ChatMember):
-        if isinstance(chat_member, ChatMemberLeft):
-            return "not in chat"
-        if isinstance(chat_member, ChatMemberBanned):
-            return "banned"
-        return None
-
-    reason = should_be_blocked(await context.bot.get_chat_member(chat_id, user.id))
-    if reason:
-        logger.info(f"User {user.username} (Telegram ID {user.id}) is not allowed: {reason}")
+    if not await members.is_chat_member(context, chat_id, user.id):
+        logger.info(f"User {user.username} (Telegram ID {user.id}) is not allowed: not in chat or banned")
         return False
 
     return True
@@ -6,6 +6,8 @@ import logging
 import os
 import pathlib
 import sqlite3
+from array import array
+from bisect import bisect_left
 from collections.abc import Iterator
 from sqlite3 import Connection, Cursor
 
@@ -13,9 +15,17 @@ from .log import LogTime
 from .settings import settings
 
 _db_connection: Connection
+_db_path: pathlib.Path
 
 _DB_FILENAME = "people.db"
 
+# In-memory copy of the `antispam_allowlist` table, see `allowlist_load()`.  Small allowlists are kept in a set.  When
+# the allowlist is larger than `ANTISPAM_ALLOWLIST_COMPACT_THRESHOLD`, user IDs loaded from the DB are kept in a sorted
+# array that takes several times less memory, and the set only holds IDs registered after loading.
+_allowlist: set[int] = set()
+_allowlist_compact = array("q")
+_allowlist_loaded = False
+
 
 def _apply_migrations() -> None:
     """Apply pending migrations
@@ -23,7 +33,9 @@ def _apply_migrations() -> None:
     Enumerates all files with .txt extension in the migrations directory, detects ones not applied previously, and tries
     to execute each one of them as a sequence of SQL statements, going through files in alphabetical order.
 
-    Every file should contain one or more SQL statements separated by semicolons.
+    Every file should contain one or more SQL statements separated by semicolons.  Semicolons inside a statement, like
+    ones that separate statements in the body of a trigger, are kept: pieces are joined until they make a complete
+    statement.
     """
 
     c = _db_connection.cursor()
@@ -53,9 +65,15 @@ def _apply_migrations() -> None:
             logging.info(f"Applying migration {migration_filename}")
 
             migration = inp.read().split(";")
-            for sql in migration:
+            sql = ""
+            for piece in migration:
+                sql += piece
+                if not sqlite3.complete_statement(sql + ";"):
+                    sql += ";"
+                    continue
                 logging.info(f"Executing: {sql}")
                 c.execute(sql)
+                sql = ""
 
             c.execute("INSERT INTO migrations(name) VALUES(?)", (migration_filename,))
 
@@ -68,9 +86,11 @@ def connect(path: pathlib.Path = None) -> None:
     @param path: optional path to the SQLite3 database file.  If omitted, the standard path is used.
     """
 
-    global _db_connection
+    global _db_connection, _db_path, _allowlist_loaded
 
-    _db_connection = sqlite3.connect(path if path is not None else settings.data_dir / _DB_FILENAME)
+    _db_path = path if path is not None else settings.data_dir / _DB_FILENAME
+    _db_connection = sqlite3.connect(_db_path)
+    _allowlist_loaded = False
 
     _apply_migrations()
 
@@ -81,6 +101,15 @@ def disconnect() -> None:
     _db_connection.close()
 
 
+def connect_for_thread() -> Connection:
+    """Open another connection to the DB that can be used from a worker thread
+
+    The caller is responsible for closing the connection, and for not using it from two threads at once.
+    """
+
+    return sqlite3.connect(_db_path, check_same_thread=False)
+
+
 def cursor() -> Cursor:
     """Return a cursor for querying the database"""
 
@@ -93,6 +122,34 @@ def commit() -> None:
     _db_connection.commit()
 
 
+def rollback() -> None:
+    """Roll back transactions pending on open connections to the DB"""
+
+    _db_connection.rollback()
+
+
+def allowlist_load() -> None:
+    """Load the `antispam_allowlist` table into memory
+
+    After this function is called, `is_good_member()` does not query the DB anymore, and `register_good_member()`
+    updates both the DB and the in-memory copy.
+    """
+
+    global _allowlist, _allowlist_compact, _allowlist_loaded
+
+    with LogTime("SELECT tg_id FROM antispam_allowlist"):
+        tg_ids = [row[0] for row in cursor().execute("SELECT tg_id FROM antispam_allowlist")]
+
+    threshold = settings.ANTISPAM_ALLOWLIST_COMPACT_THRESHOLD
+    if 0 < threshold < len(tg_ids):
+        _allowlist, _allowlist_compact = set(), array("q", sorted(tg_ids))
+    else:
+        _allowlist, _allowlist_compact = set(tg_ids), array("q")
+    _allowlist_loaded = True
+
+    logging.info(f"Loaded {len(tg_ids)} allowlisted users, compact mode is {'on' if _allowlist_compact else 'off'}")
+
+
 def register_good_member(tg_id: int) -> None:
     """Register the user ID in the `antispam_allowlist` table"""
 
@@ -103,9 +160,21 @@ def register_good_member(tg_id: int) -> None:
 
         _db_connection.commit()
 
+    if _allowlist_loaded:
+        _allowlist.add(tg_id)
+
 
 def is_good_member(tg_id: int) -> bool:
-    """Return whether the user ID exists in the `antispam_allowlist` table"""
+    """Return whether the user ID exists in the `antispam_allowlist` table
+
+    If the allowlist has been loaded with `allowlist_load()`, only the in-memory copy is checked.
+    """
+
+    if _allowlist_loaded:
+        if tg_id in _allowlist:
+            return True
+        i = bisect_left(_allowlist_compact, tg_id)
+        return i < len(_allowlist_compact) and _allowlist_compact[i] == tg_id
 
     with LogTime("SELECT FROM antispam_allowlist WHERE tg_id=?"):
         c = _db_connection.cursor()
@@ -1,8 +1,10 @@
 import pathlib
 import tempfile
 import unittest
+from unittest.mock import patch
 
 from common import db
+from common.settings import settings
 
 class TestDbGeneral(unittest.TestCase):
     @staticmethod
@@ -12,3 +14,42 @@ class TestDbGeneral(unittest.TestCase):
 
             db.connect(pathlib.Path(test_db_file.name))
             db.disconnect()
+
+
+class TestAllowlist(unittest.TestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+
+        for tg_id in (1, 5, 3):
+            db.register_good_member(tg_id)
+
+    def tearDown(self):
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+    def _check_lookup(self):
+        for tg_id in (1, 3, 5):
+            self.assertTrue(db.is_good_member(tg_id))
+        for tg_id in (0, 2, 4, 6):
+            self.assertFalse(db.is_good_member(tg_id))
+
+        db.register_good_member(4)
+        self.assertTrue(db.is_good_member(4))
+
+    def test_not_loaded(self):
+        self._check_lookup()
+
+    def test_loaded(self):
+        db.allowlist_load()
+
+        self._check_lookup()
+
+    def test_loaded_compact(self):
+        with patch.object(settings, "ANTISPAM_ALLOWLIST_COMPACT_THRESHOLD", 2):
+            db.allowlist_load()
+
+        self._check_lookup()
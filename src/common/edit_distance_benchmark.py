@@ -0,0 +1,63 @@
+"""
+Microbenchmark of edit distance functions
+
+Compares the functions from `edit_distance` on random pairs of words of glossary-like length, for pairs that are close
+to each other (which is what the fuzzy lookup verifies) and for unrelated pairs.  Run from the `src` directory:
+
+    python -m common.edit_distance_benchmark
+"""
+
+import argparse
+import random
+import sys
+from time import perf_counter
+
+from .edit_distance import bit_parallel_distance, bounded_distance, damerau_levenshtein_distance
+
+_LETTERS = "abcdefghijklmnopqrstuvwxyzабвгдежзийклмнопрстуфхцчшщыэюя"
+
+
+def _word(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(_LETTERS) for _ in range(length))
+
+
+def _typo(rng: random.Random, word: str) -> str:
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice(_LETTERS) + word[i + 1:]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark edit distance functions")
+    parser.add_argument("--pairs", type=int, default=20000, help="number of pairs of words")
+    parser.add_argument("--length", type=int, default=10, help="length of words")
+    parser.add_argument("--bound", type=int, default=2, help="bound for bounded_distance()")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the random generator")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = [_word(rng, args.length) for _ in range(args.pairs)]
+    cases = {"close": [(word, _typo(rng, word)) for word in words],
+             "unrelated": [(word, _word(rng, args.length)) for word in words]}
+
+    functions = {"reference": damerau_levenshtein_distance,
+                 "bounded": lambda one, two: bounded_distance(one, two, args.bound),
+                 "bit-parallel": bit_parallel_distance}
+
+    for case, pairs in cases.items():
+        expected = [min(damerau_levenshtein_distance(one, two), args.bound + 1) for one, two in pairs]
+        for name, function in functions.items():
+            start = perf_counter()
+            results = [function(one, two) for one, two in pairs]
+            elapsed = perf_counter() - start
+
+            if [min(result, args.bound + 1) for result in results] != expected:
+                print("{} returned wrong results!".format(name))
+                return 1
+
+            print("{:>9}, {:>12}: {:.2f} µs per pair".format(case, name, elapsed / len(pairs) * 1e6))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
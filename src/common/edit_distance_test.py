@@ -0,0 +1,51 @@
+import random
+import unittest
+
+from common.edit_distance import bit_parallel_distance, bounded_distance, damerau_levenshtein_distance
+
+_PAIRS = (("", "", 0), ("abc", "", 3), ("", "abc", 3), ("abc", "abc", 0), ("abc", "abd", 1), ("abc", "acb", 1),
+          ("abc", "bac", 1), ("kitten", "sitting", 3), ("ca", "abc", 3), ("Führerschein", "Fuhrerschien", 2),
+          ("виза", "визы", 1), ("anmeldung", "abmeldung", 1))
+
+
+class TestReference(unittest.TestCase):
+    def test_known_pairs(self):
+        for one, two, distance in _PAIRS:
+            self.assertEqual(damerau_levenshtein_distance(one, two), distance, (one, two))
+
+
+class TestBoundedDistance(unittest.TestCase):
+    def test_known_pairs(self):
+        for one, two, distance in _PAIRS:
+            self.assertEqual(bounded_distance(one, two, 5), distance, (one, two))
+            self.assertEqual(bounded_distance(one, two, 1), min(distance, 2), (one, two))
+            self.assertEqual(bounded_distance(one, two, 0), min(distance, 1), (one, two))
+
+    def test_same_as_reference(self):
+        rng = random.Random(1)
+        for _ in range(2000):
+            one = "".join(rng.choice("abc") for _ in range(rng.randint(0, 8)))
+            two = "".join(rng.choice("abc") for _ in range(rng.randint(0, 8)))
+            distance = damerau_levenshtein_distance(one, two)
+            for bound in range(4):
+                self.assertEqual(bounded_distance(one, two, bound), min(distance, bound + 1), (one, two, bound))
+
+
+class TestBitParallelDistance(unittest.TestCase):
+    def test_known_pairs(self):
+        for one, two, distance in _PAIRS:
+            self.assertEqual(bit_parallel_distance(one, two), distance, (one, two))
+
+    def test_same_as_reference(self):
+        rng = random.Random(1)
+        for _ in range(2000):
+            one = "".join(rng.choice("abc") for _ in range(rng.randint(0, 8)))
+            two = "".join(rng.choice("abc") for _ in range(rng.randint(0, 8)))
+            self.assertEqual(bit_parallel_distance(one, two), damerau_levenshtein_distance(one, two), (one, two))
+
+    def test_long_strings(self):
+        rng = random.Random(1)
+        for _ in range(20):
+            one = "".join(rng.choice("abcd") for _ in range(rng.randint(60, 100)))
+            two = "".join(rng.choice("abcd") for _ in range(rng.randint(60, 100)))
+            self.assertEqual(bit_parallel_distance(one, two), damerau_levenshtein_distance(one, two))
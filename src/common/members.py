@@ -0,0 +1,123 @@
+"""
+Roster of members of the chats that the bot works with
+
+Telegram sends updates when users join or leave a chat where the bot is an administrator.  The roster records them in
+the `chat_members` table and in memory, so that most membership checks are answered without calling the Bot API.  A
+user that is not in the roster, or whose record is older than CHAT_MEMBERS_MAX_AGE_HOURS, is verified with
+`get_chat_member()`, and the result is recorded.
+
+The roster is disabled until `load()` is called: every check goes to the Bot API, and nothing is recorded.
+"""
+
+import datetime
+import logging
+
+from telegram import ChatMember, ChatMemberBanned, ChatMemberLeft, Update
+from telegram.ext import ContextTypes
+
+from . import db, util
+from .settings import settings
+
+_DB_TABLE = "chat_members"
+
+# Maps (chat ID, user ID) to whether the user is a member of the chat, and when that was last confirmed (in UTC).
+# None means that the roster is not loaded.
+_roster: dict[tuple[int, int], tuple[bool, datetime.datetime]] | None = None
+
+
+def _utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.UTC).replace(tzinfo=None, microsecond=0)
+
+
+def _is_tracked(chat_id: int) -> bool:
+    return chat_id != 0 and chat_id in (settings.MAIN_CHAT_ID, settings.MODERATION_CHAT_ID)
+
+
+def is_member_status(chat_member: ChatMember) -> bool:
+    """Return whether the chat member object describes a user who is in the chat"""
+
+    return not isinstance(chat_member, ChatMemberLeft) and not isinstance(chat_member, ChatMemberBanned)
+
+
+def load() -> None:
+    """Load the `chat_members` table into memory and enable the roster"""
+
+    global _roster
+
+    _roster = {}
+    for row in db.sql_query(f"SELECT chat_id, tg_id, is_member, verified_at FROM {_DB_TABLE}"):
+        _roster[(row["chat_id"], row["tg_id"])] = (bool(row["is_member"]),
+                                                   datetime.datetime.fromisoformat(row["verified_at"]))
+
+    logging.info(f"Loaded {len(_roster)} chat member records")
+
+
+def register(chat_id: int, tg_id: int, is_member: bool) -> None:
+    """Record whether the user is a member of the chat as of now"""
+
+    if _roster is None:
+        return
+
+    verified_at = _utc_now()
+
+    db.sql_exec(f"INSERT OR REPLACE INTO {_DB_TABLE} (chat_id, tg_id, is_member, verified_at) VALUES(?, ?, ?, ?)",
+                (chat_id, tg_id, int(is_member), util.db_format(verified_at)))
+
+    _roster[(chat_id, tg_id)] = (is_member, verified_at)
+
+
+def lookup(chat_id: int, tg_id: int) -> bool | None:
+    """Return whether the user is a member of the chat according to the roster, or None if the roster does not know"""
+
+    if _roster is None or (chat_id, tg_id) not in _roster:
+        return None
+
+    is_member, verified_at = _roster[(chat_id, tg_id)]
+    if _utc_now() - verified_at > datetime.timedelta(hours=settings.CHAT_MEMBERS_MAX_AGE_HOURS):
+        return None
+
+    return is_member
+
+
+async def verify(context: ContextTypes.DEFAULT_TYPE, chat_id: int, tg_id: int) -> bool:
+    """Ask Telegram whether the user is a member of the chat and record the answer"""
+
+    is_member = is_member_status(await context.bot.get_chat_member(chat_id, tg_id))
+
+    register(chat_id, tg_id, is_member)
+
+    return is_member
+
+
+async def is_chat_member(context: ContextTypes.DEFAULT_TYPE, chat_id: int, tg_id: int) -> bool:
+    """Return whether the user is a member of the chat, calling the Bot API only if the roster does not know"""
+
+    result = lookup(chat_id, tg_id)
+    if result is None:
+        result = await verify(context, chat_id, tg_id)
+
+    return result
+
+
+async def handle_chat_member(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Record a change of chat member status"""
+
+    chat_member_updated = update.chat_member
+    if not _is_tracked(chat_member_updated.chat.id):
+        return
+
+    new_chat_member = chat_member_updated.new_chat_member
+    register(chat_member_updated.chat.id, new_chat_member.user.id, is_member_status(new_chat_member))
+
+
+async def handle_status_update(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Record users mentioned in a service message about joining or leaving the chat"""
+
+    message = update.effective_message
+    if not _is_tracked(message.chat_id):
+        return
+
+    for user in message.new_chat_members:
+        register(message.chat_id, user.id, True)
+    if message.left_chat_member is not None:
+        register(message.chat_id, message.left_chat_member.id, False)
@@ -0,0 +1,85 @@
+import datetime
+import pathlib
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from telegram import Chat, ChatMemberLeft, ChatMemberMember, ChatMemberUpdated, Message, Update, User
+
+from common import db, members, test_util
+
+_MAIN_CHAT_ID = -100
+_OTHER_CHAT_ID = -200
+
+
+def _user(tg_id: int) -> User:
+    return User(id=tg_id, first_name="Joe", is_bot=False)
+
+
+class TestRoster(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+        members.load()
+
+        self.context = MagicMock(bot=MagicMock(get_chat_member=test_util.AsyncMock()))
+
+        settings_patcher = patch("common.members.settings")
+        self.mock_settings = settings_patcher.start()
+        self.addCleanup(settings_patcher.stop)
+        self.mock_settings.MAIN_CHAT_ID = _MAIN_CHAT_ID
+        self.mock_settings.MODERATION_CHAT_ID = 0
+        self.mock_settings.CHAT_MEMBERS_MAX_AGE_HOURS = 24
+
+    def tearDown(self):
+        members._roster = None
+
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+    async def test_verify_unknown_users(self):
+        self.context.bot.get_chat_member.return_value = ChatMemberMember(_user(1))
+        self.assertTrue(await members.is_chat_member(self.context, _MAIN_CHAT_ID, 1))
+        self.context.bot.get_chat_member.assert_called_once_with(_MAIN_CHAT_ID, 1)
+        self.context.bot.get_chat_member.reset_mock()
+
+        # The answer is remembered.
+        self.assertTrue(await members.is_chat_member(self.context, _MAIN_CHAT_ID, 1))
+        self.context.bot.get_chat_member.assert_not_called()
+
+        # Stale records are verified again.
+        stale_date = datetime.datetime.now(datetime.UTC).replace(tzinfo=None) - datetime.timedelta(hours=25)
+        members._roster[(_MAIN_CHAT_ID, 1)] = (True, stale_date)
+        self.context.bot.get_chat_member.return_value = ChatMemberLeft(_user(1))
+        self.assertFalse(await members.is_chat_member(self.context, _MAIN_CHAT_ID, 1))
+        self.context.bot.get_chat_member.assert_called_once_with(_MAIN_CHAT_ID, 1)
+
+    async def test_updates(self):
+        chat = Chat(id=_MAIN_CHAT_ID, type=Chat.SUPERGROUP)
+        now = datetime.datetime.now()
+
+        await members.handle_status_update(Update(1, message=Message(
+            1, now, chat, new_chat_members=(_user(1), _user(2)))), self.context)
+        await members.handle_status_update(Update(2, message=Message(
+            2, now, chat, left_chat_member=_user(2))), self.context)
+        await members.handle_chat_member(Update(3, chat_member=ChatMemberUpdated(
+            chat, _user(3), now, ChatMemberLeft(_user(3)), ChatMemberMember(_user(3)))), self.context)
+
+        # Updates from other chats are ignored.
+        await members.handle_status_update(Update(4, message=Message(
+            4, now, Chat(id=_OTHER_CHAT_ID, type=Chat.SUPERGROUP), new_chat_members=(_user(4),))), self.context)
+
+        self.assertTrue(members.lookup(_MAIN_CHAT_ID, 1))
+        self.assertFalse(members.lookup(_MAIN_CHAT_ID, 2))
+        self.assertTrue(members.lookup(_MAIN_CHAT_ID, 3))
+        self.assertIsNone(members.lookup(_MAIN_CHAT_ID, 4))
+        self.assertIsNone(members.lookup(_OTHER_CHAT_ID, 4))
+
+        # The roster is persistent.
+        members.load()
+        self.assertTrue(members.lookup(_MAIN_CHAT_ID, 1))
+        self.assertFalse(members.lookup(_MAIN_CHAT_ID, 2))
+        self.context.bot.get_chat_member.assert_not_called()
@@ -0,0 +1,218 @@
+"""
+Persistence of conversation states and user data in the database
+
+The application calls `update_user_data()` and `update_conversation()` for every change, every few seconds.  Changes
+are collected and written to the `bot_persistence` table in one transaction by a background task.  The task writes in
+a worker thread through a connection of its own, so neither handlers nor the event loop wait for the DB.
+
+Data of a user is only loaded when the user sends an update, see `refresh_user_data()`, so that restarting the bot does
+not read the entire table.  Data of users who have been idle for longer than PERSISTENCE_IDLE_USER_TTL_MINUTES is
+evicted from memory by `evict_idle_users()`, and is loaded again when the user comes back.  Empty user data and ended
+conversations are deleted from the table, so it only holds users who are in the middle of something.
+"""
+
+import asyncio
+import json
+import logging
+from sqlite3 import Connection
+from time import monotonic
+
+from telegram.ext import Application, BasePersistence, PersistenceInput
+
+from . import db
+from .log import LogTime
+from .settings import settings
+
+_DB_TABLE = "bot_persistence"
+_USER_DATA = "user_data"
+
+# Key of a conversation (made of chat and user IDs) and conversation states by key, as `ConversationHandler` has them
+ConversationKey = tuple[int | str, ...]
+ConversationDict = dict[ConversationKey, object]
+
+
+class SQLitePersistence(BasePersistence):
+    """Keeps user data and states of persistent conversation handlers in the DB
+
+    Chat data, bot data, and callback data are not stored.
+    """
+
+    def __init__(self):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=settings.PERSISTENCE_UPDATE_INTERVAL_SECONDS)
+
+        # Map (name, key) to JSON data to write, or to None if the row should be deleted: changes that are waiting for
+        # the next write, and ones that are being written
+        self._pending: dict[tuple[str, str], str | None] = {}
+        self._writing: dict[tuple[str, str], str | None] = {}
+        self._write_task: asyncio.Task | None = None
+        # Only one write runs at a time, through the connection that is opened for the worker thread
+        self._write_lock = asyncio.Lock()
+        self._write_connection: Connection | None = None
+
+        # IDs of users who have data in the table, and of those whose data is loaded into the application
+        self._stored_user_ids: set[int] = set()
+        self._loaded_user_ids: set[int] = set()
+        # Maps ID of a user to the last time the user was seen, see `evict_idle_users()`
+        self._last_seen: dict[int, float] = {}
+        # IDs of users that are evicted from memory, but whose data should be kept in the table
+        self._evicted_user_ids: set[int] = set()
+
+    def _stage(self, name: str, key: str, data: str | None) -> None:
+        self._pending[(name, key)] = data
+
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    def _write(self, changes: dict[tuple[str, str], str | None]) -> None:
+        """Write changes to the table, this is supposed to be run in a worker thread"""
+
+        if self._write_connection is None:
+            self._write_connection = db.connect_for_thread()
+
+        with LogTime(f"INSERT OR REPLACE INTO {_DB_TABLE}"):
+            with self._write_connection:
+                self._write_connection.executemany(
+                    f"INSERT OR REPLACE INTO {_DB_TABLE} (name, key, data) VALUES(?, ?, ?)",
+                    [(name, key, data) for (name, key), data in changes.items() if data is not None])
+                self._write_connection.executemany(
+                    f"DELETE FROM {_DB_TABLE} WHERE name=? AND key=?",
+                    [(name, key) for (name, key), data in changes.items() if data is None])
+
+    async def _write_pending(self) -> None:
+        self._write_task = None
+
+        async with self._write_lock:
+            if not self._pending:
+                return
+
+            self._writing, self._pending = self._pending, {}
+
+            # noinspection PyBroadException
+            try:
+                await asyncio.to_thread(self._write, self._writing)
+            except Exception as e:
+                logging.error("Could not write persistent data, will retry with the next change", exc_info=e)
+                # Changes staged while writing are newer than the ones that failed.
+                self._pending = self._writing | self._pending
+            finally:
+                self._writing = {}
+
+    def _select_data(self, name: str, key: str) -> str | None:
+        for changes in (self._pending, self._writing):
+            if (name, key) in changes:
+                return changes[(name, key)]
+
+        for row in db.sql_query(f"SELECT data FROM {_DB_TABLE} WHERE name=? AND key=?", (name, key)):
+            return row["data"]
+
+        return None
+
+    async def get_user_data(self) -> dict[int, dict]:
+        """Return no data, and remember which users have it: their data is loaded on demand"""
+
+        self._stored_user_ids = {int(row["key"]) for row in db.sql_query(
+            f"SELECT key FROM {_DB_TABLE} WHERE name=?", (_USER_DATA,))}
+        self._loaded_user_ids = set()
+
+        logging.info(f"{len(self._stored_user_ids)} users have persistent data")
+
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        """Load data of the user from the table if it is not in memory yet"""
+
+        self._last_seen[user_id] = monotonic()
+        self._evicted_user_ids.discard(user_id)
+
+        if user_id in self._stored_user_ids and user_id not in self._loaded_user_ids:
+            data = self._select_data(_USER_DATA, str(user_id))
+            if data is not None:
+                user_data.update(json.loads(data))
+            self._loaded_user_ids.add(user_id)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._evicted_user_ids.discard(user_id)
+
+        if data:
+            self._stored_user_ids.add(user_id)
+            self._loaded_user_ids.add(user_id)
+            self._stage(_USER_DATA, str(user_id), json.dumps(data, ensure_ascii=False))
+        elif user_id in self._stored_user_ids:
+            self._stored_user_ids.discard(user_id)
+            self._loaded_user_ids.discard(user_id)
+            self._stage(_USER_DATA, str(user_id), None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        """Delete data of the user, unless it is only evicted from memory"""
+
+        if user_id in self._evicted_user_ids:
+            self._evicted_user_ids.discard(user_id)
+            return
+
+        self._loaded_user_ids.discard(user_id)
+        if user_id in self._stored_user_ids:
+            self._stored_user_ids.discard(user_id)
+            self._stage(_USER_DATA, str(user_id), None)
+
+    def evict_idle_users(self, application: Application) -> None:
+        """Drop data of users who have been idle for too long from memory, keeping it in the table"""
+
+        oldest_time = monotonic() - settings.PERSISTENCE_IDLE_USER_TTL_MINUTES * 60
+
+        idle_user_ids = [user_id for user_id, last_seen in self._last_seen.items() if last_seen < oldest_time]
+        for user_id in idle_user_ids:
+            del self._last_seen[user_id]
+            # If the user comes back before the application calls `drop_user_data()`, the data is loaded again, and
+            # the call deletes it from the table.  The application writes it back with the next update of the user.
+            self._loaded_user_ids.discard(user_id)
+            self._evicted_user_ids.add(user_id)
+            application.drop_user_data(user_id)
+
+        if idle_user_ids:
+            logging.info(f"Evicted data of {len(idle_user_ids)} idle users from memory")
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        return {tuple(json.loads(row["key"])): json.loads(row["data"])
+                for row in db.sql_query(f"SELECT key, data FROM {_DB_TABLE} WHERE name=?", (f"conversation:{name}",))}
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: object | None) -> None:
+        self._stage(f"conversation:{name}", json.dumps(key), None if new_state is None else json.dumps(new_state))
+
+    async def flush(self) -> None:
+        """Write pending changes and close the connection used for writing"""
+
+        await self._write_pending()
+
+        async with self._write_lock:
+            if self._write_connection is not None:
+                self._write_connection.close()
+                self._write_connection = None
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data: object) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
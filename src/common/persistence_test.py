@@ -0,0 +1,108 @@
+import pathlib
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from common import db
+from common.persistence import SQLitePersistence
+
+
+class TestPersistence(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+
+        settings_patcher = patch("common.persistence.settings")
+        self.mock_settings = settings_patcher.start()
+        self.addCleanup(settings_patcher.stop)
+        self.mock_settings.PERSISTENCE_UPDATE_INTERVAL_SECONDS = 10
+        self.mock_settings.PERSISTENCE_IDLE_USER_TTL_MINUTES = 60
+
+    def tearDown(self):
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+    async def test_user_data(self):
+        persistence = SQLitePersistence()
+        self.assertDictEqual(await persistence.get_user_data(), {})
+
+        await persistence.update_user_data(1, {"occupation": "Dentist"})
+        await persistence.update_user_data(2, {"occupation": "Plumber"})
+        await persistence.update_user_data(3, {"occupation": "Baker"})
+        await persistence.update_user_data(3, {})
+        await persistence.drop_user_data(2)
+
+        # Changes are written in the background, `flush()` waits until they are.
+        await persistence.flush()
+
+        # After a restart, data is loaded only for users who come back.
+        persistence = SQLitePersistence()
+        self.assertDictEqual(await persistence.get_user_data(), {})
+
+        for user_id, expected_data in ((1, {"occupation": "Dentist"}), (2, {}), (3, {})):
+            user_data = {}
+            await persistence.refresh_user_data(user_id, user_data)
+            self.assertDictEqual(user_data, expected_data)
+
+        # Data that is already in memory is not loaded again.
+        user_data = {"occupation": "Surgeon"}
+        await persistence.refresh_user_data(1, user_data)
+        self.assertDictEqual(user_data, {"occupation": "Surgeon"})
+
+    async def test_evict_idle_users(self):
+        persistence = SQLitePersistence()
+        await persistence.get_user_data()
+
+        await persistence.refresh_user_data(1, {})
+        await persistence.update_user_data(1, {"occupation": "Dentist"})
+        await persistence.flush()
+
+        application = MagicMock()
+        persistence.evict_idle_users(application)
+        application.drop_user_data.assert_not_called()
+
+        self.mock_settings.PERSISTENCE_IDLE_USER_TTL_MINUTES = 0
+        persistence.evict_idle_users(application)
+        application.drop_user_data.assert_called_once_with(1)
+
+        # The application drops the data from memory, the persistence keeps it in the table.
+        await persistence.drop_user_data(1)
+        await persistence.flush()
+
+        user_data = {}
+        await persistence.refresh_user_data(1, user_data)
+        self.assertDictEqual(user_data, {"occupation": "Dentist"})
+
+        # A user who comes back is not treated as evicted anymore, so dropping their data deletes it.
+        persistence.evict_idle_users(application)
+        await persistence.refresh_user_data(1, {})
+        await persistence.drop_user_data(1)
+        await persistence.flush()
+
+        persistence = SQLitePersistence()
+        await persistence.get_user_data()
+        user_data = {}
+        await persistence.refresh_user_data(1, user_data)
+        self.assertDictEqual(user_data, {})
+
+    async def test_conversations(self):
+        persistence = SQLitePersistence()
+
+        await persistence.update_conversation("enroll", (10, 1), 2)
+        await persistence.update_conversation("enroll", (10, 2), 3)
+        await persistence.update_conversation("enroll", (10, 2), None)
+        await persistence.update_conversation("who", (10, 3), 0)
+
+        # All changes are written by one background task.
+        await persistence._write_task
+        self.assertIsNone(persistence._write_task)
+        self.assertDictEqual(persistence._pending, {})
+        await persistence.flush()
+
+        persistence = SQLitePersistence()
+        self.assertDictEqual(await persistence.get_conversations("enroll"), {(10, 1): 2})
+        self.assertDictEqual(await persistence.get_conversations("who"), {(10, 3): 0})
+        self.assertDictEqual(await persistence.get_conversations("retire"), {})
@@ -0,0 +1,37 @@
+"""
+Rate limiting for bursts of Bot API requests
+"""
+
+import asyncio
+from time import monotonic
+
+
+class RateLimiter:
+    """Spaces out operations so that they start at most `rate` times per second on average
+
+    Up to `burst` operations can start immediately after a quiet period, the following ones are delayed.  Every call to
+    `reserve()` books the earliest free slot, so concurrent callers of `acquire()` are served in the order they came
+    without any locks.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self._interval = 1 / rate
+        self._tolerance = (burst - 1) * self._interval
+
+        # The moment when the next slot would be free if there were no bursts allowed
+        self._next_slot = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Book a slot for an operation that is ready to start at the moment `now`, return how long it should wait"""
+
+        next_slot = max(self._next_slot, now)
+        self._next_slot = next_slot + self._interval
+
+        return max(0.0, next_slot - self._tolerance - now)
+
+    async def acquire(self) -> None:
+        """Wait until the operation may start"""
+
+        delay = self.reserve(monotonic())
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,36 @@
+import unittest
+
+from common.rate_limit import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_steady_rate(self):
+        limiter = RateLimiter(2)
+
+        self.assertListEqual([limiter.reserve(10) for _ in range(4)], [0, 0.5, 1, 1.5])
+
+        # Slots booked earlier are not given away to later callers.
+        self.assertEqual(limiter.reserve(11), 1)
+
+        # After a quiet period, an operation starts immediately.
+        self.assertEqual(limiter.reserve(20), 0)
+        self.assertEqual(limiter.reserve(20.25), 0.25)
+
+    def test_burst(self):
+        limiter = RateLimiter(1, 3)
+
+        self.assertListEqual([limiter.reserve(10) for _ in range(5)], [0, 0, 0, 1, 2])
+
+        # The burst is only available again once the operations booked earlier have passed.
+        self.assertListEqual([limiter.reserve(13) for _ in range(2)], [0, 1])
+        self.assertListEqual([limiter.reserve(30) for _ in range(4)], [0, 0, 0, 1])
+
+
+class TestRateLimiterAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_acquire(self):
+        limiter = RateLimiter(1000, 2)
+
+        for _ in range(5):
+            await limiter.acquire()
+
+        self.assertGreater(limiter.reserve(0), 0)
@@ -58,6 +58,17 @@ class Settings:
         #
         # Default is empty list.
         self.ADMINISTRATORS = []
+        # How long, in hours, the bot trusts its own record of whether a user is a member of the main or moderation
+        # chat.  Records are updated when users join or leave, and older ones are verified with Telegram.  Default is
+        # 168.
+        self.CHAT_MEMBERS_MAX_AGE_HOURS = 168
+        # How often, in seconds, the bot saves the states of conversations and the data users entered in them, so that
+        # they survive a restart.  Default is 10.
+        self.PERSISTENCE_UPDATE_INTERVAL_SECONDS = 10
+        # How long, in minutes, the bot keeps the data of an idle user in memory.  The data stays in the DB and is
+        # loaded again when the user comes back.  0 keeps the data in memory for as long as the bot runs.  Default is
+        # 60.
+        self.PERSISTENCE_IDLE_USER_TTL_MINUTES = 60
 
         # --------------------------------------------------------------------------------------------------------------
         # Internationalisation
@@ -97,8 +108,13 @@ class Settings:
         self.SERVICES_OCCUPATION_MAX_LENGTH = 30
         # Maximum length of the Description.  0 means no limit (not recommended).  Default is 1000.
         self.SERVICES_DESCRIPTION_MAX_LENGTH = 1000
+        # Maximum number of services shown in search results.  Default is 20.
+        self.SERVICES_SEARCH_MAX_RESULTS = 20
         # Whether to include administrators into statistics report.  Default is false.
         self.SERVICES_STATS_INCLUDE_ADMINISTRATORS = False
+        # How often to save views of categories and services to the DB, in seconds.  Views are kept in memory until
+        # then.  Default is 60.
+        self.SERVICES_STATS_FLUSH_INTERVAL_SECONDS = 60
         # How often to ask service providers if their services are still offered.  Default is 60.
         self.SERVICES_PROVIDER_PING_PERIOD_DAYS = 60
         # At which time of the day to ping providers.  UTC timezone is used.  Default is 12.
@@ -107,6 +123,14 @@ class Settings:
         self.SERVICES_PING_ATTEMPT_COUNT = 3
         # Interval in days between pings.  Default is 2.
         self.SERVICES_PING_ATTEMPTS_INTERVAL_DAYS = 2
+        # Number of parts that providers are split into for checking whether they are still in the main chat.  The parts
+        # are checked one after another at equal intervals through the day, starting at SERVICES_PROVIDER_PING_HOUR, so
+        # that requests to Telegram do not bunch up.  1 means that all providers are checked at once.  Default is 4.
+        self.SERVICES_PROVIDER_CHECK_SHARD_COUNT = 4
+        # How many providers are checked simultaneously.  Default is 5.
+        self.SERVICES_PROVIDER_CHECK_CONCURRENCY = 5
+        # Maximum number of requests to Telegram per second made while checking providers.  Default is 10.
+        self.SERVICES_PROVIDER_CHECK_REQUESTS_PER_SECOND = 10
 
         # --------------------------------------------------------------------------------------------------------------
         # Greeting new users
@@ -155,14 +179,16 @@ class Settings:
         # the good user before sending spam.  Therefore, to eliminate most spam, it should be enough to evaluate the
         # first message a new user sends to the group.
 
-        # Enabled layers of spam detection.  Can be any combination of: emojis, keywords, openai, prompt.  Order does
-        # not make any difference.  The `prompt` layer uses an LLM prompt (reasoning model) to classify the first
-        # message of a new user as spam or not.  The `openai` layer uses an embedding-based SVM model.  Both layers
-        # require ANTISPAM_OPENAI_API_KEY to be set.  Example:
+        # Enabled layers of spam detection.  Can be any combination of: emojis, keywords, minhash, openai, prompt.
+        # Order does not make any difference.  The `prompt` layer uses an LLM prompt (reasoning model) to classify the
+        # first message of a new user as spam or not.  The `openai` layer uses an embedding-based SVM model.  Both
+        # layers require ANTISPAM_OPENAI_API_KEY to be set.  The `minhash` layer compares the message with spam
+        # detected before, and catches spam that was slightly changed.  Example:
         #
         # ANTISPAM_ENABLED:
         # - prompt
         # - openai
+        # - minhash
         # - emojis
         # - keywords
         #
@@ -174,6 +200,67 @@ class Settings:
         self.ANTISPAM_OPENAI_API_KEY = ""
         # Confidence threshold for the OpenAI model.  Default is 0.5.
         self.ANTISPAM_OPENAI_CONFIDENCE_THRESHOLD = 0.5
+        # Messages that the OpenAI model should evaluate are collected for this number of milliseconds after the first
+        # one arrives, and then evaluated together in one request.  Default is 20.
+        self.ANTISPAM_OPENAI_BATCH_DELAY_MS = 20
+        # Maximum number of messages that the OpenAI model evaluates in one request.  Default is 64.
+        self.ANTISPAM_OPENAI_BATCH_SIZE = 64
+        # First messages of new users are put to a queue and screened by a pool of workers, so that slow layers do not
+        # pile up during bursts.  Number of workers.  Default is 4.
+        self.ANTISPAM_WORKER_COUNT = 4
+        # Maximum number of messages waiting in the screening queue.  Default is 100.
+        self.ANTISPAM_QUEUE_SIZE = 100
+        # What to do with a message when the screening queue is full: "cheap" to screen it at once with the local layers
+        # only (see raid mode below), or "hold" to wait until there is room in the queue, leaving the message visible
+        # until it is screened.  Default is "cheap".
+        self.ANTISPAM_QUEUE_OVERFLOW_POLICY = "cheap"
+        # The allowlist of users whose messages are not checked is kept in memory.  If it has more users than this
+        # number, it is stored in a compact form that takes less memory but is slightly slower to look up.  0 means that
+        # the compact form is never used.  Default is 100000.
+        self.ANTISPAM_ALLOWLIST_COMPACT_THRESHOLD = 100000
+        # For how long to remember texts classified as spam.  During a spam wave, the same text posted by other new
+        # users is deleted at once without going through the detection layers again.  0 disables this.  Default is 30.
+        self.ANTISPAM_VERDICT_CACHE_TTL_MINUTES = 30
+        # Minimum similarity between a message and a known spam text for the `minhash` layer to classify the message as
+        # spam, from 0 to 1.  Default is 0.7.
+        self.ANTISPAM_MINHASH_SIMILARITY_THRESHOLD = 0.7
+        # Shadow layers are evaluated after the real verdict, and do not affect it.  Their results are saved next to the
+        # real verdict and compared to it in the antispam statistics, which makes it possible to try new layers,
+        # thresholds, or models without risk.  Each shadow layer has a unique name and a type, which is one of the
+        # layers listed for ANTISPAM_ENABLED.  Optional threshold overrides the respective setting of the layer (for
+        # the emojis layer, it is the maximum number of custom emojis).  An openai layer may also have a model file
+        # located in the data directory.  Shadow layers are not evaluated in raid mode.  Example:
+        #
+        # ANTISPAM_SHADOW_LAYERS:
+        # - name: openai-strict
+        #   layer: openai
+        #   threshold: 0.3
+        # - name: openai-candidate
+        #   layer: openai
+        #   model: antispam_openai_candidate.joblib
+        # - name: minhash
+        #   layer: minhash
+        #
+        # Default is empty list.
+        self.ANTISPAM_SHADOW_LAYERS = []
+
+        # Raid is a situation when many new users join the group and post at once.  During a raid, the bot switches to
+        # raid mode: it only uses the local layers (emojis, keywords, and minhash) with the stricter thresholds below,
+        # the emojis layer is always on, users whose messages look good are not added to the allowlist, and greetings
+        # are not shown.  Administrators are notified when raid mode is switched on and off.
+
+        # Length of the sliding window for counting joins and first messages, in seconds.  Default is 60.
+        self.ANTISPAM_RAID_WINDOW_SECONDS = 60
+        # Number of users joining within the window that starts raid mode.  0 means that joins are not counted.  Raid
+        # mode ends when both numbers drop below half of their thresholds.  Default is 20.
+        self.ANTISPAM_RAID_JOIN_THRESHOLD = 20
+        # Number of first messages of new users within the window that starts raid mode.  0 means that first messages
+        # are not counted.  Default is 10.
+        self.ANTISPAM_RAID_FIRST_MESSAGE_THRESHOLD = 10
+        # Maximum number of custom emojis in a message in raid mode.  Default is 1.
+        self.ANTISPAM_RAID_EMOJIS_MAX_CUSTOM_EMOJI_COUNT = 1
+        # Similarity threshold of the `minhash` layer in raid mode.  Default is 0.5.
+        self.ANTISPAM_RAID_MINHASH_SIMILARITY_THRESHOLD = 0.5
 
         # --------------------------------------------------------------------------------------------------------------
         # Glossary
@@ -0,0 +1,81 @@
+"""
+Micro-batching of requests that are cheaper to process together
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collects items submitted by concurrent callers and processes them in batches
+
+    The first submitted item starts a timer.  When it fires, or when `max_size` items have been collected, all pending
+    items are passed to `process` at once, and each caller gets the result that corresponds to their item.  If `process`
+    raises an exception, every caller of that batch gets it.
+    """
+
+    def __init__(self, process: Callable[[list], Awaitable[Sequence]], max_delay_ms: float, max_size: int):
+        """Construct the batcher
+
+        @param process: coroutine function that takes a list of items and returns a sequence of results of the same
+        length, in the same order
+        @param max_delay_ms: how long to wait for more items after the first one arrived, in milliseconds
+        @param max_size: maximum number of items in a batch
+        """
+
+        self._process = process
+        self._max_delay = max_delay_ms / 1000
+        self._max_size = max_size
+
+        self._pending: list[tuple[object, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        # Strong references to running batches, otherwise the event loop may garbage-collect them.
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item):
+        """Add `item` to the next batch and return its result when the batch is processed"""
+
+        loop = asyncio.get_running_loop()
+
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._max_delay, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[object, asyncio.Future]]) -> None:
+        logger.info(f"Processing a batch of {len(batch)} item(s)")
+
+        try:
+            results = await self._process([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Got {len(results)} result(s) for a batch of {len(batch)} item(s)")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
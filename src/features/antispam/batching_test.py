@@ -0,0 +1,61 @@
+"""
+Tests for batching.py
+"""
+
+import asyncio
+import unittest
+
+from .batching import MicroBatcher
+
+
+class TestMicroBatcher(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.batches = []
+
+    async def _double(self, items: list) -> list:
+        self.batches.append(items)
+        return [item * 2 for item in items]
+
+    async def test_concurrent_items_go_in_one_batch(self):
+        batcher = MicroBatcher(self._double, 10, 100)
+
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertEqual(self.batches, [[0, 1, 2, 3, 4]])
+
+    async def test_size_cap(self):
+        batcher = MicroBatcher(self._double, 10000, 2)
+
+        results = await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(4))), 1)
+
+        self.assertEqual(results, [0, 2, 4, 6])
+        self.assertEqual(self.batches, [[0, 1], [2, 3]])
+
+    async def test_sequential_items_go_in_separate_batches(self):
+        batcher = MicroBatcher(self._double, 1, 100)
+
+        self.assertEqual(await batcher.submit(1), 2)
+        self.assertEqual(await batcher.submit(2), 4)
+        self.assertEqual(self.batches, [[1], [2]])
+
+    async def test_exception(self):
+        async def fail(_items: list) -> list:
+            raise ValueError("Failed")
+
+        batcher = MicroBatcher(fail, 1, 100)
+
+        results = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+
+    async def test_wrong_result_count(self):
+        async def drop_one(items: list) -> list:
+            return items[1:]
+
+        batcher = MicroBatcher(drop_one, 1, 100)
+
+        with self.assertRaises(RuntimeError):
+            await asyncio.gather(batcher.submit(1), batcher.submit(2))
@@ -0,0 +1,883 @@
+"""
+Antispam
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import string
+from time import monotonic, perf_counter
+
+import joblib
+import numpy as np
+import telegram
+from openai import AsyncOpenAI
+from telegram import InlineKeyboardButton, Update
+from telegram.ext import Application, CallbackQueryHandler, ConversationHandler, ContextTypes, filters, MessageHandler
+
+from common import db, i18n
+from common.admin import get_main_keyboard, register_buttons, save_file_with_backup
+from common.bot import reply, send
+from common.checks import is_admin
+from common.messaging_helpers import delete_message, safe_delete_message
+from common.settings import settings
+from . import batching, minhash, raid, shadow
+
+
+KEYWORDS_FILENAME = "antispam_keywords.txt"
+KEYWORDS_FILE_PATH = settings.data_dir / KEYWORDS_FILENAME
+
+OPENAI_FILE_PATH = settings.data_dir / "antispam_openai.joblib"
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+# Number of dimensions in embeddings returned by `OPENAI_EMBEDDING_MODEL`, used for the probe embedding when the model
+# does not tell how many features it expects.
+OPENAI_EMBEDDING_DIMENSIONS = 1536
+
+# Admin keyboard commands
+(ADMIN_DOWNLOAD_SPAM, ADMIN_DOWNLOAD_KEYWORDS, ADMIN_UPLOAD_KEYWORDS, ADMIN_UPLOAD_OPENAI, ADMIN_STATS) = (
+    "antispam-download-spam", "antispam-download-keywords", "antispam-upload-keywords", "antispam-upload-openai",
+    "antispam-stats")
+ADMIN_UPLOADING_KEYWORDS, ADMIN_UPLOADING_OPENAI = range(2)
+
+logger = logging.getLogger(__name__)
+
+keywords = None
+spam_index = None
+openai_model = None
+_openai_model_lock = asyncio.Lock()
+
+# Verdicts for texts recently classified as spam: maps hash of the normalised text to a tuple of expiration time (in
+# terms of `monotonic()`), layers that detected spam, and confidence.
+_verdict_cache: dict[str, tuple[float, str, float]] = {}
+_verdict_cache_hits = 0
+
+_raid_detector = raid.RaidDetector(settings.ANTISPAM_RAID_WINDOW_SECONDS, settings.ANTISPAM_RAID_JOIN_THRESHOLD,
+                                   settings.ANTISPAM_RAID_FIRST_MESSAGE_THRESHOLD)
+# How often to check whether a raid is over, in seconds
+_RAID_CHECK_INTERVAL = 10
+_RAID_CHECK_JOB_NAME = "antispam-raid-check"
+
+# Layers that can be used as shadow layers, see ANTISPAM_SHADOW_LAYERS
+_SHADOW_LAYER_KINDS = ('emojis', 'keywords', 'minhash', 'openai', 'prompt')
+# Models of shadow `openai` layers, by file name
+_shadow_models = {}
+# Strong references to running evaluations of shadow layers, otherwise the event loop may garbage-collect them.
+_shadow_tasks: set[asyncio.Task] = set()
+
+# First messages of new users waiting for screening, with their contexts, futures for the verdicts, and the time when
+# they were enqueued
+_screening_queue = asyncio.Queue(settings.ANTISPAM_QUEUE_SIZE)
+_screening_workers: list[asyncio.Task] = []
+_screened_count = 0
+_total_wait = 0.0
+_max_wait = 0.0
+_max_queue_depth = 0
+_overflow_count = 0
+
+# Evaluations of messages from new users that are in progress: maps user ID to a future that gets the verdict, which is
+# True for spam, False for a good message, and None if the evaluation failed.
+_evaluations: dict[int, asyncio.Future] = {}
+
+
+def detect_keywords(text: str) -> bool:
+    """Detect spam using keywords"""
+
+    global keywords
+
+    if keywords is None:
+        logger.info("Loading the list of keywords")
+        keywords = []
+        with open(KEYWORDS_FILE_PATH) as f:
+            for line in f.readlines():
+                keywords.append(line.strip())
+
+    text_processed = [word.strip(string.punctuation) for word in text.lower().split()]
+
+    result = any([bad_kw in text_processed for bad_kw in keywords])
+    logger.info("Keywords found: {result}".format(result=result))
+
+    return result
+
+
+def get_keywords() -> io.BytesIO:
+    """Return contents of the actual keywords file"""
+
+    with open(KEYWORDS_FILE_PATH, "rb") as inp:
+        data = io.BytesIO(inp.read())
+        return data
+
+
+def detect_emojis(message: telegram.Message, max_custom_emoji_count: int) -> bool:
+    """Detect spam that uses more than `max_custom_emoji_count` custom emojis"""
+
+    if not hasattr(message, "entities"):
+        return False
+
+    custom_emoji_count = 0
+    for e in message.entities:
+        if e.type == telegram.MessageEntity.CUSTOM_EMOJI:
+            custom_emoji_count += 1
+            if custom_emoji_count > max_custom_emoji_count:
+                return True
+    return False
+
+
+def _load_openai_model(source) -> tuple[object, float]:
+    """Load the OpenAI model from `source` (a path or a file object) and make sure that it can make predictions
+
+    Unpickling a big model takes long, so this function is supposed to be run in a worker thread.  Returns the model and
+    the time in milliseconds it took to load and check it.  Raises an exception if the model could not be loaded, or if
+    it does not return a sane prediction for a probe embedding.
+    """
+
+    started_at = perf_counter()
+
+    model = joblib.load(source)
+
+    dimensions = getattr(model, "n_features_in_", OPENAI_EMBEDDING_DIMENSIONS)
+    probe = np.full((1, dimensions), 1 / np.sqrt(dimensions))
+    prediction = np.asarray(model.predict_proba(probe))
+    if prediction.shape != (1, 2) or not np.all(np.isfinite(prediction)):
+        raise ValueError(f"The model returned {prediction} for the probe embedding")
+
+    return model, (perf_counter() - started_at) * 1000
+
+
+async def _get_openai_model():
+    """Return the OpenAI model, loading it from the file in a worker thread if it is not loaded yet"""
+
+    global openai_model
+
+    if openai_model is None:
+        async with _openai_model_lock:
+            if openai_model is None:
+                logger.info("Loading the OpenAI model")
+                model, load_time = await asyncio.to_thread(_load_openai_model, OPENAI_FILE_PATH)
+                logger.info(f"Loaded the OpenAI model in {load_time:.3f} ms")
+                openai_model = model
+
+    return openai_model
+
+
+async def _preload_openai_model() -> None:
+    """Load the OpenAI model in background, logging errors rather than leaving them to the task"""
+
+    # noinspection PyBroadException
+    try:
+        await _get_openai_model()
+    except Exception as e:
+        logger.error("Could not load the OpenAI model", exc_info=e)
+
+
+async def _detect_openai_batch(texts: list[str]) -> list[float]:
+    """Detect spam in several texts using the OpenAI model
+
+    Embeddings for all texts are requested at once, and the model evaluates all of them in one call.  Returns spam
+    probabilities in the same order as `texts`.
+    """
+
+    model = await _get_openai_model()
+
+    return [float(p) for p in model.predict_proba(await _embed(texts))[:, 1]]
+
+
+async def _embed(texts: list[str]) -> np.ndarray:
+    """Return embeddings of `texts` as rows of a matrix"""
+
+    client = AsyncOpenAI(api_key=settings.ANTISPAM_OPENAI_API_KEY)
+
+    response = await client.embeddings.create(input=texts, model=OPENAI_EMBEDDING_MODEL)
+
+    return np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)])
+
+
+_openai_batcher = batching.MicroBatcher(_detect_openai_batch, settings.ANTISPAM_OPENAI_BATCH_DELAY_MS,
+                                        settings.ANTISPAM_OPENAI_BATCH_SIZE)
+
+
+async def detect_openai(text: str) -> float:
+    """Detect spam using the OpenAI model
+
+    Returns probability of `text` being spam.  Texts that come at nearly the same time are evaluated together, see
+    `_detect_openai_batch()`.
+    """
+
+    return await _openai_batcher.submit(text)
+
+
+async def detect_prompt(text: str) -> bool:
+    """Detect spam using an LLM prompt (reasoning model)
+
+    Returns True if the model classifies the message as spam.
+    """
+
+    client = AsyncOpenAI(api_key=settings.ANTISPAM_OPENAI_API_KEY)
+
+    completion = await client.chat.completions.create(
+        model="gpt-5.2",
+        reasoning_effort="low",
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "You are a spam detector for a Telegram group dedicated to expat life in Galicia, Spain. "
+                    "You will receive the first message of a new group member. "
+                    "Classify whether it is spam.\n\n"
+                    "The following content counts as spam:\n"
+                    "- Promotion of easy money earning (e.g. work-from-home schemes, passive income, MLM)\n"
+                    "- Promotion of services obviously irrelevant to Galicia or Spain\n"
+                    "- Promotion of cryptocurrency exchange or investment\n\n"
+                    "Reply ONLY with valid JSON in the form: "
+                    '{"reasoning": "<brief explanation>", "value": true or false}'
+                ),
+            },
+            {
+                "role": "user",
+                "content": text,
+            },
+        ],
+    )
+
+    raw = completion.choices[0].message.content
+    try:
+        result = json.loads(raw)
+        value = result.get("value")
+        if isinstance(value, bool):
+            is_spam_flag = value
+        elif isinstance(value, str) and value.lower() in ("true", "false"):
+            is_spam_flag = value.lower() == "true"
+        else:
+            raise ValueError("Invalid or missing 'value' field in antispam response")
+        logger.info(
+            "Prompt detection result: reasoning={r}, value={v}".format(
+                r=result.get("reasoning", ""), v=is_spam_flag
+            )
+        )
+        return is_spam_flag
+
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+        logger.error(
+            "Could not parse prompt detection response: {raw}".format(raw=raw),
+            exc_info=e,
+        )
+        return False
+
+
+async def save_new_openai(data: io.BytesIO) -> float | None:
+    """Tries to load the new OpenAI model from `data`
+
+    The model is loaded and checked in a worker thread, and then replaces the current one.  Returns time in milliseconds
+    it took to load and check the new model, or None if the model could not be used.  On failure, the existing model is
+    preserved.
+    """
+
+    data.seek(0)
+    # noinspection PyBroadException
+    try:
+        new_model, load_time = await asyncio.to_thread(_load_openai_model, data)
+    except Exception as e:
+        logger.error("Could not load the new OpenAI model", exc_info=e)
+        return None
+
+    def write_file() -> None:
+        # Write to a temporary file first so that the old model stays in place if writing fails.
+        new_path = OPENAI_FILE_PATH.with_suffix(".new")
+        with open(new_path, "wb") as out_file:
+            out_file.write(data.getbuffer())
+        os.replace(new_path, OPENAI_FILE_PATH)
+
+    global openai_model
+
+    # A lazy load of the old file that is in progress would otherwise finish after the swap and put the old model back.
+    async with _openai_model_lock:
+        await asyncio.to_thread(write_file)
+        openai_model = new_model
+
+    return load_time
+
+
+def _build_spam_index() -> None:
+    """Build the index of known spam texts used by the `minhash` layer from the `spam` table"""
+
+    global spam_index
+
+    started_at = perf_counter()
+
+    spam_index = minhash.MinHashIndex()
+    for record in db.spam_select_all():
+        if record["text"] and record["text"].strip():
+            spam_index.add(record["text"])
+
+    logger.info(f"Built the index of {len(spam_index)} spam texts in {(perf_counter() - started_at) * 1000:.3f} ms")
+
+
+def _record_spam(text: str, from_user_tg_id: int, trigger: str, confidence: float) -> None:
+    """Save a message that has been classified as spam, and add it to the index of known spam texts"""
+
+    db.spam_insert(text, from_user_tg_id, trigger, confidence)
+
+    if spam_index is not None:
+        spam_index.add(text)
+
+
+def _text_hash(text: str) -> str:
+    """Return hash of `text` normalised so that changes in case and whitespace do not affect it"""
+
+    return hashlib.sha256(" ".join(text.casefold().split()).encode("utf-8")).hexdigest()
+
+
+def _cache_verdict(text: str, layers: str, confidence: float) -> None:
+    """Remember that `text` has been classified as spam by `layers`
+
+    The verdict is kept for `ANTISPAM_VERDICT_CACHE_TTL_MINUTES`.  Expired verdicts are dropped here, which is enough to
+    keep the cache small because new verdicts are only added when spam is detected.
+    """
+
+    if settings.ANTISPAM_VERDICT_CACHE_TTL_MINUTES <= 0:
+        return
+
+    now = monotonic()
+
+    for key in [key for key, (expires_at, _, _) in _verdict_cache.items() if expires_at <= now]:
+        del _verdict_cache[key]
+
+    _verdict_cache[_text_hash(text)] = (now + settings.ANTISPAM_VERDICT_CACHE_TTL_MINUTES * 60, layers, confidence)
+
+
+def _get_cached_verdict(text: str) -> tuple[str, float] | None:
+    """Return layers and confidence of a recent spam verdict for `text`, or None if there is none"""
+
+    global _verdict_cache_hits
+
+    key = _text_hash(text)
+    if key not in _verdict_cache:
+        return None
+
+    expires_at, layers, confidence = _verdict_cache[key]
+    if expires_at <= monotonic():
+        del _verdict_cache[key]
+        return None
+
+    _verdict_cache_hits += 1
+
+    return layers, confidence
+
+
+async def is_spam(message: telegram.Message, cheap: bool = False) -> bool:
+    """Evaluates `text` and returns whether it looks like spam
+
+    The evaluation is two-step: first the keywords are looked for, and if there were any, the OpenAI model is called.
+    Only messages that tested positive on both levels are classified as spam.
+
+    If `cheap` is true (in raid mode, or when the screening queue overflows), only the local layers are used, with
+    stricter thresholds, and the emojis layer is always on.
+    """
+
+    user = message.from_user
+
+    if not hasattr(message, "text"):
+        logger.warning("A message from user ID {n} (ID {i}) does not have text, cannot detect spam".format(i=user.id,
+                                                                                                           n=user.full_name))
+        return False
+
+    cached_verdict = _get_cached_verdict(message.text)
+    if cached_verdict is not None:
+        cached_layers, confidence = cached_verdict
+        logger.info("SPAM in a message from user {n} (ID {i}) repeats a recent spam message detected by {l}.".format(
+            i=user.id, l=cached_layers, n=user.full_name))
+
+        # The text is in the index of known spam texts already, as it was recorded when the verdict was cached.
+        db.spam_insert(message.text, user.id, f"cache:{cached_layers}", confidence)
+
+        return True
+
+    layers = []
+    confidence = 0
+
+    if 'keywords' in settings.ANTISPAM_ENABLED and detect_keywords(message.text):
+        confidence = 1
+        layers.append('keywords')
+
+    if cheap:
+        if detect_emojis(message, settings.ANTISPAM_RAID_EMOJIS_MAX_CUSTOM_EMOJI_COUNT):
+            confidence = 1
+            layers.append('emojis')
+    elif 'emojis' in settings.ANTISPAM_ENABLED and detect_emojis(message,
+                                                                  settings.ANTISPAM_EMOJIS_MAX_CUSTOM_EMOJI_COUNT):
+        confidence = 1
+        layers.append('emojis')
+
+    if 'minhash' in settings.ANTISPAM_ENABLED:
+        similarity = spam_index.similarity(message.text)
+        if similarity >= (settings.ANTISPAM_RAID_MINHASH_SIMILARITY_THRESHOLD if cheap else
+                          settings.ANTISPAM_MINHASH_SIMILARITY_THRESHOLD):
+            confidence = similarity
+            layers.append('minhash')
+
+    if not cheap:
+        if 'openai' in settings.ANTISPAM_ENABLED:
+            confidence = await detect_openai(message.text)
+            if confidence > settings.ANTISPAM_OPENAI_CONFIDENCE_THRESHOLD:
+                layers.append('openai')
+
+        if 'prompt' in settings.ANTISPAM_ENABLED and await detect_prompt(message.text):
+            confidence = 1
+            layers.append('prompt')
+
+    if len(layers) == 0:
+        return False
+
+    logger.info(
+        "SPAM in a message from user ID {n} (ID {i}).  Layer(s): {l}.  Confidence: {c}.".format(c=confidence, i=user.id,
+                                                                                                l=", ".join(layers),
+                                                                                                n=user.full_name))
+
+    _record_spam(message.text, user.id, ", ".join(layers), confidence)
+
+    _cache_verdict(message.text, ", ".join(layers), confidence)
+
+    return True
+
+
+async def _evaluate_shadow_layer(layer: dict, message: telegram.Message, spam_index_size: int) -> tuple[bool, float]:
+    """Evaluate `message` with a shadow `layer` and return the verdict and the confidence
+
+    `spam_index_size` is the size of the spam index before the real verdict was made, so that the `minhash` layer does
+    not find the message itself if it has been classified as spam.
+    """
+
+    kind, threshold = layer["layer"], layer.get("threshold")
+
+    if kind == 'keywords':
+        verdict = detect_keywords(message.text)
+        return verdict, float(verdict)
+
+    if kind == 'emojis':
+        verdict = detect_emojis(message, settings.ANTISPAM_EMOJIS_MAX_CUSTOM_EMOJI_COUNT if threshold is None else
+                                threshold)
+        return verdict, float(verdict)
+
+    if kind == 'minhash':
+        similarity = spam_index.similarity(message.text, spam_index_size)
+        return similarity >= (settings.ANTISPAM_MINHASH_SIMILARITY_THRESHOLD if threshold is None else
+                              threshold), similarity
+
+    if kind == 'openai':
+        if "model" in layer:
+            if layer["model"] not in _shadow_models:
+                _shadow_models[layer["model"]], _ = await asyncio.to_thread(_load_openai_model,
+                                                                            settings.data_dir / layer["model"])
+            model = _shadow_models[layer["model"]]
+        else:
+            model = await _get_openai_model()
+        confidence = float(model.predict_proba(await _embed([message.text]))[0][1])
+        return confidence > (settings.ANTISPAM_OPENAI_CONFIDENCE_THRESHOLD if threshold is None else
+                             threshold), confidence
+
+    if kind == 'prompt':
+        verdict = await detect_prompt(message.text)
+        return verdict, float(verdict)
+
+    raise ValueError(f"Unknown shadow layer {kind}")
+
+
+async def _run_shadow_layers(message: telegram.Message, verdict: bool, spam_index_size: int) -> None:
+    """Evaluate `message` with all shadow layers and record the results next to the real `verdict`"""
+
+    for layer in settings.ANTISPAM_SHADOW_LAYERS:
+        started_at = perf_counter()
+        try:
+            shadow_verdict, confidence = await _evaluate_shadow_layer(layer, message, spam_index_size)
+        except Exception as e:
+            logger.error(f"Exception while evaluating shadow layer {layer['name']}:", exc_info=e)
+            continue
+        latency_ms = (perf_counter() - started_at) * 1000
+
+        shadow.record(message.text, message.from_user.id, verdict, layer["name"], shadow_verdict, confidence,
+                      latency_ms)
+
+
+def _validate_shadow_layers() -> None:
+    """Make sure that ANTISPAM_SHADOW_LAYERS can be used, raise an exception otherwise"""
+
+    names = set()
+    for layer in settings.ANTISPAM_SHADOW_LAYERS:
+        if not layer.get("name") or layer["name"] in names:
+            raise RuntimeError(f"Shadow layer {layer} must have a unique name")
+        if layer.get("layer") not in _SHADOW_LAYER_KINDS:
+            raise RuntimeError(f"Shadow layer {layer['name']} has unknown type, expected one of {_SHADOW_LAYER_KINDS}")
+        if "model" in layer and layer["layer"] != 'openai':
+            raise RuntimeError(f"Shadow layer {layer['name']} cannot have a model, only openai layers can")
+        names.add(layer["name"])
+
+
+def is_raid_in_progress() -> bool:
+    """Return whether the bot is in raid mode"""
+
+    return _raid_detector.is_active
+
+
+async def _update_raid_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Re-evaluate whether there is a raid, and notify the administrators if the raid mode has been switched"""
+
+    if not _raid_detector.update(monotonic()):
+        return
+
+    trans = i18n.default()
+
+    if _raid_detector.is_active:
+        logger.warning(f"Raid detected: {_raid_detector.join_count} joins and {_raid_detector.first_message_count} "
+                       f"first messages within {settings.ANTISPAM_RAID_WINDOW_SECONDS} seconds")
+
+        text = trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_RAID_STARTED {joins} {messages} {seconds}").format(
+            joins=_raid_detector.join_count, messages=_raid_detector.first_message_count,
+            seconds=settings.ANTISPAM_RAID_WINDOW_SECONDS)
+
+        # The raid should end even if nobody joins or posts anymore, hence the periodic check.
+        if not context.job_queue.get_jobs_by_name(_RAID_CHECK_JOB_NAME):
+            context.job_queue.run_repeating(_check_raid, _RAID_CHECK_INTERVAL, name=_RAID_CHECK_JOB_NAME)
+    else:
+        logger.warning("The raid is over")
+
+        text = trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_RAID_ENDED")
+
+    for admin_id in [a["id"] for a in settings.ADMINISTRATORS] if settings.ADMINISTRATORS else (
+            settings.DEVELOPER_CHAT_ID,):
+        await send(context, admin_id, text)
+
+
+async def _check_raid(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await _update_raid_state(context)
+
+    if not _raid_detector.is_active:
+        context.job.schedule_removal()
+
+
+async def handle_new_members(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Count users that join the main chat for raid detection"""
+
+    if update.effective_chat.id != settings.MAIN_CHAT_ID:
+        return
+
+    count = len([user for user in update.message.new_chat_members if not user.is_bot])
+    if count == 0:
+        return
+
+    _raid_detector.register_join(monotonic(), count)
+    await _update_raid_state(context)
+
+
+async def _screen(context: ContextTypes.DEFAULT_TYPE, message: telegram.Message, evaluation: asyncio.Future,
+                  cheap: bool) -> None:
+    """Evaluate the first message of a new user, take appropriate action, and set the verdict to `evaluation`
+
+    If `cheap` is true, or if there is a raid, only the local layers are used, see `is_spam()`.
+    """
+
+    user = message.from_user
+
+    spam_index_size = len(spam_index) if spam_index is not None else 0
+
+    verdict = None
+    cheap = cheap or _raid_detector.is_active
+    try:
+        verdict = await is_spam(message, cheap)
+        if not verdict:
+            if cheap:
+                # Only the local layers were used, so the user is not allowlisted and will be checked again.
+                logger.info("The first message from user {full_name} (ID {id}) looks good, but only the local layers "
+                            "were used".format(full_name=user.full_name, id=user.id))
+            else:
+                logger.info("The first message from user {full_name} (ID {id}) looks good".format(
+                    full_name=user.full_name, id=user.id))
+                db.register_good_member(user.id)
+    except Exception as e:
+        logger.error("Exception while trying to detect spam:", exc_info=e)
+
+        await send(context, settings.DEVELOPER_CHAT_ID, f"Exception caught while analysing spam: {str(e)}")
+    finally:
+        del _evaluations[user.id]
+        evaluation.set_result(verdict)
+
+    if settings.ANTISPAM_SHADOW_LAYERS and verdict is not None and not cheap:
+        # Shadow layers are evaluated in background, after the real verdict has been acted on.
+        task = asyncio.create_task(_run_shadow_layers(message, verdict, spam_index_size))
+        _shadow_tasks.add(task)
+        task.add_done_callback(_shadow_tasks.discard)
+
+    if not verdict:
+        return
+
+    await safe_delete_message(context, message.id, message.chat.id)
+
+    if _raid_detector.is_active:
+        # Do not flood the chat with notices during a raid.
+        return
+
+    if settings.BOT_IS_MALE:
+        delete_notice = i18n.default().gettext("ANTISPAM_MESSAGE_MC_SPAM_DETECTED_M {username}")
+    else:
+        delete_notice = i18n.default().gettext("ANTISPAM_MESSAGE_MC_SPAM_DETECTED_F {username}")
+
+    posted_message = await send(context, settings.MAIN_CHAT_ID, delete_notice.format(
+        username=message.from_user.full_name), disable_notification=True)
+    context.job_queue.run_once(delete_message, 15, data=(posted_message, False))
+
+
+async def _screening_worker() -> None:
+    """Take messages from the screening queue one by one and screen them"""
+
+    global _screened_count, _total_wait, _max_wait
+
+    while True:
+        context, message, evaluation, enqueued_at = await _screening_queue.get()
+
+        wait = monotonic() - enqueued_at
+        _screened_count += 1
+        _total_wait += wait
+        _max_wait = max(_max_wait, wait)
+
+        # noinspection PyBroadException
+        try:
+            await _screen(context, message, evaluation, False)
+        except Exception as e:
+            logger.error("Exception while screening a message:", exc_info=e)
+        finally:
+            _screening_queue.task_done()
+
+
+def _start_screening_workers() -> None:
+    """Start the screening workers unless they are running already
+
+    The workers are started on demand rather than in `post_init()`, because they need the event loop of the running
+    application.  Workers that have stopped for any reason are replaced.
+    """
+
+    _screening_workers[:] = [worker for worker in _screening_workers if not worker.done()]
+
+    while len(_screening_workers) < settings.ANTISPAM_WORKER_COUNT:
+        _screening_workers.append(asyncio.create_task(_screening_worker()))
+
+
+async def detect_spam(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Detect spam and take appropriate action
+
+    First messages of new users are put to the screening queue, where they are picked up by a pool of workers.  If the
+    queue is full, ANTISPAM_QUEUE_OVERFLOW_POLICY tells what to do.
+    """
+
+    global _max_queue_depth, _overflow_count
+
+    if update.effective_message is None:
+        logger.warning("The update does not have any message, cannot detect spam")
+        return
+    message = update.effective_message
+    user = message.from_user
+
+    if message.chat_id != settings.MAIN_CHAT_ID:
+        # The message does not belong to the main chat, will not detect spam.
+        return
+
+    if db.is_good_member(user.id):
+        # The message comes from a known user, will not detect spam.
+        return
+
+    if user.id in _evaluations:
+        # Another message from this user is being evaluated, its verdict applies to this message as well.
+        if await asyncio.shield(_evaluations[user.id]):
+            logger.info("Deleting another message from user {full_name} (ID {id}) whose first message was spam".format(
+                full_name=user.full_name, id=user.id))
+            await safe_delete_message(context, message.id, message.chat.id)
+        return
+
+    evaluation = asyncio.get_running_loop().create_future()
+    _evaluations[user.id] = evaluation
+
+    _raid_detector.register_first_message(monotonic(), user.id)
+
+    _start_screening_workers()
+
+    try:
+        _screening_queue.put_nowait((context, message, evaluation, monotonic()))
+    except asyncio.QueueFull:
+        _overflow_count += 1
+
+        if settings.ANTISPAM_QUEUE_OVERFLOW_POLICY == "hold":
+            logger.warning("The screening queue is full, waiting until there is room")
+            await _screening_queue.put((context, message, evaluation, monotonic()))
+        else:
+            logger.warning("The screening queue is full, screening with the local layers only")
+            await _screen(context, message, evaluation, True)
+    _max_queue_depth = max(_max_queue_depth, _screening_queue.qsize())
+
+    await _update_raid_state(context)
+
+
+async def handle_query_admin(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> [None, int]:
+    query = update.callback_query
+    user = query.from_user
+
+    if not is_admin(user):
+        logging.error("User {username} is not listed as administrator!".format(username=user.username))
+        return
+
+    await query.answer()
+
+    trans = i18n.trans(user)
+
+    if query.data == ADMIN_DOWNLOAD_SPAM:
+        spam = [record for record in db.spam_select_all()]
+        await user.send_document(json.dumps(spam, ensure_ascii=False, indent=2).encode("utf-8"), filename="spam.json",
+                                 reply_markup=None)
+    elif query.data == ADMIN_DOWNLOAD_KEYWORDS:
+        await user.send_document(get_keywords(), filename=KEYWORDS_FILENAME, reply_markup=None)
+    elif query.data == ADMIN_UPLOAD_KEYWORDS:
+        await reply(update, trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_REQUEST_KEYWORDS"))
+
+        return ADMIN_UPLOADING_KEYWORDS
+    elif query.data == ADMIN_UPLOAD_OPENAI:
+        await reply(update, trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_REQUEST_OPENAI"))
+
+        return ADMIN_UPLOADING_OPENAI
+    elif query.data == ADMIN_STATS:
+        message = [trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_STATS_HEADER"), "",
+                   trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_STATS_VERDICT_CACHE {hits} {size}").format(
+                       hits=_verdict_cache_hits, size=len(_verdict_cache))]
+        if spam_index is not None:
+            message.append(trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_STATS_MINHASH {size}").format(size=len(spam_index)))
+        message.append(trans.gettext(
+            "ANTISPAM_MESSAGE_DM_ADMIN_STATS_QUEUE {average_wait} {depth} {max_depth} {max_wait} {overflows} "
+            "{screened}").format(
+            average_wait=f"{_total_wait / _screened_count * 1000 if _screened_count else 0:.0f}",
+            depth=_screening_queue.qsize(), max_depth=_max_queue_depth, max_wait=f"{_max_wait * 1000:.0f}",
+            overflows=_overflow_count, screened=_screened_count))
+
+        if settings.ANTISPAM_SHADOW_LAYERS:
+            message += ["", trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_STATS_SHADOW_HEADER")]
+
+            def percent(numerator: int, denominator: int) -> str:
+                return f"{numerator / denominator:.0%}" if denominator else "—"
+
+            shadow_report = list(shadow.report())
+            for record in shadow_report:
+                message.append(trans.gettext(
+                    "ANTISPAM_MESSAGE_DM_ADMIN_STATS_SHADOW_LAYER {agreement} {average_latency} {count} {max_latency} "
+                    "{name} {precision} {recall}").format(
+                    agreement=percent(record["agreed"], record["count"]),
+                    average_latency=f"{record['average_latency_ms']:.0f}", count=record["count"],
+                    max_latency=f"{record['max_latency_ms']:.0f}", name=record["layer"],
+                    precision=percent(record["true_positives"], record["true_positives"] + record["false_positives"]),
+                    recall=percent(record["true_positives"], record["true_positives"] + record["false_negatives"])))
+            if not shadow_report:
+                message.append(trans.gettext("ADMIN_MESSAGE_DM_STATS_EMPTY"))
+
+        await reply(update, "\n".join(message), get_main_keyboard())
+
+
+# noinspection PyUnusedLocal
+async def handle_received_keywords(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    trans = i18n.trans(update.effective_user)
+
+    if await save_file_with_backup(update, KEYWORDS_FILE_PATH, "text/plain"):
+        global keywords
+
+        keywords = None
+
+        await reply(update, trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_KEYWORDS_UPDATED"))
+
+    return ConversationHandler.END
+
+
+# noinspection PyUnusedLocal
+async def handle_received_openai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user = update.effective_user
+    if not is_admin(user):
+        logging.error("User {username} is not listed as administrator!".format(username=user.username))
+        return ConversationHandler.END
+
+    document = update.message.effective_attachment
+
+    openai_file = await document.get_file()
+    data = io.BytesIO()
+    await openai_file.download_to_memory(data)
+
+    trans = i18n.trans(user)
+
+    load_time = await save_new_openai(data)
+    if load_time is not None:
+        await reply(update, trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_OPENAI_UPDATED {load_time} {size}").format(
+            load_time=f"{load_time:.0f}", size=f"{len(data.getbuffer()) / 1024:.0f}"))
+    else:
+        await reply(update, trans.gettext("ANTISPAM_MESSAGE_DM_ADMIN_OPENAI_CANNOT_USE"), get_main_keyboard())
+
+    return ConversationHandler.END
+
+
+def init(application: Application, group):
+    """Prepare the feature as defined in the configuration"""
+
+    if not settings.ANTISPAM_ENABLED:
+        return
+
+    db.allowlist_load()
+
+    _validate_shadow_layers()
+
+    if 'minhash' in settings.ANTISPAM_ENABLED or 'minhash' in [layer["layer"] for layer in
+                                                               settings.ANTISPAM_SHADOW_LAYERS]:
+        _build_spam_index()
+
+    trans = i18n.default()
+
+    # Register admin handlers
+    if 'keywords' in settings.ANTISPAM_ENABLED:
+        application.add_handler(
+            ConversationHandler(entry_points=[CallbackQueryHandler(handle_query_admin, pattern=ADMIN_UPLOAD_KEYWORDS)],
+                                states={ADMIN_UPLOADING_KEYWORDS: [
+                                    MessageHandler(filters.ATTACHMENT, handle_received_keywords)]}, fallbacks=[]))
+
+        application.add_handler(CallbackQueryHandler(handle_query_admin, pattern=ADMIN_DOWNLOAD_KEYWORDS))
+
+        register_buttons(((InlineKeyboardButton(trans.gettext("ANTISPAM_BUTTON_DOWNLOAD_ANTISPAM_KEYWORDS"),
+                                                callback_data=ADMIN_DOWNLOAD_KEYWORDS),
+                           InlineKeyboardButton(trans.gettext("ANTISPAM_BUTTON_UPLOAD_ANTISPAM_KEYWORDS"),
+                                                callback_data=ADMIN_UPLOAD_KEYWORDS)),))
+
+    if 'openai' in settings.ANTISPAM_ENABLED or 'prompt' in settings.ANTISPAM_ENABLED:
+        application.add_handler(CallbackQueryHandler(handle_query_admin, pattern=ADMIN_DOWNLOAD_SPAM))
+
+        register_buttons(((InlineKeyboardButton(trans.gettext("ANTISPAM_BUTTON_DOWNLOAD_SPAM"),
+                                                callback_data=ADMIN_DOWNLOAD_SPAM),),))
+
+    if 'openai' in settings.ANTISPAM_ENABLED:
+        application.add_handler(
+            ConversationHandler(entry_points=[CallbackQueryHandler(handle_query_admin, pattern=ADMIN_UPLOAD_OPENAI)],
+                                states={ADMIN_UPLOADING_OPENAI: [
+                                    MessageHandler(filters.ATTACHMENT, handle_received_openai)]}, fallbacks=[]))
+
+        register_buttons(((InlineKeyboardButton(trans.gettext("ANTISPAM_BUTTON_UPLOAD_ANTISPAM_OPENAI"),
+                                                callback_data=ADMIN_UPLOAD_OPENAI),),))
+
+    application.add_handler(CallbackQueryHandler(handle_query_admin, pattern=ADMIN_STATS))
+
+    register_buttons(((InlineKeyboardButton(trans.gettext("ANTISPAM_BUTTON_STATS"), callback_data=ADMIN_STATS),),))
+
+    # Spam detection may wait for network calls, and it should not hold other updates that arrive meanwhile.  This also
+    # lets messages that come in bursts be evaluated together.
+    application.add_handler(MessageHandler(filters.TEXT & (~ filters.COMMAND), detect_spam, block=False), group=group)
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_members), group=group)
+
+
+def post_init(application: Application, _group: int):
+    """Post-init"""
+
+    if not settings.ANTISPAM_ENABLED:
+        return
+
+    if 'openai' in settings.ANTISPAM_ENABLED and OPENAI_FILE_PATH.exists():
+        # Load the model in background so that the first message that needs it would not have to wait.
+        application.create_task(_preload_openai_model())
@@ -0,0 +1,255 @@
+"""
+Tests for core.py
+"""
+
+import asyncio
+import io
+import pathlib
+import tempfile
+import threading
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import telegram
+
+from common.settings import settings
+from . import core
+
+
+class TestVerdictCache(unittest.TestCase):
+    def setUp(self):
+        core._verdict_cache.clear()
+        core._verdict_cache_hits = 0
+
+    def tearDown(self):
+        core._verdict_cache.clear()
+        core._verdict_cache_hits = 0
+
+    @patch.object(settings, "ANTISPAM_VERDICT_CACHE_TTL_MINUTES", 10)
+    def test_normalisation(self):
+        core._cache_verdict("Buy  cheap\nCrypto", "keywords", 1)
+
+        self.assertEqual(core._get_cached_verdict("buy cheap crypto"), ("keywords", 1))
+        self.assertEqual(core._get_cached_verdict("  BUY CHEAP CRYPTO "), ("keywords", 1))
+        self.assertIsNone(core._get_cached_verdict("buy cheap crypto!"))
+        self.assertEqual(core._verdict_cache_hits, 2)
+
+    @patch.object(settings, "ANTISPAM_VERDICT_CACHE_TTL_MINUTES", 10)
+    @patch("features.antispam.core.monotonic")
+    def test_expiration(self, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        core._cache_verdict("spam", "openai", 0.9)
+
+        mock_monotonic.return_value = 1000 + 10 * 60 - 1
+        self.assertEqual(core._get_cached_verdict("spam"), ("openai", 0.9))
+
+        mock_monotonic.return_value = 1000 + 10 * 60
+        self.assertIsNone(core._get_cached_verdict("spam"))
+        self.assertEqual(len(core._verdict_cache), 0)
+
+        core._cache_verdict("spam", "openai", 0.9)
+        mock_monotonic.return_value = 5000
+        core._cache_verdict("more spam", "keywords", 1)
+        self.assertEqual(len(core._verdict_cache), 1)
+
+    @patch.object(settings, "ANTISPAM_VERDICT_CACHE_TTL_MINUTES", 0)
+    def test_disabled(self):
+        core._cache_verdict("spam", "keywords", 1)
+
+        self.assertIsNone(core._get_cached_verdict("spam"))
+
+    @patch.object(settings, "ANTISPAM_VERDICT_CACHE_TTL_MINUTES", 10)
+    @patch("features.antispam.core.db.spam_insert")
+    def test_hit_records_layers(self, mock_spam_insert):
+        core._cache_verdict("spam", "keywords, openai", 0.9)
+
+        message = MagicMock(text="Spam")
+        with patch.object(core, "spam_index", core.minhash.MinHashIndex()):
+            self.assertTrue(asyncio.run(core.is_spam(message)))
+
+            # The repeated text is not added to the index of known spam texts again.
+            self.assertEqual(len(core.spam_index), 0)
+
+        mock_spam_insert.assert_called_once_with("Spam", message.from_user.id, "cache:keywords, openai", 0.9)
+
+
+class TestOpenAIModelSwap(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        core.openai_model = None
+
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+
+        path_patcher = patch("features.antispam.core.OPENAI_FILE_PATH", pathlib.Path(self.test_dir.name) / "model")
+        path_patcher.start()
+        self.addCleanup(path_patcher.stop)
+
+    def tearDown(self):
+        core.openai_model = None
+
+    async def test_upload_during_lazy_load(self):
+        old_model_loading = threading.Event()
+        release_old_model = threading.Event()
+
+        def load_openai_model(source):
+            if isinstance(source, io.BytesIO):
+                return "new model", 1
+            old_model_loading.set()
+            release_old_model.wait()
+            return "old model", 1
+
+        with patch("features.antispam.core._load_openai_model", side_effect=load_openai_model):
+            lazy_load = asyncio.create_task(core._get_openai_model())
+            await asyncio.to_thread(old_model_loading.wait)
+
+            upload = asyncio.create_task(core.save_new_openai(io.BytesIO(b"model")))
+            await asyncio.sleep(0.01)
+            release_old_model.set()
+
+            self.assertEqual(await lazy_load, "old model")
+            self.assertEqual(await upload, 1)
+
+        # The uploaded model is not replaced by the one loaded from the old file.
+        self.assertEqual(core.openai_model, "new model")
+
+
+class TestSpamIndex(unittest.TestCase):
+    @patch("features.antispam.core.db.spam_select_all")
+    def test_build_skips_empty_texts(self, mock_spam_select_all):
+        mock_spam_select_all.return_value = iter([{"text": None}, {"text": "  "}, {"text": "Buy cheap crypto now"}])
+
+        with patch.object(core, "spam_index", None):
+            core._build_spam_index()
+
+            self.assertEqual(len(core.spam_index), 1)
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    @staticmethod
+    def _update(message_id: int, user_id: int = 1) -> MagicMock:
+        update = MagicMock()
+        update.effective_message.id = message_id
+        update.effective_message.chat_id = settings.MAIN_CHAT_ID
+        update.effective_message.chat.id = settings.MAIN_CHAT_ID
+        update.effective_message.from_user.id = user_id
+        return update
+
+    async def _detect_spam_in_burst(self, mock_is_spam: AsyncMock) -> None:
+        first_evaluation_started = asyncio.Event()
+        verdict = mock_is_spam.return_value
+
+        async def slow_is_spam(*_args) -> bool:
+            first_evaluation_started.set()
+            await asyncio.sleep(0.01)
+            return verdict
+
+        mock_is_spam.side_effect = slow_is_spam
+
+        with patch.object(core, "_screening_queue", asyncio.Queue(settings.ANTISPAM_QUEUE_SIZE)):
+            first = asyncio.create_task(core.detect_spam(self._update(1), MagicMock()))
+            await asyncio.wait_for(first_evaluation_started.wait(), 1)
+            await asyncio.gather(first, core.detect_spam(self._update(2), MagicMock()),
+                                 core.detect_spam(self._update(3), MagicMock()))
+            await asyncio.wait_for(core._screening_queue.join(), 1)
+
+        mock_is_spam.assert_called_once()
+        self.assertEqual(core._evaluations, {})
+
+    @patch("features.antispam.core.send", new_callable=AsyncMock)
+    @patch("features.antispam.core.safe_delete_message", new_callable=AsyncMock)
+    @patch("features.antispam.core.is_spam", new_callable=AsyncMock, return_value=True)
+    @patch("features.antispam.core.db")
+    async def test_spam(self, mock_db, mock_is_spam, mock_safe_delete_message, _mock_send):
+        mock_db.is_good_member.return_value = False
+
+        await self._detect_spam_in_burst(mock_is_spam)
+
+        self.assertEqual(sorted(c.args[1] for c in mock_safe_delete_message.call_args_list), [1, 2, 3])
+        mock_db.register_good_member.assert_not_called()
+
+    @patch("features.antispam.core.safe_delete_message", new_callable=AsyncMock)
+    @patch("features.antispam.core.is_spam", new_callable=AsyncMock, return_value=False)
+    @patch("features.antispam.core.db")
+    async def test_not_spam(self, mock_db, mock_is_spam, mock_safe_delete_message):
+        mock_db.is_good_member.return_value = False
+
+        await self._detect_spam_in_burst(mock_is_spam)
+
+        mock_safe_delete_message.assert_not_called()
+        mock_db.register_good_member.assert_called_once_with(1)
+
+
+class TestRaidMode(unittest.IsolatedAsyncioTestCase):
+    @staticmethod
+    def _message(custom_emoji_count: int) -> MagicMock:
+        message = MagicMock()
+        message.text = f"Unique text {custom_emoji_count}"
+        message.entities = [MagicMock(type=telegram.MessageEntity.CUSTOM_EMOJI) for _ in range(custom_emoji_count)]
+        return message
+
+    @patch.object(settings, "ANTISPAM_ENABLED", ["openai", "prompt"])
+    @patch("features.antispam.core.detect_prompt", new_callable=AsyncMock, return_value=False)
+    @patch("features.antispam.core.detect_openai", new_callable=AsyncMock, return_value=0)
+    @patch("features.antispam.core._record_spam")
+    async def test_local_layers_only(self, mock_record_spam, mock_detect_openai, mock_detect_prompt):
+        self.assertFalse(await core.is_spam(self._message(2)))
+        mock_detect_openai.assert_awaited_once()
+        mock_detect_prompt.assert_awaited_once()
+
+        mock_detect_openai.reset_mock()
+        mock_detect_prompt.reset_mock()
+
+        self.assertFalse(await core.is_spam(self._message(1), cheap=True))
+        self.assertTrue(await core.is_spam(self._message(2), cheap=True))
+        mock_detect_openai.assert_not_awaited()
+        mock_detect_prompt.assert_not_awaited()
+        self.assertEqual(mock_record_spam.call_args.args[2], "emojis")
+
+
+class TestShadowLayers(unittest.IsolatedAsyncioTestCase):
+    @patch.object(settings, "ANTISPAM_SHADOW_LAYERS", [{"name": "strict", "layer": "emojis", "threshold": 0},
+                                                       {"name": "default", "layer": "emojis"},
+                                                       {"name": "similar", "layer": "minhash", "threshold": 0.9}])
+    @patch("features.antispam.core.shadow.record")
+    async def test_run(self, mock_record):
+        message = TestRaidMode._message(1)
+
+        with patch.object(core, "spam_index", core.minhash.MinHashIndex()):
+            core.spam_index.add(message.text)
+
+            await core._run_shadow_layers(message, False, 0)
+
+        self.assertEqual([(c.args[3], c.args[4]) for c in mock_record.call_args_list],
+                         [("strict", True), ("default", False), ("similar", False)])
+        for c in mock_record.call_args_list:
+            self.assertFalse(c.args[2])
+
+    def test_validate(self):
+        for layers in ([{"name": "a", "layer": "openai"}, {"name": "a", "layer": "minhash"}],
+                       [{"name": "a", "layer": "magic"}],
+                       [{"layer": "openai"}],
+                       [{"name": "a", "layer": "minhash", "model": "model.joblib"}]):
+            with patch.object(settings, "ANTISPAM_SHADOW_LAYERS", layers):
+                with self.assertRaises(RuntimeError):
+                    core._validate_shadow_layers()
+
+
+class TestScreeningQueue(unittest.IsolatedAsyncioTestCase):
+    @patch.object(settings, "ANTISPAM_WORKER_COUNT", 0)
+    @patch.object(settings, "ANTISPAM_QUEUE_OVERFLOW_POLICY", "cheap")
+    @patch("features.antispam.core.is_spam", new_callable=AsyncMock, return_value=False)
+    @patch("features.antispam.core.db")
+    async def test_overflow_cheap(self, mock_db, mock_is_spam):
+        mock_db.is_good_member.return_value = False
+
+        with patch.object(core, "_screening_queue", asyncio.Queue(1)):
+            await core.detect_spam(TestSingleFlight._update(1, 1), MagicMock())
+            mock_is_spam.assert_not_called()
+
+            await core.detect_spam(TestSingleFlight._update(2, 2), MagicMock())
+            mock_is_spam.assert_awaited_once()
+            self.assertTrue(mock_is_spam.call_args.args[1])
+            mock_db.register_good_member.assert_not_called()
+
+            self.assertEqual(core._screening_queue.qsize(), 1)
+            core._evaluations.clear()
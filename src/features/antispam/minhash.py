@@ -0,0 +1,119 @@
+"""
+Near-duplicate text detection with MinHash and locality-sensitive hashing (LSH)
+
+Texts are split into overlapping character shingles after normalisation that drops case, punctuation and emojis, so
+that small variations between spam messages do not matter much.  Each text is represented with a MinHash signature: for
+every one of `PERMUTATION_COUNT` random hash functions, the minimum hash value over all shingles of the text.  The share
+of equal positions in signatures of two texts estimates Jaccard similarity of their shingle sets.
+
+To avoid comparing a new text with every known one, signatures are split into `BAND_COUNT` bands of `ROW_COUNT` rows,
+and each band is put into a hash table.  Only texts that share at least one band with the new one are compared.  With 32
+bands of 4 rows, texts with similarity 0.6 become candidates with probability of 98%, while for similarity 0.2 it is 5%.
+"""
+
+import zlib
+
+import numpy as np
+
+# Length of a shingle in characters
+SHINGLE_LENGTH = 5
+
+BAND_COUNT = 32
+ROW_COUNT = 4
+PERMUTATION_COUNT = BAND_COUNT * ROW_COUNT
+
+# Hash functions are (a * x + b) mod p, where p is the Mersenne prime 2^31 - 1.  Shingle hashes are reduced modulo p as
+# well, so that a * x fits into 62 bits and can be calculated in uint64 without overflow.
+_PRIME = (1 << 31) - 1
+
+# Coefficients are generated with a fixed seed so that signatures are stable between restarts.
+_random = np.random.default_rng(20261018)
+_A = _random.integers(1, _PRIME, PERMUTATION_COUNT, dtype=np.uint64)
+_B = _random.integers(0, _PRIME, PERMUTATION_COUNT, dtype=np.uint64)
+
+
+def normalise(text: str) -> str:
+    """Return `text` in lower case, with only letters and digits separated by single spaces"""
+
+    return " ".join("".join(c if c.isalnum() else " " for c in text.casefold()).split())
+
+
+def shingles(text: str) -> set[str]:
+    """Return the set of shingles of the normalised `text`
+
+    A text shorter than a shingle is its own single shingle.  An empty text has no shingles.
+    """
+
+    text = normalise(text)
+
+    if len(text) <= SHINGLE_LENGTH:
+        return {text} if text else set()
+
+    return {text[i:i + SHINGLE_LENGTH] for i in range(len(text) - SHINGLE_LENGTH + 1)}
+
+
+def signature(text: str) -> np.ndarray | None:
+    """Return MinHash signature of `text`, or None if the text has no shingles"""
+
+    text_shingles = shingles(text)
+    if not text_shingles:
+        return None
+
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) % _PRIME for s in text_shingles), dtype=np.uint64,
+                         count=len(text_shingles))
+
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+class MinHashIndex:
+    """Index of texts that finds the most similar known text for a new one"""
+
+    def __init__(self):
+        self._signatures: dict[int, np.ndarray] = {}
+        self._buckets: list[dict[bytes, list[int]]] = [{} for _ in range(BAND_COUNT)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    @staticmethod
+    def _bands(text_signature: np.ndarray):
+        for band in range(BAND_COUNT):
+            yield band, text_signature[band * ROW_COUNT:(band + 1) * ROW_COUNT].tobytes()
+
+    def add(self, text: str) -> None:
+        """Add `text` to the index"""
+
+        text_signature = signature(text)
+        if text_signature is None:
+            return
+
+        key = len(self._signatures)
+        self._signatures[key] = text_signature
+
+        for band, band_key in self._bands(text_signature):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def similarity(self, text: str, limit: int | None = None) -> float:
+        """Return estimated similarity between `text` and the most similar text in the index
+
+        The result is between 0 and 1.  Texts that are not similar enough to become LSH candidates count as 0.  If
+        `limit` is given, only the first `limit` texts added to the index are considered.
+        """
+
+        text_signature = signature(text)
+        if text_signature is None:
+            return 0
+
+        candidates = set()
+        for band, band_key in self._bands(text_signature):
+            candidates.update(self._buckets[band].get(band_key, ()))
+
+        if limit is not None:
+            candidates = {key for key in candidates if key < limit}
+
+        if not candidates:
+            return 0
+
+        candidate_signatures = np.stack([self._signatures[key] for key in candidates])
+
+        return float((candidate_signatures == text_signature).mean(axis=1).max())
@@ -0,0 +1,52 @@
+"""
+Tests for minhash.py
+"""
+
+import unittest
+
+from . import minhash
+
+_SPAM = ("Hi everyone! I am looking for 3 people for remote work, 2 hours a day, income from 500 USD per week. "
+         "Write me in private messages for details.")
+
+
+class TestShingles(unittest.TestCase):
+    def test_normalise(self):
+        self.assertEqual(minhash.normalise("  Hello,   WORLD!!! 🔥🔥 "), "hello world")
+        self.assertEqual(minhash.normalise("🔥🔥"), "")
+
+    def test_shingles(self):
+        self.assertEqual(minhash.shingles(""), set())
+        self.assertEqual(minhash.shingles("Hi!"), {"hi"})
+        self.assertEqual(minhash.shingles("abcdef"), {"abcde", "bcdef"})
+
+
+class TestMinHashIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = minhash.MinHashIndex()
+        self.index.add(_SPAM)
+        self.index.add("Selling a bicycle in good condition, almost new, call me")
+        self.index.add("")
+
+    def test_len(self):
+        self.assertEqual(len(self.index), 2)
+
+    def test_exact_duplicate(self):
+        self.assertEqual(self.index.similarity(_SPAM), 1)
+        self.assertEqual(self.index.similarity(_SPAM.upper() + " 🔥🔥🔥"), 1)
+
+    def test_near_duplicate(self):
+        variant = _SPAM.replace("3 people", "4 people").replace("500 USD", "700 USD").replace("details", "info")
+
+        self.assertGreater(self.index.similarity(variant), 0.7)
+
+    def test_limit(self):
+        self.index.add("Selling a bicycle in good condition, almost new, call me")
+
+        self.assertEqual(self.index.similarity(_SPAM, 1), 1)
+        self.assertEqual(self.index.similarity(_SPAM, 0), 0)
+
+    def test_different_text(self):
+        self.assertLess(self.index.similarity("Does anyone know a good dentist near the central station?"), 0.3)
+        self.assertEqual(self.index.similarity(""), 0)
+        self.assertEqual(minhash.MinHashIndex().similarity(_SPAM), 0)
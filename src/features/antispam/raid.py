@@ -0,0 +1,75 @@
+"""
+Detection of raids, when many new users join the group and post at once
+"""
+
+from collections import deque
+
+
+class RaidDetector:
+    """Tracks joins and first messages of new users over a sliding window, and decides whether a raid is in progress
+
+    A raid starts when the number of joins or the number of first messages within the window reaches its threshold.  It
+    ends when both numbers drop below half of their thresholds, so that the mode does not flap when the rate hovers
+    around a threshold.  A threshold of 0 disables the respective criterion.
+
+    Every user counts at most once among first messages within the window: users who are not trusted yet keep having
+    their messages treated as first ones during a raid, and they should not keep the raid going by merely talking.
+    """
+
+    def __init__(self, window_seconds: float, join_threshold: int, first_message_threshold: int):
+        self._window = window_seconds
+        self._join_threshold = join_threshold
+        self._first_message_threshold = first_message_threshold
+
+        self._joins = deque()
+        # Pairs of (time, user ID), and the set of IDs of users that are counted
+        self._first_messages = deque()
+        self._first_message_user_ids = set()
+
+        self.is_active = False
+
+    @property
+    def join_count(self) -> int:
+        return len(self._joins)
+
+    @property
+    def first_message_count(self) -> int:
+        return len(self._first_messages)
+
+    def register_join(self, now: float, count: int = 1) -> None:
+        """Register `count` users that joined the group at time `now`"""
+
+        self._joins.extend([now] * count)
+
+    def register_first_message(self, now: float, user_id: int) -> None:
+        """Register a first message of a new user posted at time `now`, unless the user is counted already"""
+
+        if user_id in self._first_message_user_ids:
+            return
+
+        self._first_messages.append((now, user_id))
+        self._first_message_user_ids.add(user_id)
+
+    def update(self, now: float) -> bool:
+        """Forget events that are older than the window, re-evaluate the state, and return whether it has changed"""
+
+        while self._joins and self._joins[0] <= now - self._window:
+            self._joins.popleft()
+        while self._first_messages and self._first_messages[0][0] <= now - self._window:
+            _, user_id = self._first_messages.popleft()
+            self._first_message_user_ids.discard(user_id)
+
+        def reached(count: int, threshold: float) -> bool:
+            return 0 < threshold <= count
+
+        if not self.is_active:
+            self.is_active = (reached(self.join_count, self._join_threshold) or
+                              reached(self.first_message_count, self._first_message_threshold))
+            return self.is_active
+
+        if (reached(self.join_count, self._join_threshold / 2) or
+                reached(self.first_message_count, self._first_message_threshold / 2)):
+            return False
+
+        self.is_active = False
+        return True
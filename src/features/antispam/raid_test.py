@@ -0,0 +1,76 @@
+"""
+Tests for raid.py
+"""
+
+import unittest
+
+from .raid import RaidDetector
+
+
+class TestRaidDetector(unittest.TestCase):
+    def test_joins(self):
+        detector = RaidDetector(60, 10, 0)
+
+        detector.register_join(0, 9)
+        self.assertFalse(detector.update(0))
+        self.assertFalse(detector.is_active)
+
+        detector.register_join(30)
+        self.assertTrue(detector.update(30))
+        self.assertTrue(detector.is_active)
+        self.assertEqual(detector.join_count, 10)
+
+        # Nine joins at 0 leave the window, but one at 30 is still there.
+        self.assertTrue(detector.update(60))
+        self.assertFalse(detector.is_active)
+        self.assertEqual(detector.join_count, 1)
+
+    def test_first_messages(self):
+        detector = RaidDetector(60, 0, 4)
+
+        for t in range(4):
+            detector.register_first_message(t, t)
+        self.assertTrue(detector.update(3))
+        self.assertTrue(detector.is_active)
+
+        self.assertFalse(detector.update(3))
+        self.assertTrue(detector.is_active)
+
+    def test_first_messages_of_same_user(self):
+        detector = RaidDetector(10, 0, 4)
+
+        # Further messages of a user who is counted already do not make a raid.
+        for t in range(8):
+            detector.register_first_message(t, 1)
+        detector.register_first_message(8, 2)
+        self.assertFalse(detector.update(8))
+        self.assertEqual(detector.first_message_count, 2)
+
+        # Once the first message leaves the window, the user is counted again.
+        self.assertFalse(detector.update(10))
+        self.assertEqual(detector.first_message_count, 1)
+        detector.register_first_message(10, 1)
+        self.assertEqual(detector.first_message_count, 2)
+
+    def test_hysteresis(self):
+        detector = RaidDetector(10, 4, 0)
+
+        detector.register_join(0, 4)
+        self.assertTrue(detector.update(0))
+
+        # Two joins within the window is half of the threshold, which still keeps the raid going.
+        detector.register_join(5, 2)
+        self.assertFalse(detector.update(10))
+        self.assertTrue(detector.is_active)
+
+        detector.register_join(12)
+        self.assertTrue(detector.update(15))
+        self.assertFalse(detector.is_active)
+
+    def test_disabled(self):
+        detector = RaidDetector(60, 0, 0)
+
+        detector.register_join(0, 1000)
+        detector.register_first_message(0, 1)
+        self.assertFalse(detector.update(0))
+        self.assertFalse(detector.is_active)
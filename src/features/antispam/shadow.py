@@ -0,0 +1,36 @@
+"""
+Persistent results of shadow antispam layers
+
+Shadow layers are evaluated after the real verdict has been acted on, and their results are stored next to the real
+verdict, so that new layers or thresholds can be compared with the ones in production before switching to them.
+"""
+
+from collections.abc import Iterator
+
+from common import db
+
+
+def record(text: str, from_user_tg_id: int, verdict: bool, layer: str, shadow_verdict: bool, confidence: float,
+           latency_ms: float) -> None:
+    """Save the result of a shadow layer `layer` for a message that got the real `verdict`"""
+
+    db.sql_exec("INSERT INTO spam_shadow "
+                "(text, from_user_tg_id, verdict, layer, shadow_verdict, confidence, latency_ms) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                (text, from_user_tg_id, verdict, layer, shadow_verdict, confidence, latency_ms))
+
+
+def report() -> Iterator[dict]:
+    """Return statistics of each shadow layer compared to the real verdicts
+
+    Each record has the layer name, the number of evaluated messages, how many of them got the same verdict as the real
+    one, numbers of true positives, false positives and false negatives (the real verdict being the label), and the
+    average and maximum latency in milliseconds.
+    """
+
+    yield from db.sql_query("SELECT layer, COUNT(*) AS count, SUM(verdict = shadow_verdict) AS agreed, "
+                            "SUM(verdict AND shadow_verdict) AS true_positives, "
+                            "SUM(NOT verdict AND shadow_verdict) AS false_positives, "
+                            "SUM(verdict AND NOT shadow_verdict) AS false_negatives, "
+                            "AVG(latency_ms) AS average_latency_ms, MAX(latency_ms) AS max_latency_ms "
+                            "FROM spam_shadow GROUP BY layer ORDER BY layer")
@@ -0,0 +1,37 @@
+"""
+Tests for shadow.py
+"""
+
+import pathlib
+import tempfile
+import unittest
+
+from common import db
+from . import shadow
+
+
+class TestShadow(unittest.TestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+
+    def tearDown(self):
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+    def test_report(self):
+        self.assertEqual(list(shadow.report()), [])
+
+        for verdict, shadow_verdict, latency_ms in ((True, True, 10), (True, False, 20), (False, True, 30),
+                                                    (False, False, 40), (False, False, 50)):
+            shadow.record("text", 1, verdict, "b", shadow_verdict, 0.5, latency_ms)
+        shadow.record("text", 1, True, "a", True, 1, 5)
+
+        report = list(shadow.report())
+
+        self.assertEqual([record["layer"] for record in report], ["a", "b"])
+        self.assertEqual(report[1], {"layer": "b", "count": 5, "agreed": 3, "true_positives": 1, "false_positives": 1,
+                                     "false_negatives": 1, "average_latency_ms": 30, "max_latency_ms": 50})
@@ -0,0 +1 @@
+from .core import init, post_init
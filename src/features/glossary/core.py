@@ -0,0 +1,503 @@
+"""
+Glossary
+"""
+
+import asyncio
+import csv
+import io
+import logging
+import re
+import time
+
+from telegram import InlineKeyboardButton, Message, Update
+from telegram.constants import ReactionEmoji
+from telegram.ext import Application, CallbackQueryHandler, ContextTypes, ConversationHandler, filters, MessageHandler
+
+from common import i18n, settings
+from common.admin import register_buttons, save_file_with_backup
+from common.bot import reply
+from common.checks import is_admin
+from common.log import LogTime
+from common.messaging_helpers import self_destructing_reaction, self_destructing_reply
+from common.settings import settings
+from . import fuzzy, matcher, recent, state
+
+TERMS_FILENAME = "glossary_terms.csv"
+TERMS_FILE_PATH = settings.data_dir / TERMS_FILENAME
+
+# Admin keyboard commands
+ADMIN_DOWNLOAD_TERMS, ADMIN_UPLOAD_TERMS = "glossary-download-terms", "glossary-upload-terms"
+ADMIN_ADD_TERM, ADMIN_EDIT_TERM, ADMIN_DELETE_TERM = "glossary-add-term", "glossary-edit-term", "glossary-delete-term"
+ADMIN_UPLOADING_TERMS, ADMIN_ADDING_TERM, ADMIN_EDITING_TERM, ADMIN_DELETING_TERM = range(1, 5)
+
+# Glossary data.  List of dictionary items with the following fields:
+# - id: ID of the term in the DB
+# - regex: regular expression that should capture the trigger in a message in any form, including misspellings
+# - standard: trigger in "native" language in its "best" form (properly transliterated, no typos or other errors)
+# - original: word in its original ("foreign") language
+# - explanation: meaning of the term in the default language
+glossary_data = []
+
+# Matcher that finds triggers of all terms from `glossary_data` in a message.  Built along with `glossary_data`.
+glossary_matcher: matcher.TermMatcher | None = None
+
+# Index of standard forms of all terms from `glossary_data` for the "what is" command.  Built along with
+# `glossary_data`.
+glossary_index: fuzzy.FuzzyIndex | None = None
+
+# Serialises rebuilds of the glossary, so that the latest one is applied last.
+_rebuild_lock = asyncio.Lock()
+
+# Terms from `glossary_data` by their IDs.  Built along with `glossary_data`.
+glossary_terms_by_id: dict[int, dict] = {}
+
+# Maximum number of recent triggers remembered in a conversation
+MAX_RECENT_TRIGGERS = 100
+
+# Triggers found recently in every conversation, see `conversation_key()`
+recent_triggers: recent.RecentTriggers
+
+# Commands given to the bot via mentioning it.
+mention_commands: dict
+
+# Keys in dictionaries used in the above data structures.
+ID, REGEX, STANDARD, ORIGINAL, EXPLANATION = "id", "regex", "standard", "original", "explanation"
+COMMAND_EXPLAIN, COMMAND_WHATISIT = "explain", "whatisit"
+
+
+def _compile_regex(regex: str) -> re.Pattern:
+    return re.compile("\\b{}\\b".format(regex), re.IGNORECASE)
+
+
+def _build_glossary(rows: list[dict], previous_data: list) -> tuple[list, matcher.TermMatcher, fuzzy.FuzzyIndex]:
+    """Build glossary data and lookup structures from records of the `glossary_terms` table
+
+    Compiled regular expressions are taken from `previous_data` for terms whose regular expressions have not changed, so
+    that only new and changed terms are compiled.  Does not change any global state, so that it can run in a worker
+    thread while the previous data is still in use.
+    """
+
+    compiled = {term[REGEX].pattern: term[REGEX] for term in previous_data}
+
+    data = []
+    compiled_count = 0
+    for row in rows:
+        regex = compiled.get("\\b{}\\b".format(row["regex"]))
+        if regex is None:
+            try:
+                regex = _compile_regex(row["regex"])
+            except re.error as e:
+                logging.warning("Skipping glossary term {} with invalid regex \"{}\": {}".format(
+                    row["id"], row["regex"], e))
+                continue
+            compiled_count += 1
+        data.append({ID: row["id"], REGEX: regex, STANDARD: row["standard"], ORIGINAL: row["original"],
+                     EXPLANATION: row["explanation"]})
+
+    term_matcher = matcher.TermMatcher([term[REGEX] for term in data])
+    term_index = fuzzy.FuzzyIndex([term[STANDARD] for term in data])
+
+    logging.info("Built glossary of {} terms, compiled {} regular expressions, {} terms cannot be prefiltered".format(
+        len(data), compiled_count, term_matcher.unindexed_count))
+
+    return data, term_matcher, term_index
+
+
+def _set_glossary(data: list, term_matcher: matcher.TermMatcher, term_index: fuzzy.FuzzyIndex) -> None:
+    global glossary_data, glossary_matcher, glossary_index, glossary_terms_by_id
+
+    # Handlers never await between accessing these, so they always see a consistent state.
+    glossary_data, glossary_matcher, glossary_index = data, term_matcher, term_index
+    glossary_terms_by_id = {term[ID]: term for term in data}
+
+
+def load_glossary() -> None:
+    """Load the glossary from the DB
+
+    If the DB has no terms yet, imports them from the CSV file if it exists.
+    """
+
+    if state.term_count() == 0 and TERMS_FILE_PATH.exists():
+        with open(TERMS_FILE_PATH, "rb") as inp:
+            terms = read_terms(io.BytesIO(inp.read()))
+        state.term_replace_all(terms)
+        logging.info("Imported {} glossary terms from {}".format(len(terms), TERMS_FILE_PATH))
+
+    _set_glossary(*_build_glossary(list(state.term_select_all()), []))
+
+
+async def rebuild_glossary() -> None:
+    """Rebuild the glossary from the DB in a worker thread, and replace the current one with the result"""
+
+    async with _rebuild_lock:
+        rows = list(state.term_select_all())
+        _set_glossary(*await asyncio.to_thread(_build_glossary, rows, glossary_data))
+
+
+def parse_term(row: list[str]) -> tuple[str, ...]:
+    """Convert a CSV row to a tuple of values for `state.COLUMNS`, optionally preceded with the term ID
+
+    Raises `ValueError` if the row does not have a proper number of values or the ID is not a number, and `re.error` if
+    the regular expression is invalid.
+    """
+
+    row = [value.strip() for value in row]
+
+    if len(row) == len(state.COLUMNS) + 1:
+        row[0] = int(row[0])
+    elif len(row) != len(state.COLUMNS):
+        raise ValueError("Expected {} or {} values, got {}".format(
+            len(state.COLUMNS), len(state.COLUMNS) + 1, len(row)))
+
+    _compile_regex(row[-len(state.COLUMNS)])
+
+    return tuple(row)
+
+
+def read_terms(data: io.BytesIO) -> list[tuple]:
+    """Read terms from CSV data
+
+    Rows that do not have a proper number of values are skipped.  Raises `re.error` if a regular expression is invalid.
+    """
+
+    terms = []
+    for row in csv.reader(io.StringIO(data.getvalue().decode("utf-8-sig"), newline=""), delimiter=";"):
+        if not row:
+            continue
+        try:
+            terms.append(parse_term(row))
+        except ValueError as e:
+            logging.warning(e)
+    return terms
+
+
+def get_file() -> io.BytesIO:
+    """Return all terms in a CSV file"""
+
+    text = io.StringIO()
+    writer = csv.writer(text, delimiter=";")
+    for row in state.term_select_all():
+        writer.writerow([row["id"]] + [row[column] for column in state.COLUMNS])
+
+    return io.BytesIO(text.getvalue().encode("utf-8-sig"))
+
+
+def conversation_key(message: Message) -> tuple[int, int | None]:
+    """Return the key of the conversation that `message` belongs to: the chat ID and the forum topic ID, if any"""
+
+    return message.chat_id, message.message_thread_id if message.is_topic_message else None
+
+
+def format_explanations(terms: list) -> list:
+    """Returns a list of strings that contain explanations for each trigger in `keys`"""
+
+    result = []
+    for term in terms:
+        result.append("<b>{t}</b> <em>({o})</em> — {e}".format(e=term[EXPLANATION], o=term[ORIGINAL], t=term[STANDARD]))
+
+    if len(terms) > 1 and settings.GLOSSARY_EXTERNAL_URL:
+        result.append(
+            i18n.default().gettext("GLOSSARY_EXTERNAL_URL_NOTE {url}").format(url=settings.GLOSSARY_EXTERNAL_URL))
+
+    return result
+
+
+async def process_normal_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Search triggers in an incoming message, and react appropriately"""
+
+    if not update.message:
+        logging.info("Skipping an update that does not have a message.")
+        return
+
+    with LogTime("Trigger lookup"):
+        filtered = [glossary_data[i] for i in glossary_matcher.find(update.effective_message.text)]
+    if not filtered:
+        return
+
+    recent_triggers.add(conversation_key(update.effective_message), [term[ID] for term in filtered], time.monotonic())
+
+    if settings.GLOSSARY_REPLY_TO_TRIGGER and len(filtered) >= settings.GLOSSARY_REPLY_TO_MIN_TRIGGER_COUNT:
+        trans = i18n.default()
+
+        text = [trans.gettext("GLOSSARY_TRIGGERED_EXPLANATION_HEADER")] + format_explanations(filtered)
+        await self_destructing_reply(update, context, "\n".join(text), settings.GLOSSARY_REPLY_TO_TRIGGER_TIMEOUT,
+                                     False)
+
+    if settings.GLOSSARY_REACT_TO_TRIGGER:
+        await self_destructing_reaction(update, context, [ReactionEmoji.EYES], settings.GLOSSARY_MAX_TRIGGER_AGE)
+
+
+async def maybe_process_command_explain(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Try to find the "explain" command in the message, and handle it if found
+
+    Tries to find one of command terms that mean "explain the current context", and if found, renders the explanation
+    for all recent triggers, then clears them.
+
+    Returns whether the command term was found.
+    """
+
+    global mention_commands
+
+    if mention_commands[COMMAND_EXPLAIN].search(update.effective_message.text) is None:
+        return False
+
+    trans = i18n.default()
+
+    key = conversation_key(update.effective_message)
+
+    # Terms deleted from the glossary since they were triggered are skipped.
+    terms = [glossary_terms_by_id[term_id] for term_id in recent_triggers.terms(key, time.monotonic())
+             if term_id in glossary_terms_by_id]
+    if not terms:
+        await reply(update, trans.gettext("GLOSSARY_EMPTY_CONTEXT"))
+        return True
+
+    text = [trans.gettext("GLOSSARY_EXPLANATION_HEADER")] + format_explanations(terms)
+    await reply(update, "\n".join(text))
+
+    recent_triggers.clear(key)
+    return True
+
+
+async def maybe_process_command_whatisit(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Try to find the "what is ..." command in the message, and handle it if found
+
+    Tries to find a pattern that means "what is <word>", and if found, tries to find that term and respond with an
+    explanation.
+
+    Returns whether the command term was found.
+    """
+
+    trans = i18n.default()
+
+    match = mention_commands[COMMAND_WHATISIT].search(update.effective_message.text)
+    if match is None:
+        return False
+
+    word = match.group("term")
+
+    with LogTime("Fuzzy term lookup"):
+        found = glossary_index.find(word)
+
+    if found and found[0][0] == 0:
+        await reply(update, format_explanations([glossary_data[found[0][1]]])[0])
+        return True
+
+    possible_terms = [glossary_data[term_index] for _distance, term_index in found]
+
+    if possible_terms:
+        if len(possible_terms) > 1:
+            text = [trans.gettext("GLOSSARY_WHATISIT_FUZZY_MATCH")] + format_explanations(possible_terms)
+            await reply(update, "\n".join(text))
+        else:
+            await reply(update, format_explanations(possible_terms)[0])
+        return True
+
+    await reply(update, trans.gettext("GLOSSARY_I_DO_NOT_KNOW"))
+    return True
+
+
+async def process_bot_mention(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """React to mention
+
+    The update text must start with the handle of the bot, otherwise it is ignored.  This is to handle commands like
+    "@OurBot, what is this" and skip things like "Everyone, use @OurBot for fun stuff".
+
+    If the mention does not contain any term recognised as a question to translate triggers noticed recently, sends "I
+    do not understand this".  Otherwise, sends an explanation to triggers that stay currently in the global
+    `recent_triggers` for the conversation, and clears them, or says that there is nothing to explain.
+    """
+
+    if not update.effective_message.text.startswith(context.bot.name):
+        return
+
+    trans = i18n.default()
+
+    # TODO find a way to register multiple mention commands from different features in the single handler in the core,
+    # so that the only handler there would pick the mention and then dispatch it to the actual handlers.
+    for handler in (maybe_process_command_explain, maybe_process_command_whatisit):
+        if await handler(update, context):
+            return
+
+    if settings.GLOSSARY_EXTERNAL_URL:
+        await reply(update, trans.gettext("GLOSSARY_UNKNOWN_COMMAND {url}").format(url=settings.GLOSSARY_EXTERNAL_URL))
+    else:
+        await reply(update, trans.gettext("GLOSSARY_UNKNOWN_COMMAND"))
+
+
+async def handle_query_admin(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> [None, int]:
+    query = update.callback_query
+    user = query.from_user
+
+    if not is_admin(user):
+        logging.error("User {username} is not listed as administrator!".format(username=user.username))
+        return
+
+    await query.answer()
+
+    trans = i18n.trans(user)
+
+    if query.data == ADMIN_DOWNLOAD_TERMS:
+        await user.send_document(get_file(), filename=TERMS_FILENAME, reply_markup=None)
+    elif query.data == ADMIN_UPLOAD_TERMS:
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_REQUEST_TERMS"))
+
+        return ADMIN_UPLOADING_TERMS
+    elif query.data == ADMIN_ADD_TERM:
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_REQUEST_NEW_TERM"))
+
+        return ADMIN_ADDING_TERM
+    elif query.data == ADMIN_EDIT_TERM:
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_REQUEST_EDITED_TERM"))
+
+        return ADMIN_EDITING_TERM
+    elif query.data == ADMIN_DELETE_TERM:
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_REQUEST_TERM_ID"))
+
+        return ADMIN_DELETING_TERM
+
+
+def _validate_terms_file(data: io.BytesIO) -> (bool, str):
+    try:
+        read_terms(data)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return False, str(e)
+    except re.error as e:
+        return False, "{}: {}".format(e.pattern, e)
+    return True, ""
+
+
+async def handle_received_terms_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    trans = i18n.trans(update.effective_user)
+
+    if await save_file_with_backup(update, TERMS_FILE_PATH, "text/csv", _validate_terms_file):
+        with open(TERMS_FILE_PATH, "rb") as inp:
+            state.term_replace_all(read_terms(io.BytesIO(inp.read())))
+
+        context.application.create_task(rebuild_glossary(), update)
+
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_TERMS_UPDATED"))
+
+    return ConversationHandler.END
+
+
+async def _parse_received_term(update: Update, with_id: bool) -> tuple | None:
+    """Parse a term sent by an administrator as a CSV row, or explain the problem to the administrator"""
+
+    trans = i18n.trans(update.effective_user)
+
+    rows = list(csv.reader(io.StringIO(update.effective_message.text, newline=""), delimiter=";"))
+    try:
+        if len(rows) != 1:
+            raise ValueError("Expected a single row")
+        term = parse_term(rows[0])
+        if with_id != (len(term) > len(state.COLUMNS)):
+            raise ValueError("Unexpected number of values")
+    except ValueError:
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_INVALID_TERM"))
+        return None
+    except re.error as e:
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_INVALID_REGEX {error}").format(error=e))
+        return None
+
+    return term
+
+
+async def handle_received_new_term(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    term = await _parse_received_term(update, False)
+    if term is not None:
+        term_id = state.term_insert(*term)
+        context.application.create_task(rebuild_glossary(), update)
+
+        trans = i18n.trans(update.effective_user)
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_TERM_ADDED {id}").format(id=term_id))
+
+    return ConversationHandler.END
+
+
+async def handle_received_edited_term(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    term = await _parse_received_term(update, True)
+    if term is not None:
+        trans = i18n.trans(update.effective_user)
+        if state.term_update(*term):
+            context.application.create_task(rebuild_glossary(), update)
+            await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_TERM_UPDATED {id}").format(id=term[0]))
+        else:
+            await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_TERM_NOT_FOUND {id}").format(id=term[0]))
+
+    return ConversationHandler.END
+
+
+async def handle_received_term_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    trans = i18n.trans(update.effective_user)
+
+    try:
+        term_id = int(update.effective_message.text.strip())
+    except ValueError:
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_INVALID_TERM_ID"))
+        return ConversationHandler.END
+
+    if state.term_delete(term_id):
+        context.application.create_task(rebuild_glossary(), update)
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_TERM_DELETED {id}").format(id=term_id))
+    else:
+        await reply(update, trans.gettext("GLOSSARY_MESSAGE_DM_ADMIN_TERM_NOT_FOUND {id}").format(id=term_id))
+
+    return ConversationHandler.END
+
+
+def init(application: Application, group):
+    """Prepare the feature as defined in the configuration"""
+
+    if not settings.GLOSSARY_ENABLED:
+        return
+
+    global recent_triggers
+
+    recent_triggers = recent.RecentTriggers(settings.GLOSSARY_MAX_TRIGGER_AGE, MAX_RECENT_TRIGGERS)
+
+    load_glossary()
+
+    trans = i18n.default()
+
+    # Prepare regular expressions for the mention commands
+    global mention_commands
+
+    mention_commands = {
+        COMMAND_EXPLAIN: re.compile("\\b{}\\b".format(trans.gettext("GLOSSARY_COMMAND_EXPLAIN")), re.IGNORECASE),
+        COMMAND_WHATISIT: re.compile("\\b{}\\b".format(trans.gettext("GLOSSARY_COMMAND_WHATISIT")), re.IGNORECASE)}
+
+    # Register admin handlers
+    text_message = filters.TEXT & (~ filters.COMMAND)
+    application.add_handler(
+        ConversationHandler(
+            entry_points=[CallbackQueryHandler(handle_query_admin, pattern="|".join(
+                (ADMIN_UPLOAD_TERMS, ADMIN_ADD_TERM, ADMIN_EDIT_TERM, ADMIN_DELETE_TERM)))],
+            states={ADMIN_UPLOADING_TERMS: [MessageHandler(filters.ATTACHMENT, handle_received_terms_file)],
+                    ADMIN_ADDING_TERM: [MessageHandler(text_message, handle_received_new_term)],
+                    ADMIN_EDITING_TERM: [MessageHandler(text_message, handle_received_edited_term)],
+                    ADMIN_DELETING_TERM: [MessageHandler(text_message, handle_received_term_id)]}, fallbacks=[]),
+        group=group)
+    application.add_handler(CallbackQueryHandler(handle_query_admin, pattern=ADMIN_DOWNLOAD_TERMS), group=group)
+
+    register_buttons(((InlineKeyboardButton(trans.gettext("GLOSSARY_BUTTON_DOWNLOAD_TERMS"),
+                                            callback_data=ADMIN_DOWNLOAD_TERMS),
+                       InlineKeyboardButton(trans.gettext("GLOSSARY_BUTTON_UPLOAD_TERMS"),
+                                            callback_data=ADMIN_UPLOAD_TERMS)),
+                      (InlineKeyboardButton(trans.gettext("GLOSSARY_BUTTON_ADD_TERM"), callback_data=ADMIN_ADD_TERM),
+                       InlineKeyboardButton(trans.gettext("GLOSSARY_BUTTON_EDIT_TERM"), callback_data=ADMIN_EDIT_TERM),
+                       InlineKeyboardButton(trans.gettext("GLOSSARY_BUTTON_DELETE_TERM"),
+                                            callback_data=ADMIN_DELETE_TERM)),))
+
+
+def post_init(application: Application, group):
+    """Post-init"""
+
+    if not settings.GLOSSARY_ENABLED:
+        return
+
+    # The bot name is not yet known when init() is called, but the handler for mentions must be added before the handler
+    # for all other messages, which is why we have to add handlers in post-init, when the bot is already created and
+    # knows its own name.
+    application.add_handler(MessageHandler(filters.Mention(application.bot.name), process_bot_mention), group=group)
+    application.add_handler(MessageHandler(filters.TEXT & (~ filters.COMMAND), process_normal_message), group=group)
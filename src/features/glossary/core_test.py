@@ -0,0 +1,77 @@
+"""
+Tests for core.py
+"""
+
+import io
+import pathlib
+import re
+import tempfile
+import unittest
+
+from common import db
+from . import core, state
+
+
+class TestTermsFile(unittest.TestCase):
+    def test_parse_term(self):
+        self.assertEqual(core.parse_term([" bank\\w* ", "bank", "Bank", "A bank "]),
+                         ("bank\\w*", "bank", "Bank", "A bank"))
+        self.assertEqual(core.parse_term(["5", "bank", "bank", "Bank", "A bank"]),
+                         (5, "bank", "bank", "Bank", "A bank"))
+
+        for row in (["bank", "bank", "Bank"], ["x", "bank", "bank", "Bank", "A bank"], []):
+            with self.assertRaises(ValueError):
+                core.parse_term(row)
+        with self.assertRaises(re.error):
+            core.parse_term(["bank(", "bank", "Bank", "A bank"])
+
+    def test_read_terms(self):
+        data = io.BytesIO(
+            "bank;bank;Bank;A bank\r\n\r\nbroken;row\r\n3;visa;visa;Visum;\"A visa; for a stay\"\r\n".encode("utf-8-sig"))
+
+        self.assertEqual(core.read_terms(data), [("bank", "bank", "Bank", "A bank"),
+                                                 (3, "visa", "visa", "Visum", "A visa; for a stay")])
+
+
+class TestGlossary(unittest.TestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+
+        state.term_replace_all([("bank\\w*", "bank", "Bank", "A bank"), ("visa|виза", "visa", "Visum", "A visa")])
+
+    def tearDown(self):
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+    def test_build(self):
+        data, term_matcher, term_index = core._build_glossary(list(state.term_select_all()), [])
+
+        self.assertEqual([term[core.STANDARD] for term in data], ["bank", "visa"])
+        self.assertEqual(term_matcher.find("Нужна виза в банк"), [1])
+        self.assertEqual(term_index.find("Viza"), [(1, 1)])
+
+    def test_rebuild_compiles_changed_terms_only(self):
+        previous_data, _, _ = core._build_glossary(list(state.term_select_all()), [])
+
+        bank_id = previous_data[0][core.ID]
+        state.term_update(bank_id, "banks?", "bank", "Bank", "A bank")
+        state.term_insert("kita", "kita", "Kita", "A kindergarten")
+
+        data, _, _ = core._build_glossary(list(state.term_select_all()), previous_data)
+
+        self.assertIsNot(data[0][core.REGEX], previous_data[0][core.REGEX])
+        self.assertIs(data[1][core.REGEX], previous_data[1][core.REGEX])
+        self.assertEqual(data[2][core.REGEX].pattern, "\\bkita\\b")
+
+    def test_get_file(self):
+        exported = core.get_file()
+
+        state.term_replace_all([])
+        state.term_replace_all(core.read_terms(exported))
+
+        self.assertEqual([row["regex"] for row in state.term_select_all()], ["bank\\w*", "visa|виза"])
+        self.assertEqual(core.get_file().getvalue(), exported.getvalue())
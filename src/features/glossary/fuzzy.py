@@ -0,0 +1,69 @@
+"""
+Fuzzy lookup of glossary terms
+
+Uses the symmetric delete approach (known as SymSpell): every key is stored along with all strings that can be obtained
+from it by deleting up to `max_distance` characters.  Two strings within edit distance `max_distance` of each other
+always share at least one such deletion, so a query only generates its own deletions, looks them up in the dictionary,
+and computes the exact distance for the few candidates found.  The cost of a lookup depends on the length of the query
+and not on the number of keys.
+"""
+
+import unicodedata
+
+from common.edit_distance import bit_parallel_distance
+
+
+def normalise(text: str) -> str:
+    """Return `text` without diacritics, in case-folded form"""
+
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn").casefold()
+
+
+def deletions(text: str, max_count: int) -> set[str]:
+    """Return all strings that can be obtained from `text` by deleting up to `max_count` characters, including `text`"""
+
+    result = {text}
+    frontier = {text}
+    for _ in range(max_count):
+        frontier = {s[:i] + s[i + 1:] for s in frontier for i in range(len(s))}
+        result |= frontier
+    return result
+
+
+class FuzzyIndex:
+    """Finds keys that are within a small edit distance from a query
+
+    Keys and queries are normalised with `normalise()`, so that case and diacritics do not matter.
+    """
+
+    def __init__(self, keys: list[str], max_distance: int = 2):
+        self._max_distance = max_distance
+        self._keys = [normalise(key) for key in keys]
+
+        # Maps a deletion to indices of keys it was obtained from
+        self._deletions: dict[str, list[int]] = {}
+        for key_index, key in enumerate(self._keys):
+            for deletion in deletions(key, max_distance):
+                self._deletions.setdefault(deletion, []).append(key_index)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def find(self, query: str) -> list[tuple[int, int]]:
+        """Return (distance, key index) tuples of keys within the maximum distance from `query`, closest first"""
+
+        query = normalise(query)
+
+        candidates = set()
+        for deletion in deletions(query, self._max_distance):
+            candidates.update(self._deletions.get(deletion, ()))
+
+        result = []
+        for key_index in candidates:
+            key = self._keys[key_index]
+            if abs(len(key) - len(query)) > self._max_distance:
+                continue
+            distance = bit_parallel_distance(query, key)
+            if distance <= self._max_distance:
+                result.append((distance, key_index))
+        return sorted(result)
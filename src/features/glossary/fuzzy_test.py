@@ -0,0 +1,56 @@
+"""
+Tests for fuzzy.py
+"""
+
+import random
+import unittest
+
+from common.edit_distance import damerau_levenshtein_distance
+from . import fuzzy
+
+
+class TestHelpers(unittest.TestCase):
+    def test_normalise(self):
+        self.assertEqual(fuzzy.normalise("Aufenthaltstitel"), "aufenthaltstitel")
+        self.assertEqual(fuzzy.normalise("Führerschein"), "fuhrerschein")
+        self.assertEqual(fuzzy.normalise("Straße"), "strasse")
+        self.assertEqual(fuzzy.normalise("Ёлка"), "елка")
+
+    def test_deletions(self):
+        self.assertEqual(fuzzy.deletions("", 2), {""})
+        self.assertEqual(fuzzy.deletions("ab", 1), {"ab", "a", "b"})
+        self.assertEqual(fuzzy.deletions("abc", 2), {"abc", "ab", "ac", "bc", "a", "b", "c"})
+
+
+class TestFuzzyIndex(unittest.TestCase):
+    def setUp(self):
+        self.keys = ["Anmeldung", "Abmeldung", "Führerschein", "Kindergeld", "Steuer-ID"]
+        self.index = fuzzy.FuzzyIndex(self.keys)
+
+    def test_exact(self):
+        self.assertEqual(self.index.find("Kindergeld"), [(0, 3)])
+        self.assertEqual(self.index.find("kindergeld"), [(0, 3)])
+        self.assertEqual(self.index.find("fuhrerschein"), [(0, 2)])
+
+    def test_typos(self):
+        self.assertEqual(self.index.find("Kindregeld"), [(1, 3)])
+        self.assertEqual(self.index.find("kindergld"), [(1, 3)])
+        self.assertEqual(self.index.find("Furerschien"), [(2, 2)])
+        self.assertEqual(self.index.find("Anmeldung"), [(0, 0), (1, 1)])
+        self.assertEqual(self.index.find("meldung"), [(2, 0), (2, 1)])
+
+    def test_not_found(self):
+        self.assertEqual(self.index.find("Kndrgld"), [])
+        self.assertEqual(self.index.find(""), [])
+        self.assertEqual(fuzzy.FuzzyIndex([]).find("Kindergeld"), [])
+
+    def test_same_as_linear_scan(self):
+        rng = random.Random(1)
+        keys = ["".join(rng.choice("abcd") for _ in range(rng.randint(1, 7))) for _ in range(200)]
+        index = fuzzy.FuzzyIndex(keys)
+
+        for _ in range(200):
+            query = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 7)))
+            expected = sorted((d, i) for i, key in enumerate(keys)
+                              if (d := damerau_levenshtein_distance(query, key)) <= 2)
+            self.assertEqual(index.find(query), expected, query)
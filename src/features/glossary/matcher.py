@@ -0,0 +1,193 @@
+"""
+Single-pass search of many glossary triggers in a message
+
+A plain alternation of all trigger regexes does not help here: Python's regex engine tries every alternative at every
+position of the text, so a combined pattern is even slower than searching for each trigger separately.  Instead, the
+matcher extracts a literal prefix from every trigger regex (for example, "bank" from `\\bbank\\w*\\b`, or "visa" and
+"виза" from `\\b(visa|виза)\\b`), and indexes the triggers by the first one or two characters of their prefixes.  A
+message is scanned once; at every position only the triggers whose prefix starts there are verified with their own
+regexes.
+
+Triggers that have no literal prefix (for example, ones that start with a character class or an optional character)
+cannot be indexed and are searched for separately, as before.
+"""
+
+import re
+
+# Characters that have a special meaning in a regex outside a character class
+_SPECIAL_CHARACTERS = frozenset(".^$*+?{}[]|()\\")
+
+# Quantifiers that allow the preceding item to be absent
+_OPTIONAL_QUANTIFIERS = frozenset("?*{")
+
+# Escape sequences that match an empty string
+_ZERO_WIDTH_ESCAPES = frozenset("bBA")
+
+# Length of index keys.  Prefixes shorter than that are indexed by their full length.
+_KEY_LENGTH = 2
+
+
+def _scan(source: str, start: int = 0):
+    """Yield positions and characters of `source` that are neither escaped nor inside a character class, along with the
+    depth of groups at the moment"""
+
+    depth, i = 0, start
+    while i < len(source):
+        c = source[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            # A closing bracket right after the opening one (or after a negation) is a literal.
+            i += 1
+            if source[i:i + 1] == "^":
+                i += 1
+            if source[i:i + 1] == "]":
+                i += 1
+            while i < len(source) and source[i] != "]":
+                i += 2 if source[i] == "\\" else 1
+            i += 1
+            continue
+        if c == ")":
+            depth -= 1
+        yield i, c, depth
+        if c == "(":
+            depth += 1
+        i += 1
+
+
+def _split_alternatives(source: str) -> list[str]:
+    """Split `source` into its top-level alternatives"""
+
+    alternatives = []
+    start = 0
+    for i, c, depth in _scan(source):
+        if c == "|" and depth == 0:
+            alternatives.append(source[start:i])
+            start = i + 1
+    alternatives.append(source[start:])
+    return alternatives
+
+
+def _group(source: str, start: int) -> tuple[str | None, int]:
+    """Return the body of the group that opens at `start` and the position after the group
+
+    The body is None if the group is not a plain capturing or non-capturing one, e.g., a lookaround.
+    """
+
+    end = len(source)
+    for i, c, depth in _scan(source, start + 1):
+        if c == ")" and depth == -1:
+            end = i
+            break
+    body = source[start + 1:end]
+    if body.startswith("?:"):
+        body = body[2:]
+    elif body.startswith("?P<"):
+        body = body[body.find(">") + 1:]
+    elif body.startswith("?"):
+        body = None
+    return body, end + 1
+
+
+def _sequence_prefixes(source: str) -> list[str]:
+    """Return literal strings that every match of the regex `source` without top-level alternatives starts with one of
+
+    The result may contain an empty string, which means that some matches have no literal prefix.
+    """
+
+    prefix = []
+    i = 0
+    while i < len(source):
+        c = source[i]
+        if c == "(":
+            body, i = _group(source, i)
+            if body is None or source[i:i + 1] in _OPTIONAL_QUANTIFIERS:
+                break
+            head = "".join(prefix)
+            return [head + p for alternative in _split_alternatives(body) for p in _sequence_prefixes(alternative)]
+        if c == "\\":
+            escaped = source[i + 1:i + 2]
+            if escaped in _ZERO_WIDTH_ESCAPES:
+                i += 2
+                continue
+            if not escaped or escaped.isalnum():
+                break
+            c, i = escaped, i + 1
+        elif c in _SPECIAL_CHARACTERS:
+            break
+        i += 1
+
+        quantifier = source[i:i + 1]
+        if quantifier in _OPTIONAL_QUANTIFIERS:
+            break
+        prefix.append(c)
+        if quantifier == "+":
+            break
+    return ["".join(prefix)]
+
+
+def literal_prefixes(source: str) -> list[str] | None:
+    """Return literal strings that every match of the regex `source` starts with one of, or None if there are matches
+    that have no literal prefix"""
+
+    prefixes = [p for alternative in _split_alternatives(source) for p in _sequence_prefixes(alternative)]
+    return prefixes if all(prefixes) else None
+
+
+class TermMatcher:
+    """Finds all patterns from a list that occur in a text
+
+    The result is the same as calling `search()` of every pattern, except for exotic case-insensitive equivalences that
+    `str.lower()` does not produce (like the long s matching "s"), which the prefilter may miss.
+    """
+
+    def __init__(self, patterns: list[re.Pattern]):
+        self._patterns = patterns
+
+        # Maps a key to the list of (prefix, pattern index) tuples of patterns that have a prefix starting with the key
+        self._index: dict[str, list[tuple[str, int]]] = {}
+        # Indices of patterns that could not be indexed
+        self._unindexed: list[int] = []
+
+        for pattern_index, pattern in enumerate(patterns):
+            # In verbose patterns, whitespace is not a literal.
+            prefixes = None if pattern.flags & re.VERBOSE else literal_prefixes(pattern.pattern)
+            if prefixes is None:
+                self._unindexed.append(pattern_index)
+                continue
+            for prefix in set(p.lower() for p in prefixes):
+                self._index.setdefault(prefix[:_KEY_LENGTH], []).append((prefix, pattern_index))
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    @property
+    def unindexed_count(self) -> int:
+        return len(self._unindexed)
+
+    def _search_all(self, text: str, indices) -> set[int]:
+        return set(i for i in indices if self._patterns[i].search(text) is not None)
+
+    def find(self, text: str) -> list[int]:
+        """Return sorted indices of patterns that occur in `text`"""
+
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # Positions in the lowered text do not correspond to the original ones, so the index cannot be used.
+            return sorted(self._search_all(text, range(len(self._patterns))))
+
+        found = self._search_all(text, self._unindexed)
+
+        index = self._index
+        for position in range(len(text)):
+            for key_length in range(1, _KEY_LENGTH + 1):
+                candidates = index.get(lowered[position:position + key_length])
+                if candidates is None:
+                    continue
+                for prefix, pattern_index in candidates:
+                    if (pattern_index not in found and lowered.startswith(prefix, position) and
+                            self._patterns[pattern_index].match(text, position) is not None):
+                        found.add(pattern_index)
+
+        return sorted(found)
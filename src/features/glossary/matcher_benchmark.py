@@ -0,0 +1,81 @@
+"""
+Benchmark of glossary trigger lookup: searching every trigger regex separately vs. `TermMatcher`
+
+Generates a synthetic glossary with trigger regexes shaped like real ones (word stems with suffixes, alternatives of
+spellings, character classes) and a set of messages that mention a few of the terms, checks that both approaches find
+the same terms, and prints the time per message.  Run from the `src` directory:
+
+    python -m features.glossary.matcher_benchmark --terms 5000
+"""
+
+import argparse
+import random
+import re
+import sys
+from time import perf_counter
+
+from .matcher import TermMatcher
+
+_LETTERS = "abcdefghijklmnopqrstuvwxyzабвгдежзийклмнопрстуфхцчшщыэюя"
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(_LETTERS) for _ in range(rng.randint(4, 10)))
+
+
+def _regex(rng: random.Random, stem: str) -> str:
+    shape = rng.random()
+    if shape < 0.5:
+        return stem + "\\w*"
+    if shape < 0.8:
+        return "(?:{}|{})\\w{{0,3}}".format(stem, stem[:-1] + rng.choice(_LETTERS))
+    if shape < 0.95:
+        return "{}{}?{}".format(stem[:2], stem[2], stem[3:])
+    # Starts with a character class, so cannot be indexed
+    return "[{}{}]{}".format(stem[0], rng.choice(_LETTERS), stem[1:])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark glossary trigger lookup")
+    parser.add_argument("--terms", type=int, default=5000, help="number of terms in the glossary")
+    parser.add_argument("--messages", type=int, default=200, help="number of messages to look up triggers in")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the random generator")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stems = [_word(rng) for _ in range(args.terms)]
+    patterns = [re.compile("\\b{}\\b".format(_regex(rng, stem)), re.IGNORECASE) for stem in stems]
+
+    messages = []
+    for _ in range(args.messages):
+        words = [_word(rng) for _ in range(rng.randint(5, 60))]
+        for _ in range(rng.randint(0, 3)):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(stems).capitalize())
+        messages.append(" ".join(words))
+
+    start = perf_counter()
+    matcher = TermMatcher(patterns)
+    build_time = perf_counter() - start
+    print("Terms: {}, not indexed: {}, matcher built in {:.1f} ms".format(len(matcher), matcher.unindexed_count,
+                                                                          build_time * 1000))
+
+    start = perf_counter()
+    expected = [[i for i, pattern in enumerate(patterns) if pattern.search(text) is not None] for text in messages]
+    loop_time = perf_counter() - start
+
+    start = perf_counter()
+    actual = [matcher.find(text) for text in messages]
+    matcher_time = perf_counter() - start
+
+    if actual != expected:
+        print("Results differ!")
+        return 1
+
+    print("Messages: {}, terms found: {}".format(len(messages), sum(len(found) for found in actual)))
+    print("Separate regexes: {:.3f} ms per message".format(loop_time / len(messages) * 1000))
+    print("TermMatcher:      {:.3f} ms per message".format(matcher_time / len(messages) * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Tests for matcher.py
+"""
+
+import re
+import unittest
+
+from . import matcher
+
+
+def _compile(source: str) -> re.Pattern:
+    return re.compile("\\b{}\\b".format(source), re.IGNORECASE)
+
+
+class TestLiteralPrefixes(unittest.TestCase):
+    def test_sequence(self):
+        self.assertEqual(matcher.literal_prefixes("bank"), ["bank"])
+        self.assertEqual(matcher.literal_prefixes("\\bbank\\w*\\b"), ["bank"])
+        self.assertEqual(matcher.literal_prefixes("ban?k"), ["ba"])
+        self.assertEqual(matcher.literal_prefixes("ban*k"), ["ba"])
+        self.assertEqual(matcher.literal_prefixes("ban{0,2}k"), ["ba"])
+        self.assertEqual(matcher.literal_prefixes("ban+k"), ["ban"])
+        self.assertEqual(matcher.literal_prefixes("c\\+\\+"), ["c++"])
+        self.assertEqual(matcher.literal_prefixes("b[ao]nk"), ["b"])
+        self.assertIsNone(matcher.literal_prefixes("[bp]ank"))
+        self.assertIsNone(matcher.literal_prefixes(".bank"))
+        self.assertIsNone(matcher.literal_prefixes("b?ank"))
+        self.assertIsNone(matcher.literal_prefixes("\\dbank"))
+        self.assertIsNone(matcher.literal_prefixes(""))
+
+    def test_alternatives(self):
+        self.assertEqual(matcher.literal_prefixes("\\bvisa|виза\\b"), ["visa", "виза"])
+        self.assertEqual(matcher.literal_prefixes("\\bab[]|]c|de\\b"), ["ab", "de"])
+        self.assertEqual(matcher.literal_prefixes("\\bab\\|c|de\\b"), ["ab|c", "de"])
+        self.assertIsNone(matcher.literal_prefixes("\\b.a|de\\b"))
+
+    def test_groups(self):
+        self.assertEqual(matcher.literal_prefixes("\\b(visa|виза)\\b"), ["visa", "виза"])
+        self.assertEqual(matcher.literal_prefixes("ba(?:n|m)k"), ["ban", "bam"])
+        self.assertEqual(matcher.literal_prefixes("(?P<x>a(b|c)|d)+e"), ["ab", "ac", "d"])
+        self.assertEqual(matcher.literal_prefixes("b(a[(]|o)"), ["ba", "bo"])
+        self.assertEqual(matcher.literal_prefixes("ba(n|m)?k"), ["ba"])
+        self.assertIsNone(matcher.literal_prefixes("(a|)b"))
+        self.assertIsNone(matcher.literal_prefixes("(?=a)ab"))
+        self.assertIsNone(matcher.literal_prefixes("(?i)ab"))
+
+
+class TestTermMatcher(unittest.TestCase):
+    def setUp(self):
+        self.sources = ["bank\\w*", "visa|виза", "(?:страховк|insuranc)\\w+", "[bp]ension", "c\\+\\+", "ИНН", "b"]
+        self.patterns = [_compile(source) for source in self.sources]
+        self.matcher = matcher.TermMatcher(self.patterns)
+
+    def assert_same_as_search(self, text: str):
+        expected = [i for i, pattern in enumerate(self.patterns) if pattern.search(text) is not None]
+        self.assertEqual(self.matcher.find(text), expected, text)
+
+    def test_unindexed(self):
+        self.assertEqual(len(self.matcher), len(self.sources))
+        self.assertEqual(self.matcher.unindexed_count, 1)
+
+    def test_find(self):
+        self.assertEqual(self.matcher.find(""), [])
+        self.assertEqual(self.matcher.find("Nothing to see here"), [])
+        self.assertEqual(self.matcher.find("My BANKING app shows my pension"), [0, 3])
+        self.assertEqual(self.matcher.find("Нужна виза и страховка, а инн есть"), [1, 2, 5])
+        self.assertEqual(self.matcher.find("b"), [6])
+
+    def test_same_as_search(self):
+        for text in ("banks, visas and insurances", "visa and c++ (or C++) at the bank", "embank", "abank b",
+                     "Paid the Bank with VISA", "Straße İstanbul bank", "ИНН: 1234, ВИЗА"):
+            self.assert_same_as_search(text)
+
+    def test_case_sensitive(self):
+        patterns = [re.compile("\\bBank\\b"), re.compile("\\bbank\\b")]
+        self.assertEqual(matcher.TermMatcher(patterns).find("the Bank"), [0])
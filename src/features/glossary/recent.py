@@ -0,0 +1,78 @@
+"""
+Glossary terms found recently in each chat
+"""
+
+from collections import deque
+from collections.abc import Hashable
+
+
+class RecentTriggers:
+    """Remembers which terms were triggered recently, separately for every conversation
+
+    A conversation is identified by an arbitrary key, like a tuple of a chat ID and a forum topic ID.  Every
+    conversation has a buffer of (timestamp, term ID) pairs ordered by time, so that old triggers are removed from the
+    head of the buffer, and a dictionary that counts triggers of every term in the buffer.  Listing the recent terms
+    therefore costs as many operations as there are recent triggers, regardless of the size of the glossary.
+
+    A buffer holds at most `max_count` triggers, the oldest ones are forgotten when a new one does not fit.
+    """
+
+    def __init__(self, max_age: float, max_count: int):
+        self._max_age = max_age
+        self._max_count = max_count
+
+        self._buffers: dict[Hashable, deque[tuple[float, int]]] = {}
+        self._counts: dict[Hashable, dict[int, int]] = {}
+
+    def __len__(self) -> int:
+        """Return number of conversations that have recent triggers"""
+
+        return len(self._buffers)
+
+    def _pop_oldest(self, key: Hashable) -> None:
+        _timestamp, term_id = self._buffers[key].popleft()
+
+        counts = self._counts[key]
+        counts[term_id] -= 1
+        if counts[term_id] == 0:
+            del counts[term_id]
+
+    def expire(self, key: Hashable, now: float) -> None:
+        """Forget triggers in the conversation `key` that are older than the maximum age at the moment `now`"""
+
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            return
+
+        oldest_timestamp = now - self._max_age
+        while buffer and buffer[0][0] < oldest_timestamp:
+            self._pop_oldest(key)
+
+        if not buffer:
+            self.clear(key)
+
+    def add(self, key: Hashable, term_ids: list[int], now: float) -> None:
+        """Register triggers of terms `term_ids` in the conversation `key` at the moment `now`"""
+
+        self.expire(key, now)
+
+        buffer = self._buffers.setdefault(key, deque())
+        counts = self._counts.setdefault(key, {})
+        for term_id in term_ids:
+            if len(buffer) >= self._max_count:
+                self._pop_oldest(key)
+            buffer.append((now, term_id))
+            counts[term_id] = counts.get(term_id, 0) + 1
+
+    def terms(self, key: Hashable, now: float) -> list[int]:
+        """Return IDs of distinct terms triggered in the conversation `key` recently as of the moment `now`"""
+
+        self.expire(key, now)
+
+        return list(self._counts.get(key, ()))
+
+    def clear(self, key: Hashable) -> None:
+        """Forget all triggers in the conversation `key`"""
+
+        self._buffers.pop(key, None)
+        self._counts.pop(key, None)
@@ -0,0 +1,47 @@
+"""
+Tests for recent.py
+"""
+
+import unittest
+
+from .recent import RecentTriggers
+
+
+class TestRecentTriggers(unittest.TestCase):
+    def setUp(self):
+        self.triggers = RecentTriggers(60, 5)
+
+    def test_terms(self):
+        self.triggers.add("chat", [1, 2], 0)
+        self.triggers.add("chat", [1, 3], 10)
+
+        self.assertEqual(self.triggers.terms("chat", 20), [1, 2, 3])
+        self.assertEqual(self.triggers.terms("other chat", 20), [])
+
+    def test_conversations_are_separate(self):
+        self.triggers.add((1, None), [1], 0)
+        self.triggers.add((1, 5), [2], 0)
+
+        self.assertEqual(self.triggers.terms((1, None), 0), [1])
+        self.assertEqual(self.triggers.terms((1, 5), 0), [2])
+
+        self.triggers.clear((1, None))
+        self.assertEqual(self.triggers.terms((1, None), 0), [])
+        self.assertEqual(self.triggers.terms((1, 5), 0), [2])
+
+    def test_expiry(self):
+        self.triggers.add("chat", [1, 2], 0)
+        self.triggers.add("chat", [1], 30)
+
+        # Term 1 was triggered again, so it stays while term 2 expires.
+        self.assertEqual(self.triggers.terms("chat", 61), [1])
+        self.assertEqual(len(self.triggers), 1)
+
+        self.assertEqual(self.triggers.terms("chat", 91), [])
+        self.assertEqual(len(self.triggers), 0)
+
+    def test_max_count(self):
+        self.triggers.add("chat", [1, 2, 3], 0)
+        self.triggers.add("chat", [4, 5, 6, 7], 1)
+
+        self.assertEqual(self.triggers.terms("chat", 1), [3, 4, 5, 6, 7])
@@ -0,0 +1,80 @@
+"""
+Persistent state of the glossary feature
+"""
+
+from collections.abc import Iterable, Iterator
+
+from common import db
+
+# Columns of the `glossary_terms` table that describe a term, in the order they go in the CSV file
+COLUMNS = ("regex", "standard", "original", "explanation")
+
+
+def term_select_all() -> Iterator[dict]:
+    """Query all terms ordered by their IDs"""
+
+    return db.sql_query("SELECT id, regex, standard, original, explanation FROM glossary_terms ORDER BY id")
+
+
+def term_insert(regex: str, standard: str, original: str, explanation: str) -> int:
+    """Add a new term and return its ID"""
+
+    c = db.cursor()
+    c.execute("INSERT INTO glossary_terms (regex, standard, original, explanation) VALUES(?, ?, ?, ?)",
+              (regex, standard, original, explanation))
+    db.commit()
+
+    return c.lastrowid
+
+
+# noinspection PyShadowingBuiltins
+def term_update(id: int, regex: str, standard: str, original: str, explanation: str) -> bool:
+    """Change the term identified by `id` and return whether it exists"""
+
+    c = db.cursor()
+    c.execute("UPDATE glossary_terms SET regex=?, standard=?, original=?, explanation=? WHERE id=?",
+              (regex, standard, original, explanation, id))
+    db.commit()
+
+    return c.rowcount > 0
+
+
+# noinspection PyShadowingBuiltins
+def term_delete(id: int) -> bool:
+    """Delete the term identified by `id` and return whether it existed"""
+
+    c = db.cursor()
+    c.execute("DELETE FROM glossary_terms WHERE id=?", (id,))
+    db.commit()
+
+    return c.rowcount > 0
+
+
+def term_replace_all(terms: Iterable[tuple]) -> None:
+    """Replace all terms with `terms` in a single transaction
+
+    Every item of `terms` is a tuple of values for `COLUMNS`, optionally preceded with the term ID.  Terms that have no
+    ID get new ones.
+    """
+
+    c = db.cursor()
+    try:
+        c.execute("DELETE FROM glossary_terms")
+        for term in terms:
+            if len(term) == len(COLUMNS):
+                c.execute("INSERT INTO glossary_terms (regex, standard, original, explanation) VALUES(?, ?, ?, ?)",
+                          term)
+            else:
+                c.execute("INSERT INTO glossary_terms (id, regex, standard, original, explanation) "
+                          "VALUES(?, ?, ?, ?, ?)", term)
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+
+
+def term_count() -> int:
+    """Return number of terms"""
+
+    for row in db.sql_query("SELECT COUNT(1) AS term_count FROM glossary_terms"):
+        return row["term_count"]
@@ -0,0 +1,55 @@
+"""
+Tests for state.py
+"""
+
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+
+from common import db
+from . import state
+
+
+class TestTerms(unittest.TestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+
+    def tearDown(self):
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+    def _all(self) -> list[tuple]:
+        return [tuple(row.values()) for row in state.term_select_all()]
+
+    def test_insert_update_delete(self):
+        self.assertEqual(state.term_count(), 0)
+
+        first_id = state.term_insert("bank\\w*", "bank", "Bank", "A bank")
+        second_id = state.term_insert("visa", "visa", "Visum", "A visa")
+        self.assertEqual(state.term_count(), 2)
+
+        self.assertTrue(state.term_update(first_id, "banks?", "bank", "Bank", "A financial institution"))
+        self.assertFalse(state.term_update(100, "x", "x", "x", "x"))
+        self.assertEqual(self._all(), [(first_id, "banks?", "bank", "Bank", "A financial institution"),
+                                       (second_id, "visa", "visa", "Visum", "A visa")])
+
+        self.assertTrue(state.term_delete(first_id))
+        self.assertFalse(state.term_delete(first_id))
+        self.assertEqual(self._all(), [(second_id, "visa", "visa", "Visum", "A visa")])
+
+    def test_replace_all(self):
+        state.term_insert("bank", "bank", "Bank", "A bank")
+
+        state.term_replace_all([(10, "visa", "visa", "Visum", "A visa"), ("kita", "kita", "Kita", "A kindergarten")])
+        self.assertEqual(self._all(), [(10, "visa", "visa", "Visum", "A visa"),
+                                       (11, "kita", "kita", "Kita", "A kindergarten")])
+
+        # Duplicate IDs fail the entire import.
+        with self.assertRaises(sqlite3.IntegrityError):
+            state.term_replace_all([(1, "a", "a", "a", "a"), (1, "b", "b", "b", "b")])
+        self.assertEqual(state.term_count(), 2)
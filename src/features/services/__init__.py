@@ -1,2 +1,2 @@
-from .core import init, post_init, show_main_status, handle_extended_start_command
+from .core import init, post_init, post_shutdown, show_main_status, handle_extended_start_command
 from .keyboards import standard as get_standard_keyboard
@@ -7,6 +7,7 @@ import io
 import json
 import logging
 import pathlib
+import tempfile
 
 import jsonschema
 from telegram import InlineKeyboardButton, Update
@@ -38,8 +39,13 @@ async def _handle_query(update: Update, _context: ContextTypes.DEFAULT_TYPE) ->
     trans = i18n.trans(user)
 
     if query.data == _ADMIN_EXPORT_DB:
-        await user.send_document(json.dumps(state.export_db(), ensure_ascii=False, indent=2).encode("utf-8"),
-                                 filename="services.json", reply_markup=None)
+        with tempfile.TemporaryFile() as export_file:
+            writer = io.TextIOWrapper(export_file, encoding="utf-8")
+            state.write_db(writer)
+            writer.detach()
+
+            export_file.seek(0)
+            await user.send_document(export_file, filename="services.json", reply_markup=None)
     elif query.data == _ADMIN_IMPORT_DB:
         await reply(update, trans.gettext("SERVICES_MESSAGE_DM_ADMIN_REQUEST_DB"))
 
@@ -66,7 +72,6 @@ async def _handle_received_db(update: Update, _context: ContextTypes.DEFAULT_TYP
         schema = json.load(open(pathlib.Path(__file__).parent / "schema.json"))
 
         jsonschema.validate(data, schema)
-        # TODO: Validate data integrity.
 
         state.import_db(data)
 
@@ -74,6 +79,10 @@ async def _handle_received_db(update: Update, _context: ContextTypes.DEFAULT_TYP
     except jsonschema.ValidationError as e:
         logging.error(e)
         await reply(update, trans.gettext("SERVICES_MESSAGE_DM_ADMIN_INVALID_JSON"), get_main_keyboard())
+    except state.InvalidData as e:
+        logging.error(e)
+        await reply(update, trans.gettext("SERVICES_MESSAGE_DM_ADMIN_INCONSISTENT_DB {error}").format(error=str(e)),
+                    get_main_keyboard())
     except Exception as e:
         logging.error(e)
         await reply(update, trans.gettext("ADMIN_MESSAGE_DM_INTERNAL_ERROR"), get_main_keyboard())
@@ -2,30 +2,27 @@
 Registry of services
 """
 
+import asyncio
 import copy
 import datetime
 import logging
 import re
 from collections.abc import Awaitable, Callable
+from time import perf_counter
 
-from telegram import ChatMemberBanned, ChatMemberLeft, Update
-from telegram.error import BadRequest
+from telegram import Update
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import Application, CallbackQueryHandler, ContextTypes, ConversationHandler, filters, MessageHandler
 
-from common import i18n
+from common import i18n, members
 from common.bot import reply, send
+from common.rate_limit import RateLimiter
 from common.settings import settings
-from . import admin, const, keyboards, render, state
+from . import admin, const, directory, keyboards, render, state
 
-
-def _get_all_services() -> dict:
-    result = {}
-    for service in state.Service.get_all_active():
-        if service.category.id not in result:
-            result[service.category.id] = []
-        result[service.category.id].append(service)
-
-    return result
+# Name of the job that pings providers, and the moment when it is scheduled to run
+_PING_JOB_NAME = "services_ping"
+_ping_job_time: datetime.datetime | None = None
 
 
 async def _verify_limit_then_retry_or_proceed(update: Update, context: ContextTypes.DEFAULT_TYPE, current_stage_id: int,
@@ -140,57 +137,83 @@ async def _moderate_new_data(context: ContextTypes.DEFAULT_TYPE, data) -> None:
             occupation=data["occupation"], username=data["tg_username"]), keyboards.approve_service_change(data))
 
 
-async def _who_request_category(update: Update, context: ContextTypes.DEFAULT_TYPE, categorised_people: dict) -> int:
+async def _show_category_page(update: Update, services_directory: directory.Directory, category_id: int,
+                              after: str | None = None, before: str | None = None) -> None:
+    """Show a page of services in the category, or the entire category if it fits in a single message
+
+    See `directory.Directory.category_page()` for the meaning of `after` and `before`.
+    """
+
+    user = update.callback_query.from_user
+
+    text, previous_cursor, next_cursor = services_directory.category_page(category_id, settings.MAX_MESSAGE_LENGTH,
+                                                                          after, before)
+
+    await reply(update, text, keyboards.directory_page(user, category_id, previous_cursor, next_cursor))
+
+
+async def _who_request_category(update: Update, _context: ContextTypes.DEFAULT_TYPE,
+                                services_directory: directory.Directory) -> int:
     """Ask user for a category to show"""
 
-    if not categorised_people:
+    if not services_directory.categories:
         raise RuntimeError("Cannot request a category: no people to show")
 
     query = update.callback_query
 
     await query.edit_message_reply_markup(None)
 
-    categories = []
-
-    for category in state.ServiceCategory.all():
-        if category.id not in categorised_people:
-            continue
-
-        categories.append(category)
-
     trans = i18n.trans(query.from_user)
     await reply(update, render.prepend_disclaimer(trans, trans.gettext("SERVICES_DM_WHO_CATEGORY_LIST")),
-                keyboards.select_category(categories))
-
-    context.user_data["who_request_category"] = categorised_people
+                keyboards.select_category(services_directory.categories))
 
     return const.SELECTING_CATEGORY
 
 
-async def _who_received_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def _who_received_category(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> int:
     """List users in the category that the user selected previously"""
 
     query = update.callback_query
 
     await query.edit_message_reply_markup(None)
 
-    categorised_people = context.user_data["who_request_category"]
+    trans = i18n.trans(query.from_user)
+
+    services_directory = directory.get(trans)
     category_id = int(query.data)
-    if category_id not in categorised_people:
+    if category_id not in services_directory.services:
         raise RuntimeError(f"No category {category_id}")
 
-    trans = i18n.trans(query.from_user)
+    state.ServiceCategoryStats.register(query.from_user.id, category_id)
 
-    category = state.ServiceCategory.get(category_id)
+    await _show_category_page(update, services_directory, category_id)
 
-    state.ServiceCategoryStats.register(query.from_user.id, category_id)
+    return ConversationHandler.END
 
-    message = render.category_with_services(category, categorised_people[category.id], True)
 
-    await reply(update, render.append_disclaimer(trans, message), keyboards.standard(query.from_user))
+async def _handle_directory_page(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show another page of a category that does not fit in a single message"""
 
-    del context.user_data["who_request_category"]
-    return ConversationHandler.END
+    query = update.callback_query
+
+    await query.edit_message_reply_markup(None)
+
+    _command, category_id, direction, cursor = query.data.split(":", 3)
+    category_id = int(category_id)
+
+    trans = i18n.trans(query.from_user)
+
+    services_directory = directory.get(trans)
+
+    # The directory may have changed since the page was shown.
+    if category_id not in services_directory.services:
+        await reply(update, trans.gettext("SERVICES_DM_WHO_CATEGORY_EMPTY"), keyboards.standard(query.from_user))
+        return
+
+    if direction == const.DIRECTORY_PAGE_BEFORE:
+        await _show_category_page(update, services_directory, category_id, before=cursor)
+    else:
+        await _show_category_page(update, services_directory, category_id, after=cursor)
 
 
 async def _handle_command_who(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -199,30 +222,56 @@ async def _handle_command_who(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     trans = i18n.trans(query.from_user)
 
-    categorised_services = _get_all_services()
+    services_directory = directory.get(trans)
 
-    if not categorised_services:
+    if not services_directory.categories:
         await reply(update, trans.gettext("SERVICES_DM_WHO_EMPTY"), keyboards.standard(query.from_user))
         return ConversationHandler.END
 
     state.ServiceCategoryStats.register(query.from_user.id, -1)
 
-    if len(categorised_services) == 1:
-        united_message = render.categories_with_services(trans, categorised_services)
-        await reply(update, united_message, keyboards.standard(query.from_user))
+    if len(services_directory.categories) == 1:
+        if len(services_directory.text) < settings.MAX_MESSAGE_LENGTH:
+            await reply(update, services_directory.text, keyboards.standard(query.from_user))
+        else:
+            await _show_category_page(update, services_directory, services_directory.categories[0].id)
         return ConversationHandler.END
 
     if settings.SHOW_CATEGORIES_ALWAYS:
-        return await _who_request_category(update, context, categorised_services)
+        return await _who_request_category(update, context, services_directory)
     else:
-        united_message = render.categories_with_services(trans, categorised_services)
-
-        if len(united_message) < settings.MAX_MESSAGE_LENGTH:
+        if len(services_directory.text) < settings.MAX_MESSAGE_LENGTH:
             await query.edit_message_reply_markup(None)
-            await reply(update, united_message, keyboards.standard(query.from_user))
+            await reply(update, services_directory.text, keyboards.standard(query.from_user))
             return ConversationHandler.END
         else:
-            return await _who_request_category(update, context, categorised_services)
+            return await _who_request_category(update, context, services_directory)
+
+
+async def _handle_command_search(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Start the conversation about searching for services"""
+
+    query = update.callback_query
+
+    await query.edit_message_reply_markup(None)
+
+    trans = i18n.trans(query.from_user)
+    await reply(update, trans.gettext("SERVICES_DM_SEARCH_ASK"))
+
+    return const.TYPING_SEARCH_QUERY
+
+
+async def _search_received_query(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Show services that match the text that the user sent"""
+
+    message = update.message
+    trans = i18n.trans(message.from_user)
+
+    services = state.Service.search(message.text, settings.SERVICES_SEARCH_MAX_RESULTS)
+
+    await reply(update, render.search_results(trans, services), keyboards.standard(message.from_user))
+
+    return ConversationHandler.END
 
 
 async def _handle_command_enroll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -542,7 +591,10 @@ async def handle_extended_start_command(update: Update, _context: ContextTypes.D
 async def _ping_provider(context: ContextTypes.DEFAULT_TYPE, provider: state.Provider) -> None:
     records = [r for r in state.Service.get_all_by_user(provider.tg_id)]
 
-    assert records
+    if not records:
+        logging.warning(f"User {provider} has no services to ping about")
+        provider.reset_ping_attempts_and_schedule_next_ping()
+        return
 
     trans = i18n.default()
 
@@ -555,6 +607,80 @@ async def _ping_provider(context: ContextTypes.DEFAULT_TYPE, provider: state.Pro
                keyboards.ping(trans, provider.tg_id))
 
 
+def _utc_now() -> datetime.datetime:
+    """Return the current time in UTC, naive like ping dates stored in the DB"""
+
+    return datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+
+def _schedule_pings(application: Application, next_ping: datetime.datetime | None = None) -> None:
+    """Make sure that the ping job runs when the earliest ping is due
+
+    @param application: the application whose job queue runs the job.
+    @param next_ping: date of a ping that has just been scheduled.  If given, the job is only rescheduled when this ping
+    is due before the job would run.
+    """
+
+    global _ping_job_time
+
+    if next_ping is not None and _ping_job_time is not None and _ping_job_time <= next_ping:
+        return
+
+    for job in application.job_queue.get_jobs_by_name(_PING_JOB_NAME):
+        job.schedule_removal()
+
+    _ping_job_time = state.Provider.get_earliest_ping()
+    if _ping_job_time is None:
+        return
+
+    logging.info(f"Next ping is due at {_ping_job_time}")
+
+    application.job_queue.run_once(_ping_due_providers,
+                                   max(0.0, (_ping_job_time - _utc_now()).total_seconds()),
+                                   name=_PING_JOB_NAME)
+
+
+def _postpone_ping(provider: state.Provider) -> None:
+    """Try to ping the provider again later, so that a failed ping does not drop them from the ping schedule"""
+
+    # noinspection PyBroadException
+    try:
+        provider.postpone_ping()
+    except Exception as e:
+        logging.exception(f"Could not postpone the ping of provider {provider}: {e}")
+
+
+async def _ping_due_providers(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ping providers whose next ping is due, and delete ones that did not respond to all pings"""
+
+    global _ping_job_time
+
+    limiter = RateLimiter(settings.SERVICES_PROVIDER_CHECK_REQUESTS_PER_SECOND)
+
+    try:
+        for provider in state.Provider.pop_due_pings(_utc_now()):
+            try:
+                if provider.remaining_ping_count == 0:
+                    logging.info(f"User {provider} did not respond to pings")
+                    state.Provider.delete(provider.tg_id)
+                    continue
+
+                await limiter.acquire()
+                await _ping_provider(context, provider)
+            except BadRequest as e:
+                logging.info(f"Exception when pinging provider {provider}: {e}")
+                state.Provider.delete(provider.tg_id)
+            except TelegramError as e:
+                logging.warning(f"Could not ping provider {provider}: {e}")
+                _postpone_ping(provider)
+            except Exception as e:
+                logging.exception(f"Failed to ping provider {provider}: {e}")
+                _postpone_ping(provider)
+    finally:
+        _ping_job_time = None
+        _schedule_pings(context.application)
+
+
 async def _handle_pong(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
     """Approve or decline changes to user data"""
 
@@ -616,31 +742,82 @@ async def _handle_pong_confirm_delete(update: Update, _context: ContextTypes.DEF
         logging.error("Unexpected query data: '{}'".format(query.data))
 
 
+async def _check_provider(context: ContextTypes.DEFAULT_TYPE, provider: state.Provider, limiter: RateLimiter,
+                          report: dict) -> None:
+    """Check whether the provider is still in the main chat
+
+    Asks Telegram only if the roster of chat members does not know the answer.  Updates counters in `report`.  A
+    provider that has left the chat is added to the list of providers to remove.
+    """
+
+    try:
+        is_member = members.lookup(settings.MAIN_CHAT_ID, provider.tg_id)
+        if is_member is None:
+            await limiter.acquire()
+            is_member = await members.verify(context, settings.MAIN_CHAT_ID, provider.tg_id)
+        if not is_member:
+            logging.info(f"User {provider} is not found in the main chat")
+            report["removed"].append(provider.tg_id)
+
+    except BadRequest as e:
+        logging.info(f"Exception when checking provider {provider}: {e}")
+        report["removed"].append(provider.tg_id)
+    except TelegramError as e:
+        logging.warning(f"Could not check provider {provider}: {e}")
+        report["failed"] += 1
+
+
 async def _check_providers(context: ContextTypes.DEFAULT_TYPE) -> None:
-    logging.info("Checking if all providers are still in the main chat")
-
-    provider_ids_to_remove = []
-    for provider in state.Provider.get_all():
-        try:
-            chat_member = await context.bot.get_chat_member(settings.MAIN_CHAT_ID, provider.tg_id)
-            if isinstance(chat_member, ChatMemberLeft) or isinstance(chat_member, ChatMemberBanned):
-                logging.info(f"User {provider} is not found in the main chat")
-                provider_ids_to_remove.append(provider.tg_id)
-                continue
-
-            if datetime.datetime.now() > provider.next_ping:
-                if provider.remaining_ping_count > 0:
-                    await _ping_provider(context, provider)
-                else:
-                    provider_ids_to_remove.append(provider.tg_id)
-
-        except BadRequest as e:
-            logging.info(f"Exception when checking provider {provider}: {e}")
-            provider_ids_to_remove.append(provider.tg_id)
-
-    for provider_id in provider_ids_to_remove:
+    """Check providers of one shard, see `_check_provider()`
+
+    A provider belongs to the shard that equals their Telegram ID modulo SERVICES_PROVIDER_CHECK_SHARD_COUNT, the shard
+    number is the data of the job.  Providers are checked by a few concurrent workers that share a rate limiter.
+    Administrators are notified if any providers were removed or could not be checked.
+    """
+
+    shard, shard_count = context.job.data, settings.SERVICES_PROVIDER_CHECK_SHARD_COUNT
+
+    logging.info(f"Checking if providers of shard {shard + 1} of {shard_count} are still in the main chat")
+
+    providers = [provider for provider in state.Provider.get_all() if provider.tg_id % shard_count == shard]
+    limiter = RateLimiter(settings.SERVICES_PROVIDER_CHECK_REQUESTS_PER_SECOND)
+    report = {"removed": [], "failed": 0}
+
+    started_at = perf_counter()
+
+    async def worker() -> None:
+        # The iterator is shared, so every provider is taken by exactly one worker.
+        for provider in pending:
+            await _check_provider(context, provider, limiter, report)
+
+    pending = iter(providers)
+    await asyncio.gather(*(worker() for _ in range(settings.SERVICES_PROVIDER_CHECK_CONCURRENCY)))
+
+    for provider_id in report["removed"]:
         state.Provider.delete(provider_id)
 
+    duration = perf_counter() - started_at
+
+    logging.info(f"Checked {len(providers)} providers in {duration:.1f} s: {len(report['removed'])} removed, "
+                 f"{report['failed']} failed")
+
+    if not report["removed"] and not report["failed"]:
+        return
+
+    text = i18n.default().gettext(
+        "SERVICES_ADMIN_PROVIDER_CHECK_REPORT {shard} {shard_count} {checked} {removed} {failed} {duration}").format(
+        shard=shard + 1, shard_count=shard_count, checked=len(providers), removed=len(report["removed"]),
+        failed=report["failed"], duration=f"{duration:.1f}")
+    for admin_id in [a["id"] for a in settings.ADMINISTRATORS] if settings.ADMINISTRATORS else (
+            settings.DEVELOPER_CHAT_ID,):
+        await send(context, admin_id, text)
+
+
+async def _flush_stats(_context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Save view events collected since the previous run"""
+
+    state.flush_stats()
+
 
 async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle an incoming message.  This is the single entry point for all normal messages."""
@@ -668,7 +845,20 @@ def post_init(application: Application) -> None:
     # noinspection PyUnresolvedReferences
     state.Service.set_bot_username(application.bot.username)
 
-    application.job_queue.run_daily(_check_providers, datetime.time(settings.SERVICES_PROVIDER_PING_HOUR, 0, 0))
+    # Shards of providers are checked at equal intervals through the day, the first one at SERVICES_PROVIDER_PING_HOUR.
+    shard_count = settings.SERVICES_PROVIDER_CHECK_SHARD_COUNT
+    for shard in range(shard_count):
+        minutes = settings.SERVICES_PROVIDER_PING_HOUR * 60 + shard * 24 * 60 // shard_count
+        application.job_queue.run_daily(_check_providers, datetime.time(minutes // 60 % 24, minutes % 60, 0),
+                                        data=shard)
+    application.job_queue.run_repeating(_flush_stats, settings.SERVICES_STATS_FLUSH_INTERVAL_SECONDS)
+
+    state.Provider.set_ping_listener(lambda next_ping: _schedule_pings(application, next_ping))
+    _schedule_pings(application)
+
+
+def post_shutdown(_application: Application) -> None:
+    state.flush_stats()
 
 
 def init(application: Application, group: int) -> None:
@@ -686,19 +876,33 @@ def init(application: Application, group: int) -> None:
                 const.TYPING_LOCATION: [
                     MessageHandler(filters.TEXT & (~ filters.COMMAND), _verify_location_and_request_legality)],
                 const.CONFIRMING_LEGALITY: [CallbackQueryHandler(_verify_legality_and_finalise_data_collection)]},
-        fallbacks=[MessageHandler(filters.ALL, _abort_conversation)]), group=group)
+        fallbacks=[MessageHandler(filters.ALL, _abort_conversation)], name="services_enroll", persistent=True),
+        group=group)
 
     application.add_handler(
         ConversationHandler(entry_points=[CallbackQueryHandler(_handle_command_who, pattern=const.COMMAND_WHO)],
                             states={const.SELECTING_CATEGORY: [
                                 CallbackQueryHandler(_who_received_category)]},
-                            fallbacks=[MessageHandler(filters.ALL, _abort_conversation)]),
+                            fallbacks=[MessageHandler(filters.ALL, _abort_conversation)], name="services_who",
+                            persistent=True),
         group=group)
 
+    application.add_handler(
+        ConversationHandler(entry_points=[CallbackQueryHandler(_handle_command_search, pattern=const.COMMAND_SEARCH)],
+                            states={const.TYPING_SEARCH_QUERY: [
+                                MessageHandler(filters.TEXT & (~ filters.COMMAND), _search_received_query)]},
+                            fallbacks=[MessageHandler(filters.ALL, _abort_conversation)], name="services_search",
+                            persistent=True), group=group)
+
     application.add_handler(
         ConversationHandler(entry_points=[CallbackQueryHandler(_handle_command_retire, pattern=const.COMMAND_RETIRE)],
                             states={const.SELECTING_CATEGORY: [CallbackQueryHandler(_retire_received_category)]},
-                            fallbacks=[MessageHandler(filters.ALL, _abort_conversation)]), group=group)
+                            fallbacks=[MessageHandler(filters.ALL, _abort_conversation)], name="services_retire",
+                            persistent=True), group=group)
+
+    application.add_handler(CallbackQueryHandler(_handle_directory_page, pattern=re.compile(
+        "^{page}:[0-9]+:({before}|{after}):\\w+$".format(page=const.DIRECTORY_PAGE, before=const.DIRECTORY_PAGE_BEFORE,
+                                                        after=const.DIRECTORY_PAGE_AFTER))), group=group)
 
     application.add_handler(CallbackQueryHandler(_handle_pong, pattern=re.compile(
         "^({confirm}|{edit}|{delete}):[0-9]+$".format(confirm=const.PING_CONFIRM_ALL, edit=const.PING_CONFIRM_EDIT,
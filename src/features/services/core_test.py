@@ -2,14 +2,16 @@
 Tests for the core.py
 """
 import copy
+import logging
 import unittest
-from unittest.mock import call
+from unittest.mock import call, MagicMock
 
-from telegram import Chat, Message, Update
+from telegram import Chat, ChatMemberLeft, ChatMemberMember, Message, Update
+from telegram.error import BadRequest, NetworkError
 from telegram.ext import Application, CallbackContext, ConversationHandler
 
 from common import i18n, test_util
-from . import const, core, keyboards, render
+from . import const, core, directory, keyboards, render
 from .test_util import *
 
 
@@ -28,6 +30,7 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
 
     def tearDown(self):
         load_test_categories(0)
+        load_test_services([])
 
     def _create_chat_user_context(self, username=None) -> tuple[Chat, User, CallbackContext]:
         """Create a set of objects needed in many test cases"""
@@ -147,7 +150,10 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
 
     @patch("features.services.core.reply")
     async def test_show_main_status(self, mock_reply):
-        tg_id = 1234215
+        chat, user, context = self._create_chat_user_context()
+        update = self._create_update_with_message(chat, from_user=user)
+
+        tg_id = user.id
 
         def return_single_record(_where_clause: str = "", _where_params: tuple = ()) -> Iterator[dict]:
             yield data_row_for_service(tg_id, 1)
@@ -161,58 +167,58 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
 
         state.Service.set_bot_username("bot_username")
 
-        chat, user, context = self._create_chat_user_context()
-        update = self._create_update_with_message(chat, from_user=user)
-
         main_chat = await context.bot.get_chat(1)
         chat_title = main_chat.title
 
         trans = i18n.default()
 
-        with patch_service__do_select_query_return_nothing():
-            expected_text = trans.gettext("SERVICES_DM_HELLO {bot_first_name} {main_chat_name}").format(
-                bot_first_name=context.bot.first_name, main_chat_name=chat_title)
+        load_test_services([])
 
-            load_test_categories(0)
+        expected_text = trans.gettext("SERVICES_DM_HELLO {bot_first_name} {main_chat_name}").format(
+            bot_first_name=context.bot.first_name, main_chat_name=chat_title)
 
-            await core.show_main_status(update, context)
-            mock_reply.assert_called_once_with(update, expected_text, keyboards.standard(user))
-            mock_reply.reset_mock()
+        load_test_categories(0)
 
-            load_test_categories(1)
+        await core.show_main_status(update, context)
+        mock_reply.assert_called_once_with(update, expected_text, keyboards.standard(user))
+        mock_reply.reset_mock()
 
-            await core.show_main_status(update, context)
-            mock_reply.assert_called_once_with(update, expected_text, keyboards.standard(user))
-            mock_reply.reset_mock()
+        load_test_categories(1)
 
-        with patch("features.services.state.Service._do_select_query", return_single_record):
-            expected_text = "\n".join(
-                [trans.gettext("SERVICES_DM_HELLO_AGAIN {user_first_name}").format(user_first_name=user.first_name),
-                 render.service_description_for_owner(state.Service(**data_row_for_service(tg_id, 1)))])
+        await core.show_main_status(update, context)
+        mock_reply.assert_called_once_with(update, expected_text, keyboards.standard(user))
+        mock_reply.reset_mock()
 
-            load_test_categories(1)
+        load_test_services(return_single_record())
 
-            await core.show_main_status(update, context)
-            mock_reply.assert_called_once_with(update, expected_text, keyboards.standard(user))
-            mock_reply.reset_mock()
+        expected_text = "\n".join(
+            [trans.gettext("SERVICES_DM_HELLO_AGAIN {user_first_name}").format(user_first_name=user.first_name),
+             render.service_description_for_owner(state.Service(**data_row_for_service(tg_id, 1)))])
 
-            load_test_categories(2)
+        load_test_categories(1)
 
-            await core.show_main_status(update, context)
-            mock_reply.assert_called_once_with(update, expected_text, keyboards.standard(user))
-            mock_reply.reset_mock()
+        await core.show_main_status(update, context)
+        mock_reply.assert_called_once_with(update, expected_text, keyboards.standard(user))
+        mock_reply.reset_mock()
 
-        with patch("features.services.state.Service._do_select_query", return_multiple_records):
-            await core.show_main_status(update, context)
-            records = [r for r in return_multiple_records()]
-            expected_text = [trans.ngettext("SERVICES_DM_HELLO_AGAIN_S {user_first_name} {record_count}",
-                                            "SERVICES_DM_HELLO_AGAIN_P {user_first_name} {record_count}",
-                                            len(records)).format(user_first_name=user.first_name,
-                                                                 record_count=len(records))]
-            for record in records:
-                expected_text.append(render.service_description_for_owner(state.Service(**record)))
-            mock_reply.assert_called_once_with(update, "\n".join(expected_text), keyboards.standard(user))
-            mock_reply.reset_mock()
+        load_test_categories(2)
+
+        await core.show_main_status(update, context)
+        mock_reply.assert_called_once_with(update, expected_text, keyboards.standard(user))
+        mock_reply.reset_mock()
+
+        load_test_services(return_multiple_records())
+
+        await core.show_main_status(update, context)
+        records = [r for r in return_multiple_records()]
+        expected_text = [trans.ngettext("SERVICES_DM_HELLO_AGAIN_S {user_first_name} {record_count}",
+                                        "SERVICES_DM_HELLO_AGAIN_P {user_first_name} {record_count}",
+                                        len(records)).format(user_first_name=user.first_name,
+                                                             record_count=len(records))]
+        for record in records:
+            expected_text.append(render.service_description_for_owner(state.Service(**record)))
+        mock_reply.assert_called_once_with(update, "\n".join(expected_text), keyboards.standard(user))
+        mock_reply.reset_mock()
 
     @patch("features.services.core.send")
     @patch("features.services.core.settings")
@@ -255,15 +261,18 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
         update = self._create_update_with_query(chat, user)
 
         # _who_request_category() must not be called with an empty set of people.
+        load_test_services([])
         with self.assertRaises(RuntimeError):
-            await core._who_request_category(update, context, {})
+            await core._who_request_category(update, context, directory.get(trans))
+
+        # Services with odd IDs are not suspended.
+        load_test_providers([1, 3, 5])
 
         async def test_with_services_in_categories(category_ids: list[int]):
             with patch("features.services.core.reply") as mock_reply:
-                categorised_people = {category_id: [state.Service(**data_row_for_service(1, category_id)),
-                                                    state.Service(**data_row_for_service(2, category_id)),
-                                                    state.Service(**data_row_for_service(3, category_id))] for
-                                      category_id in category_ids}
+                load_test_services(data_row_for_service(tg_id, category_id)
+                                   for tg_id in (1, 3, 5) for category_id in category_ids)
+                categorised_people = directory.categorised_services()
 
                 expected_category_list = []
                 for category in state.ServiceCategory.all():
@@ -272,7 +281,7 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
                     expected_category_list.append(
                         {"object": category, "text": f"{category.title}: {len(categorised_people[category.id])}"})
 
-                result = await core._who_request_category(update, context, categorised_people)
+                result = await core._who_request_category(update, context, directory.get(trans))
                 self.assertEqual(result, const.SELECTING_CATEGORY)
                 mock_reply.assert_called_once_with(update, render.prepend_disclaimer(trans, trans.gettext(
                     "SERVICES_DM_WHO_CATEGORY_LIST")), keyboards.select_category(
@@ -288,33 +297,33 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
         await test_with_services_in_categories([3, 1, 2])
         await test_with_services_in_categories([1, 2, 0, 4, 3, 5])
 
-    @patch_service__do_select_query_return_nothing()
     @patch("features.services.state.ServiceCategoryStats.register")
     @patch("features.services.core.reply")
     async def test__who_received_category(self, mock_reply, mock_stat):
+        load_test_services([])
+
         trans = i18n.default()
 
         chat, user, context = self._create_chat_user_context()
         category_id = 1
         update = self._create_update_with_query(chat, user, str(category_id))
 
-        context.user_data["who_request_category"] = {}
-
         with self.assertRaises(RuntimeError):
             await core._who_received_category(update, context), ConversationHandler.END
 
         load_test_categories(2)
-        load_test_providers([1, 2])
+        load_test_providers([1, 3])
 
         state.Service.set_bot_username("bot_username")
 
+        load_test_services([data_row_for_service(1, 1), data_row_for_service(1, 2), data_row_for_service(3, 2)])
+
         categorised_people = {1: [state.Service(**data_row_for_service(1, 1))],
                               2: [state.Service(**data_row_for_service(1, 2)),
-                                  state.Service(**data_row_for_service(2, 2))]}
+                                  state.Service(**data_row_for_service(3, 2))]}
 
         for selected_category_id in (1, 2):
             update = self._create_update_with_query(chat, user, str(selected_category_id))
-            context.user_data["who_request_category"] = categorised_people
 
             self.assertEqual(await core._who_received_category(update, context), ConversationHandler.END)
 
@@ -329,6 +338,56 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
             mock_reply.reset_mock()
             mock_stat.reset_mock()
 
+    @patch("features.services.core.reply")
+    @patch("features.services.core.settings")
+    async def test__handle_directory_page(self, mock_settings, mock_reply):
+        trans = i18n.default()
+
+        chat, user, context = self._create_chat_user_context()
+
+        tg_ids = list(range(1, 100, 2))
+        load_test_categories(2)
+        load_test_providers(tg_ids)
+        load_test_services(data_row_for_service(tg_id, 1) for tg_id in tg_ids)
+
+        state.Service.set_bot_username("bot_username")
+
+        mock_settings.MAX_MESSAGE_LENGTH = 1000
+
+        services_directory = directory.get(trans)
+        first_page, _, next_cursor = services_directory.category_page(1, mock_settings.MAX_MESSAGE_LENGTH)
+        second_page, previous_cursor, third_cursor = services_directory.category_page(
+            1, mock_settings.MAX_MESSAGE_LENGTH, after=next_cursor)
+        self.assertIsNotNone(third_cursor)
+
+        for data, expected_text, expected_cursors in (
+                (f"{const.DIRECTORY_PAGE}:1:{const.DIRECTORY_PAGE_AFTER}:{next_cursor}", second_page,
+                 (previous_cursor, third_cursor)),
+                (f"{const.DIRECTORY_PAGE}:1:{const.DIRECTORY_PAGE_BEFORE}:{previous_cursor}", first_page,
+                 (None, next_cursor))):
+            update = self._create_update_with_query(chat, user, data)
+            await core._handle_directory_page(update, context)
+
+            self.assertTrue(update.callback_query._edit_message_reply_markup_called)
+            mock_reply.assert_called_once_with(update, expected_text,
+                                               keyboards.directory_page(user, 1, *expected_cursors))
+            mock_reply.reset_mock()
+
+        # A cursor past the end shows the last page.
+        update = self._create_update_with_query(chat, user,
+                                                f"{const.DIRECTORY_PAGE}:1:{const.DIRECTORY_PAGE_AFTER}:zzz")
+        await core._handle_directory_page(update, context)
+        text, previous_cursor, _ = services_directory.category_page(1, mock_settings.MAX_MESSAGE_LENGTH, after="zzz")
+        mock_reply.assert_called_once_with(update, text, keyboards.directory_page(user, 1, previous_cursor, None))
+        mock_reply.reset_mock()
+
+        # A category that does not have services anymore.
+        update = self._create_update_with_query(chat, user,
+                                                f"{const.DIRECTORY_PAGE}:2:{const.DIRECTORY_PAGE_AFTER}:a")
+        await core._handle_directory_page(update, context)
+        mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_WHO_CATEGORY_EMPTY"),
+                                           keyboards.standard(user))
+
     @patch("features.services.core.settings")
     async def test__handle_command_who(self, mock_settings):
         trans = i18n.default()
@@ -341,19 +400,20 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
 
         state.Service.set_bot_username("bot_username")
 
-        with patch_service__do_select_query_return_nothing():
-            for show_categories_always in (False, True):
-                mock_settings.SHOW_CATEGORIES_ALWAYS = show_categories_always
+        load_test_services([])
+
+        for show_categories_always in (False, True):
+            mock_settings.SHOW_CATEGORIES_ALWAYS = show_categories_always
 
-                with patch("features.services.core._who_request_category") as mock_who_request_category:
-                    with patch("features.services.state.ServiceCategoryStats.register") as mock_stat:
-                        with patch("features.services.core.reply") as mock_reply:
-                            self.assertEqual(await core._handle_command_who(update, context), ConversationHandler.END)
+            with patch("features.services.core._who_request_category") as mock_who_request_category:
+                with patch("features.services.state.ServiceCategoryStats.register") as mock_stat:
+                    with patch("features.services.core.reply") as mock_reply:
+                        self.assertEqual(await core._handle_command_who(update, context), ConversationHandler.END)
 
-                            mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_WHO_EMPTY"),
-                                                               keyboards.standard(user))
-                            mock_stat.assert_not_called()
-                            mock_who_request_category.assert_not_called()
+                        mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_WHO_EMPTY"),
+                                                           keyboards.standard(user))
+                        mock_stat.assert_not_called()
+                        mock_who_request_category.assert_not_called()
 
         @patch("features.services.core._who_request_category")
         @patch("features.services.state.ServiceCategoryStats.register")
@@ -367,7 +427,7 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
             call_args = _mock_who_request_category.call_args[0]
             self.assertEqual(call_args[0], update)
             self.assertEqual(call_args[1], context)
-            self.assertDictEqual(call_args[2], categorised_services)
+            self.assertDictEqual(call_args[2].services, categorised_services)
 
         @patch("features.services.core._who_request_category")
         @patch("features.services.state.ServiceCategoryStats.register")
@@ -375,7 +435,7 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
         async def render_service_directory(_mock_reply, _mock_stat, _mock_who_request_category) -> None:
             self.assertEqual(await core._handle_command_who(update, context), ConversationHandler.END)
 
-            expected_message = render.categories_with_services(trans, core._get_all_services())
+            expected_message = render.categories_with_services(trans, directory.categorised_services())
             _mock_reply.assert_called_once_with(update, expected_message, keyboards.standard(user))
             _mock_stat.assert_called_once_with(user.id, -1)
             _mock_who_request_category.assert_not_called()
@@ -387,11 +447,14 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
             for tg_id in range(1, 3):
                 yield data_row_for_service(tg_id, 1)
 
-        with patch("features.services.state.Service._do_select_query", get_services_in_one_category):
-            for show_categories_always in (False, True):
-                mock_settings.SHOW_CATEGORIES_ALWAYS = show_categories_always
+        load_test_services(get_services_in_one_category())
 
-                await render_service_directory()
+        mock_settings.MAX_MESSAGE_LENGTH = 1000
+
+        for show_categories_always in (False, True):
+            mock_settings.SHOW_CATEGORIES_ALWAYS = show_categories_always
+
+            await render_service_directory()
 
         # Test the most used case when there are several services in several categories.
         def get_services_in_two_categories(_where_clause: str = "", _where_params: tuple = (),
@@ -400,31 +463,67 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
                 for category_id in range(1, 3):
                     yield data_row_for_service(tg_id, category_id)
 
-        with patch("features.services.state.Service._do_select_query", get_services_in_two_categories):
-            categorised_services = core._get_all_services()
+        load_test_services(get_services_in_two_categories())
 
-            # When the directory exceeds the message length limit, category selection should be shown even if the
-            # SHOW_CATEGORIES_ALWAYS setting is False.
-            mock_settings.MAX_MESSAGE_LENGTH = 100
+        categorised_services = directory.categorised_services()
 
-            for show_categories_always in (False, True):
-                mock_settings.SHOW_CATEGORIES_ALWAYS = show_categories_always
+        # When the directory exceeds the message length limit, category selection should be shown even if the
+        # SHOW_CATEGORIES_ALWAYS setting is False.
+        mock_settings.MAX_MESSAGE_LENGTH = 100
 
-                await render_category_selection()
+        for show_categories_always in (False, True):
+            mock_settings.SHOW_CATEGORIES_ALWAYS = show_categories_always
 
-            # When the limit is big enough for the entire directory, category selection should be shown only if the
-            # SHOW_CATEGORIES_ALWAYS setting is True.
-            mock_settings.MAX_MESSAGE_LENGTH = 1000
-            mock_settings.SHOW_CATEGORIES_ALWAYS = False
+            await render_category_selection()
 
-            await render_service_directory()
+        # When the limit is big enough for the entire directory, category selection should be shown only if the
+        # SHOW_CATEGORIES_ALWAYS setting is True.
+        mock_settings.MAX_MESSAGE_LENGTH = 1000
+        mock_settings.SHOW_CATEGORIES_ALWAYS = False
 
-            mock_settings.SHOW_CATEGORIES_ALWAYS = True
-            await render_category_selection()
+        await render_service_directory()
+
+        mock_settings.SHOW_CATEGORIES_ALWAYS = True
+        await render_category_selection()
+
+    @patch("features.services.core.reply")
+    async def test_search(self, mock_reply):
+        trans = i18n.default()
+
+        chat, user, context = self._create_chat_user_context()
+
+        load_test_categories(1)
+        load_test_providers([1, 3])
+        load_test_services([data_row_for_service(1, 1), data_row_for_service(3, 1)])
+
+        state.Service.set_bot_username("bot_username")
+
+        update = self._create_update_with_query(chat, user)
+        self.assertEqual(await core._handle_command_search(update, context), const.TYPING_SEARCH_QUERY)
+        self.assertTrue(update.callback_query._edit_message_reply_markup_called)
+        mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_SEARCH_ASK"))
+        mock_reply.reset_mock()
+
+        update = self._create_update_with_message(chat, "occupation 3", user)
+        found_services = [state.Service.get(3, 1)]
+        with patch("features.services.state.Service.search", return_value=found_services) as mock_search:
+            self.assertEqual(await core._search_received_query(update, context), ConversationHandler.END)
+
+            mock_search.assert_called_once_with("occupation 3", settings.SERVICES_SEARCH_MAX_RESULTS)
+            mock_reply.assert_called_once_with(update, render.search_results(trans, found_services),
+                                               keyboards.standard(user))
+            mock_reply.reset_mock()
+
+        with patch("features.services.state.Service.search", return_value=[]):
+            self.assertEqual(await core._search_received_query(update, context), ConversationHandler.END)
+
+            mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_SEARCH_NOTHING_FOUND"),
+                                               keyboards.standard(user))
 
-    @patch_service__do_select_query_return_nothing()
     @patch("features.services.core.reply")
     async def test__handle_command_enroll(self, mock_reply):
+        load_test_services([])
+
         trans = i18n.default()
 
         chat, user, context = self._create_chat_user_context()
@@ -477,27 +576,22 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
 
         load_test_categories(2)
 
-        def return_two_categories(_where_clause: str = "",
-                                  where_params: tuple = (),
-                                  _additional_clause: str = "") -> Iterator[dict]:
-            yield data_row_for_service(where_params[0], 1)
-            yield data_row_for_service(where_params[0], 2)
+        load_test_services([data_row_for_service(user.id, 1), data_row_for_service(user.id, 2)])
 
-        with patch("features.services.state.Service._do_select_query", return_two_categories):
-            self.assertIsInstance(update.callback_query, test_util.MockQuery)
+        self.assertIsInstance(update.callback_query, test_util.MockQuery)
 
-            self.assertFalse(update.callback_query._edit_message_reply_markup_called)
+        self.assertFalse(update.callback_query._edit_message_reply_markup_called)
 
-            self.assertEqual(await core._handle_command_update(update, context), const.SELECTING_CATEGORY)
+        self.assertEqual(await core._handle_command_update(update, context), const.SELECTING_CATEGORY)
 
-            self.assertIn("mode", context.user_data)
-            self.assertEqual(context.user_data["mode"], "update")
+        self.assertIn("mode", context.user_data)
+        self.assertEqual(context.user_data["mode"], "update")
 
-            self.assertTrue(update.callback_query._edit_message_reply_markup_called)
-            self.assertIsNone(update.callback_query._edit_message_reply_markup_called_with)
-            mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_SELECT_CATEGORY_FOR_UPDATE"),
-                                               keyboards.select_category(
-                                                   [s.category for s in state.Service.get_all_by_user(user.id)]))
+        self.assertTrue(update.callback_query._edit_message_reply_markup_called)
+        self.assertIsNone(update.callback_query._edit_message_reply_markup_called_with)
+        mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_SELECT_CATEGORY_FOR_UPDATE"),
+                                           keyboards.select_category(
+                                               [s.category for s in state.Service.get_all_by_user(user.id)]))
 
     @patch("features.services.core.reply")
     @patch("features.services.core.settings")
@@ -510,67 +604,58 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
 
         load_test_categories(2)
 
-        def return_two_categories(tg_id: int) -> Iterator[dict]:
-            yield data_row_for_service(tg_id, 1)
-            yield data_row_for_service(tg_id, 2)
-
-        with patch("features.services.state.Service._do_select_query", return_two_categories):
-            async def test_request_new_occupation():
-                context.user_data.clear()
-                self.assertEqual(await core._accept_category_and_request_occupation(update, context),
-                                 const.TYPING_OCCUPATION)
-                self.assertEqual(context.user_data["category_id"], selected_category_id)
-                mock_reply.assert_called_once_with(update, render.occupation_request_new_with_limit(
-                    trans, mock_settings.SERVICES_OCCUPATION_MAX_LENGTH))
-                mock_reply.reset_mock()
-
-            mock_settings.SERVICES_OCCUPATION_MAX_LENGTH = 0
+        load_test_services([data_row_for_service(user.id, 1), data_row_for_service(user.id, 2)])
 
-            await test_request_new_occupation()
+        async def test_request_new_occupation():
+            context.user_data.clear()
+            self.assertEqual(await core._accept_category_and_request_occupation(update, context),
+                             const.TYPING_OCCUPATION)
+            self.assertEqual(context.user_data["category_id"], selected_category_id)
+            mock_reply.assert_called_once_with(update, render.occupation_request_new_with_limit(
+                trans, mock_settings.SERVICES_OCCUPATION_MAX_LENGTH))
+            mock_reply.reset_mock()
 
-            mock_settings.SERVICES_OCCUPATION_MAX_LENGTH = 100
+        mock_settings.SERVICES_OCCUPATION_MAX_LENGTH = 0
 
-            await test_request_new_occupation()
+        await test_request_new_occupation()
 
-            def return_service(_where_clause: str = "",
-                               where_params: tuple = (),
-                               _additional_clause: str = "") -> Iterator[dict]:
-                self.assertIsInstance(where_params, tuple)
-                self.assertEqual(list(map(type, where_params)),[int, int])
-                yield data_row_for_service(where_params[0], where_params[1])
+        mock_settings.SERVICES_OCCUPATION_MAX_LENGTH = 100
 
-            with patch("features.services.state.Service._do_select_query", return_service):
-                async def test_request_updated_occupation():
-                    context.user_data.clear()
-                    context.user_data["mode"] = "update"
+        await test_request_new_occupation()
 
-                    self.assertEqual(await core._accept_category_and_request_occupation(update, context),
-                                     const.TYPING_OCCUPATION)
-                    self.assertEqual(context.user_data["category_id"], selected_category_id)
+        load_test_services([data_row_for_service(user.id, selected_category_id)])
 
-                    service = state.Service.get(user.id, selected_category_id)
-                    self.assertEqual(context.user_data["category_title"], service.category.title)
-                    self.assertEqual(context.user_data["location"], service.location)
-                    self.assertEqual(context.user_data["occupation"], service.occupation)
-                    self.assertEqual(context.user_data["description"], service.description)
+        async def test_request_updated_occupation():
+            context.user_data.clear()
+            context.user_data["mode"] = "update"
 
-                    self.assertEqual(context.user_data["category_title"],
-                                     state.ServiceCategory.get(selected_category_id).title)
-                    mock_reply.assert_called_once_with(update, render.occupation_request_update_with_limit(
-                        trans, service.category.title, service.occupation,
-                        mock_settings.SERVICES_OCCUPATION_MAX_LENGTH))
-                    mock_reply.reset_mock()
+            self.assertEqual(await core._accept_category_and_request_occupation(update, context),
+                             const.TYPING_OCCUPATION)
+            self.assertEqual(context.user_data["category_id"], selected_category_id)
+
+            service = state.Service.get(user.id, selected_category_id)
+            self.assertEqual(context.user_data["category_title"], service.category.title)
+            self.assertEqual(context.user_data["location"], service.location)
+            self.assertEqual(context.user_data["occupation"], service.occupation)
+            self.assertEqual(context.user_data["description"], service.description)
+
+            self.assertEqual(context.user_data["category_title"],
+                             state.ServiceCategory.get(selected_category_id).title)
+            mock_reply.assert_called_once_with(update, render.occupation_request_update_with_limit(
+                trans, service.category.title, service.occupation,
+                mock_settings.SERVICES_OCCUPATION_MAX_LENGTH))
+            mock_reply.reset_mock()
 
-                context.user_data.clear()
-                context.user_data["mode"] = "update"
+        context.user_data.clear()
+        context.user_data["mode"] = "update"
 
-                mock_settings.SERVICES_OCCUPATION_MAX_LENGTH = 0
+        mock_settings.SERVICES_OCCUPATION_MAX_LENGTH = 0
 
-                await test_request_updated_occupation()
+        await test_request_updated_occupation()
 
-                mock_settings.SERVICES_OCCUPATION_MAX_LENGTH = 100
+        mock_settings.SERVICES_OCCUPATION_MAX_LENGTH = 100
 
-                await test_request_updated_occupation()
+        await test_request_updated_occupation()
 
     async def _test_data_entry_handler(self, method_being_tested, initial_stage_id: int, final_stage_id: int):
         with patch("logging.warning") as mock_logging:
@@ -781,19 +866,14 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
         load_test_categories(5)
         category_ids = [1, 3]
 
-        def return_two_services(_where_clause: str = "",
-                                where_params: tuple = (),
-                                _additional_clause: str = "") -> Iterator[state.Service]:
-            for category_id in category_ids:
-                yield data_row_for_service(where_params[0], category_id)
+        load_test_services(data_row_for_service(user.id, category_id) for category_id in category_ids)
 
-        with patch("features.services.state.Service._do_select_query", return_two_services):
-            with patch("features.services.core.reply") as mock_reply:
-                self.assertEqual(await core._handle_command_retire(update, context), const.SELECTING_CATEGORY)
+        with patch("features.services.core.reply") as mock_reply:
+            self.assertEqual(await core._handle_command_retire(update, context), const.SELECTING_CATEGORY)
 
-                mock_reply.assert_called_once_with(
-                    update, render.select_category_to_retire(trans),
-                    keyboards.select_category([state.ServiceCategory.get(category_id) for category_id in category_ids]))
+            mock_reply.assert_called_once_with(
+                update, render.select_category_to_retire(trans),
+                keyboards.select_category([state.ServiceCategory.get(category_id) for category_id in category_ids]))
 
     async def test__retire_received_category(self):
         trans = i18n.default()
@@ -845,12 +925,6 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
         load_test_categories(2)
         load_test_providers([1, 2])
 
-        def return_single_service(_query: str, parameters: tuple[int, int]) -> Iterator[dict]:
-            yield data_row_for_service(*parameters)
-
-        def return_no_service(_query: str, _parameters: tuple[str, int]) -> Iterator[dict]:
-            yield from ()
-
         state.Service.set_bot_username("bot_username")
 
         # Create a message that does not have valid text.
@@ -867,64 +941,172 @@ class TestCore(unittest.IsolatedAsyncioTestCase):
         update = self._create_update_with_message(
             chat, text=f"/start service_info_{service.category.id}_{service.provider.tg_username}", from_user=user_1)
 
-        with patch("features.services.state.Service._do_select_query", return_single_service):
-            with patch("features.services.core.reply") as mock_reply:
-                await core.handle_extended_start_command(update, context)
+        load_test_services([data_row_for_service(1, 1), data_row_for_service(2, 1)])
 
-                mock_reply.assert_called_once_with(update, trans.gettext(
-                    "SERVICES_DM_YOUR_SERVICE_INFO {category_title} {description} {location} {occupation}").format(
-                    category_title=service.category.title, description=service.description,
-                    location=service.location, occupation=service.occupation))
-                mock_stat.assert_called_once_with(user_1.id, service.tg_id, service.category.id)
+        with patch("features.services.core.reply") as mock_reply:
+            await core.handle_extended_start_command(update, context)
 
-            mock_stat.reset_mock()
+            mock_reply.assert_called_once_with(update, trans.gettext(
+                "SERVICES_DM_YOUR_SERVICE_INFO {category_title} {description} {location} {occupation}").format(
+                category_title=service.category.title, description=service.description,
+                location=service.location, occupation=service.occupation))
+            mock_stat.assert_called_once_with(user_1.id, service.tg_id, service.category.id)
 
-            update = self._create_update_with_message(
-                chat, f"/start service_info_{service.category.id}_{service.provider.tg_username}", user_2)
+        mock_stat.reset_mock()
 
-            with patch("features.services.core.reply") as mock_reply:
-                await core.handle_extended_start_command(update, context)
+        update = self._create_update_with_message(
+            chat, f"/start service_info_{service.category.id}_{service.provider.tg_username}", user_2)
 
-                mock_reply.assert_called_once_with(update, trans.gettext(
-                    "SERVICES_DM_SERVICE_INFO {category_title} {description} {location} {occupation} {"
-                    "username}").format(category_title=service.category.title, description=service.description,
-                                        location=service.location, occupation=service.occupation,
-                                        username=service.provider.tg_username))
-                mock_stat.assert_called_once_with(user_2.id, service.tg_id, service.category.id)
+        with patch("features.services.core.reply") as mock_reply:
+            await core.handle_extended_start_command(update, context)
 
-            mock_stat.reset_mock()
+            mock_reply.assert_called_once_with(update, trans.gettext(
+                "SERVICES_DM_SERVICE_INFO {category_title} {description} {location} {occupation} {"
+                "username}").format(category_title=service.category.title, description=service.description,
+                                    location=service.location, occupation=service.occupation,
+                                    username=service.provider.tg_username))
+            mock_stat.assert_called_once_with(user_2.id, service.tg_id, service.category.id)
 
-            update = self._create_update_with_message(
-                chat, f"/start service_info_{suspended_service.category.id}_{suspended_service.provider.tg_username}",
-                from_user=user_1)
+        mock_stat.reset_mock()
 
-            with patch("features.services.core.reply") as mock_reply:
-                await core.handle_extended_start_command(update, context)
+        update = self._create_update_with_message(
+            chat, f"/start service_info_{suspended_service.category.id}_{suspended_service.provider.tg_username}",
+            from_user=user_1)
 
-                mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_SERVICE_NOT_FOUND"))
-                mock_stat.assert_not_called()
+        with patch("features.services.core.reply") as mock_reply:
+            await core.handle_extended_start_command(update, context)
 
-            mock_stat.reset_mock()
+            mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_SERVICE_NOT_FOUND"))
+            mock_stat.assert_not_called()
 
-            update = self._create_update_with_message(
-                chat, f"/start service_info_{suspended_service.category.id}_{suspended_service.provider.tg_username}",
-                from_user=user_2)
+        mock_stat.reset_mock()
 
-            with patch("features.services.core.reply") as mock_reply:
-                await core.handle_extended_start_command(update, context)
+        update = self._create_update_with_message(
+            chat, f"/start service_info_{suspended_service.category.id}_{suspended_service.provider.tg_username}",
+            from_user=user_2)
+
+        with patch("features.services.core.reply") as mock_reply:
+            await core.handle_extended_start_command(update, context)
 
-                mock_reply.assert_called_once_with(update, trans.gettext(
-                    "SERVICES_DM_YOUR_SERVICE_INFO {category_title} {description} {location} {occupation}").format(
-                    category_title=suspended_service.category.title, description=suspended_service.description,
-                    location=suspended_service.location, occupation=suspended_service.occupation,
-                    username=suspended_service.provider.tg_username))
-                mock_stat.assert_called_once_with(user_2.id, suspended_service.tg_id, suspended_service.category.id)
+            mock_reply.assert_called_once_with(update, trans.gettext(
+                "SERVICES_DM_YOUR_SERVICE_INFO {category_title} {description} {location} {occupation}").format(
+                category_title=suspended_service.category.title, description=suspended_service.description,
+                location=suspended_service.location, occupation=suspended_service.occupation,
+                username=suspended_service.provider.tg_username))
+            mock_stat.assert_called_once_with(user_2.id, suspended_service.tg_id, suspended_service.category.id)
 
-            mock_stat.reset_mock()
+        mock_stat.reset_mock()
 
-        with patch("features.services.state.Service._do_select_query", return_no_service):
-            with patch("features.services.core.reply") as mock_reply:
-                await core.handle_extended_start_command(update, context)
+        load_test_services([])
+
+        with patch("features.services.core.reply") as mock_reply:
+            await core.handle_extended_start_command(update, context)
+
+            mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_SERVICE_NOT_FOUND"))
+            mock_stat.assert_not_called()
+
+    @patch("features.services.state.Provider.delete")
+    @patch("features.services.core.send")
+    async def test__check_providers(self, mock_send, mock_delete):
+        _chat, _user, context = self._create_chat_user_context()
+        context.job = MagicMock(data=1)
+
+        load_test_providers([1, 2, 3, 4, 5, 6])
+
+        async def get_chat_member(_chat_id, tg_id):
+            if tg_id == 1:
+                return ChatMemberLeft(User(id=tg_id, first_name="Joe", is_bot=False))
+            if tg_id == 5:
+                raise NetworkError("Timed out")
+            return ChatMemberMember(User(id=tg_id, first_name="Joe", is_bot=False))
+
+        with (patch("features.services.core.settings") as mock_settings,
+              patch.object(test_util.MockBot, "get_chat_member", side_effect=get_chat_member) as mock_get_chat_member):
+            mock_settings.SERVICES_PROVIDER_CHECK_SHARD_COUNT = 2
+            mock_settings.SERVICES_PROVIDER_CHECK_CONCURRENCY = 2
+            mock_settings.SERVICES_PROVIDER_CHECK_REQUESTS_PER_SECOND = 1000
+            mock_settings.ADMINISTRATORS = [{"id": 100}]
+
+            await core._check_providers(context)
+
+            # Only providers of the second shard are checked.
+            self.assertListEqual(sorted(c.args[1] for c in mock_get_chat_member.call_args_list), [1, 3, 5])
+
+        mock_delete.assert_called_once_with(1)
+
+        mock_send.assert_called_once()
+        self.assertEqual(mock_send.call_args.args[1], 100)
+
+    @patch("features.services.state.db.sql_exec")
+    @patch("features.services.core.send")
+    async def test__ping_due_providers_without_services(self, mock_send, _mock_sql_exec):
+        _chat, _user, context = self._create_chat_user_context()
+
+        load_test_providers([1])
+        load_test_services([])
+
+        now = state.Provider.get_by_tg_id(1).next_ping
+        with (patch("features.services.core.datetime") as mock_datetime,
+              patch("telegram.ext.JobQueue.run_once")):
+            mock_datetime.datetime.now.return_value = now
+            await core._ping_due_providers(context)
+
+        # The provider is not pinged, but is not dropped from the schedule either.
+        mock_send.assert_not_called()
+        self.assertEqual(state.Provider.get_earliest_ping(), state.Provider.get_by_tg_id(1).next_ping)
+        self.assertGreater(state.Provider.get_earliest_ping(), now)
+
+    @patch("features.services.state.db.sql_exec")
+    @patch("features.services.core._ping_provider")
+    async def test__ping_due_providers(self, mock_ping_provider, _mock_sql_exec):
+        _chat, _user, context = self._create_chat_user_context()
+
+        # Test providers are due in as many minutes as their Telegram ID.
+        load_test_providers([1, 2, 3, 600])
+
+        async def ping_provider(_context, provider):
+            if provider.tg_id == 2:
+                raise ValueError("Unexpected error")
+            if provider.tg_id == 3:
+                raise BadRequest("Chat not found")
+            provider.consume_ping_attempt_and_schedule_next_attempt()
+
+        mock_ping_provider.side_effect = ping_provider
+
+        async def run(now: datetime.datetime) -> None:
+            with (patch("features.services.core.datetime") as mock_datetime,
+                  patch("telegram.ext.JobQueue.run_once") as mock_run_once):
+                mock_datetime.datetime.now.return_value = now
+
+                await core._ping_due_providers(context)
+
+                # The job is scheduled again for the earliest ping that is due.
+                mock_run_once.assert_called_once()
+                self.assertEqual(mock_run_once.call_args.args[1],
+                                 (state.Provider.get_earliest_ping() - now).total_seconds())
+
+        with patch("features.services.state.Provider.delete") as mock_delete:
+            with self.assertLogs(level=logging.ERROR):
+                await run(util.rounded_utc_now() + datetime.timedelta(minutes=10))
+
+            # An unexpected error does not stop other providers from being pinged.
+            self.assertListEqual([c.args[1].tg_id for c in mock_ping_provider.call_args_list], [1, 2, 3])
+            mock_delete.assert_called_once_with(3)
+            self.assertEqual(state.Provider.get_earliest_ping(), state.Provider.get_by_tg_id(600).next_ping)
+
+            # The provider that could not be pinged stays in the schedule.
+            self.assertEqual(state.Provider.get_by_tg_id(2).next_ping, state.Provider.get_next_ping_reminder_date())
+            self.assertEqual(state.Provider.get_by_tg_id(2).remaining_ping_count, 3)
+
+        mock_ping_provider.reset_mock()
+
+        # A provider that did not respond to the last ping is deleted when the next one is due.
+        provider = state.Provider.get_by_tg_id(1)
+        while provider.remaining_ping_count > 0:
+            provider.consume_ping_attempt_and_schedule_next_attempt()
+
+        with patch("features.services.state.Provider.delete") as mock_delete:
+            await run(provider.next_ping)
 
-                mock_reply.assert_called_once_with(update, trans.gettext("SERVICES_DM_SERVICE_NOT_FOUND"))
-                mock_stat.assert_not_called()
+            self.assertListEqual([c.args[1].tg_id for c in mock_ping_provider.call_args_list], [600, 2])
+            mock_delete.assert_called_once_with(1)
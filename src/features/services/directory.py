@@ -0,0 +1,135 @@
+"""
+Service directory rendered into messages
+
+Grouping the active services by category is cached for every language and reused until the directory version changes
+(see `state.Service.directory_version()`).  Messages are only rendered when they are requested: the entire directory
+once per version, and categories a page at a time.
+"""
+
+import gettext
+from bisect import bisect_left, bisect_right
+from functools import cached_property
+
+from . import render, state
+
+
+class Directory:
+    """Active services grouped by category, and messages that show them
+
+    `services` maps a category ID to the list of services in that category, and `categories` lists categories that have
+    services in the order they are displayed.  `text` is the message that shows the entire directory.  Services of a
+    single category are shown by `category_page()`.
+    """
+
+    def __init__(self, trans: gettext.GNUTranslations):
+        self._trans = trans
+        # Maps a category ID to sort keys of its services, see `sort_key()`
+        self._keys: dict[int, list[str]] = {}
+
+        self.version = state.Service.directory_version()
+
+        self.services = categorised_services()
+        self.categories = [c for c in state.ServiceCategory.all() if c.id in self.services]
+
+    @cached_property
+    def text(self) -> str:
+        return render.categories_with_services(self._trans, self.services)
+
+    def _category_keys(self, category_id: int) -> list[str]:
+        if category_id not in self._keys:
+            self._keys[category_id] = [sort_key(service) for service in self.services[category_id]]
+
+        return self._keys[category_id]
+
+    def category_page(self, category_id: int, limit: int, after: str | None = None,
+                      before: str | None = None) -> tuple[str, str | None, str | None]:
+        """Render a message that shows services of the category, shorter than `limit`
+
+        @param after: sort key of a service, see `sort_key()`.  If given, the page starts with the service that follows.
+        @param before: sort key of a service.  If given, the page ends with the service that precedes it.  If neither
+        `after` nor `before` is given, the page starts with the first service of the category.
+
+        The services need not be in the category anymore: the page starts or ends where they would be, so that the page
+        does not shift when services are added or removed between requests.  A page has at least one service, so an
+        unreasonably long service description can still exceed the limit.  Only the services shown on the page are
+        rendered.
+
+        Returns the message, and the cursors for the previous and the next pages: sort keys of the first and the last
+        services shown, or None if there is nothing before or after the page.  If the entire category fits in the
+        message, it is shown without the page counter.
+        """
+
+        services = self.services[category_id]
+        keys = self._category_keys(category_id)
+        count = len(services)
+        category = state.ServiceCategory.get(category_id)
+
+        # Length of a page without services.  Numbers in the page counter are never longer than the ones used here.
+        empty_page_length = len(render.category_page(self._trans, category, [], count, count, count))
+
+        def fill(indices: range) -> list[int]:
+            result = []
+            page_length = empty_page_length
+            for i in indices:
+                line_length = len(render.service_description_for_public(services[i])) + 1
+                if result and page_length + line_length >= limit:
+                    break
+                result.append(i)
+                page_length += line_length
+            return result
+
+        start = bisect_right(keys, after) if after is not None else 0
+        if before is not None:
+            shown = sorted(fill(range(bisect_left(keys, before) - 1, -1, -1)))
+            if not shown or shown[0] == 0:
+                shown = fill(range(count))
+        elif start < count:
+            shown = fill(range(start, count))
+        else:
+            # Services at the end have been removed, show the last page.
+            shown = sorted(fill(range(count - 1, -1, -1)))
+
+        first, last = shown[0], shown[-1]
+        if first == 0 and last == count - 1:
+            return render.append_disclaimer(self._trans, render.category_with_services(category, services, True)), \
+                None, None
+
+        text = render.category_page(self._trans, category,
+                                    [render.service_description_for_public(services[i]) for i in shown],
+                                    first + 1, last + 1, count)
+
+        return text, keys[first] if first > 0 else None, keys[last] if last < count - 1 else None
+
+
+# Maps a language code to the directory rendered in that language
+_cache: dict[str, Directory] = {}
+
+
+def sort_key(service: state.Service) -> str:
+    """Return the key that services are sorted by in the directory, see `state.Service.get_all_active()`"""
+
+    return service.provider.tg_username.lower()
+
+
+def categorised_services() -> dict:
+    """Return active services grouped by category ID, keeping the order of `state.Service.get_all_active()`"""
+
+    result = {}
+    for service in state.Service.get_all_active():
+        if service.category.id not in result:
+            result[service.category.id] = []
+        result[service.category.id].append(service)
+
+    return result
+
+
+def get(trans: gettext.GNUTranslations) -> Directory:
+    """Return the current directory rendered with `trans`, rendering it only if the directory has changed"""
+
+    language = trans.info().get("language", "")
+
+    directory = _cache.get(language)
+    if directory is None or directory.version != state.Service.directory_version():
+        directory = _cache[language] = Directory(trans)
+
+    return directory
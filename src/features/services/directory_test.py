@@ -0,0 +1,111 @@
+"""
+Tests for directory.py
+"""
+
+import unittest
+
+from common import i18n
+from . import directory, render
+from .test_util import *
+
+
+class TestDirectory(unittest.TestCase):
+    def setUp(self):
+        load_test_categories(2)
+        load_test_providers([1, 3])
+        load_test_services([data_row_for_service(3, 2), data_row_for_service(1, 2), data_row_for_service(1, 1)])
+        state.Service.set_bot_username("bot_username")
+
+    def tearDown(self):
+        load_test_categories(0)
+        load_test_providers([])
+        load_test_services([])
+
+    def test_render(self):
+        trans = i18n.default()
+
+        services_directory = directory.get(trans)
+
+        self.assertListEqual([c.id for c in services_directory.categories], [1, 2])
+        self.assertListEqual([s.tg_id for s in services_directory.services[2]], [1, 3])
+
+        self.assertEqual(services_directory.text,
+                         render.categories_with_services(trans, directory.categorised_services()))
+        for category in services_directory.categories:
+            expected_text = render.append_disclaimer(
+                trans, render.category_with_services(category, services_directory.services[category.id], True))
+            self.assertTupleEqual(services_directory.category_page(category.id, 100000), (expected_text, None, None))
+
+    @patch("features.services.state.db.sql_exec")
+    def test_cache(self, _mock_sql_exec):
+        trans = i18n.default()
+
+        services_directory = directory.get(trans)
+        self.assertIs(directory.get(trans), services_directory)
+
+        state.Service.set_is_suspended(1, 1, True)
+
+        updated_directory = directory.get(trans)
+        self.assertIsNot(updated_directory, services_directory)
+        self.assertListEqual([c.id for c in updated_directory.categories], [2])
+        self.assertIs(directory.get(trans), updated_directory)
+
+        state.Provider.get_by_tg_id(3).tg_username = "a"
+        self.assertListEqual([s.tg_id for s in directory.get(trans).services[2]], [3, 1])
+
+        state.Service.delete(3, 2)
+        self.assertListEqual([s.tg_id for s in directory.get(trans).services[2]], [1])
+
+    def test_category_pages(self):
+        trans = i18n.default()
+
+        tg_ids = list(range(1, 200, 2))
+        load_test_providers(tg_ids)
+        load_test_services(data_row_for_service(tg_id, 1) for tg_id in tg_ids)
+
+        services_directory = directory.get(trans)
+        services = services_directory.services[1]
+        lines = [render.service_description_for_public(service) for service in services]
+
+        # A category that fits in a message is not split.
+        self.assertIsNone(services_directory.category_page(1, 100000)[2])
+
+        # Going forward shows every service once, every page is under the limit.
+        limit = 1000
+        pages = []
+        text, previous_cursor, next_cursor = services_directory.category_page(1, limit)
+        self.assertIsNone(previous_cursor)
+        pages.append(text)
+        while next_cursor is not None:
+            text, previous_cursor, next_cursor = services_directory.category_page(1, limit, after=next_cursor)
+            self.assertIsNotNone(previous_cursor)
+            pages.append(text)
+
+        self.assertGreater(len(pages), 2)
+        shown_lines = []
+        for text in pages:
+            self.assertLess(len(text), limit)
+            shown_lines.extend(line for line in text.split("\n") if line in lines)
+        self.assertListEqual(shown_lines, lines)
+
+        # Going back from the last page reaches the first one.
+        backward_pages = [text]
+        while previous_cursor is not None:
+            text, previous_cursor, _next_cursor = services_directory.category_page(1, limit, before=previous_cursor)
+            backward_pages.append(text)
+        self.assertEqual(backward_pages[-1], pages[0])
+
+        # The cursor is a sort key, so removing a service shown earlier does not shift the next page.
+        _text, _previous_cursor, next_cursor = services_directory.category_page(1, limit)
+        second_page = services_directory.category_page(1, limit, after=next_cursor)[0]
+        last_shown = [s for s in services if render.service_description_for_public(s) in pages[0].split("\n")][-1]
+        self.assertEqual(next_cursor, directory.sort_key(last_shown))
+        with patch("features.services.state.db.sql_exec"):
+            state.Service.delete(services[0].tg_id, 1)
+        updated_directory = directory.get(trans)
+        self.assertIsNot(updated_directory, services_directory)
+        self.assertEqual(updated_directory.category_page(1, limit, after=next_cursor)[0].split("\n")[1],
+                         second_page.split("\n")[1])
+
+        # A cursor past the end shows the last page.
+        self.assertIsNone(updated_directory.category_page(1, limit, after="zzz")[2])
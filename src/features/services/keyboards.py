@@ -17,9 +17,9 @@ def standard(user: User) -> InlineKeyboardMarkup:
     The standard keyboard is displayed at the start of the conversation (handling the /start command) or in the end of
     any conversation, and looks like this:
 
-    +-----------------+
-    | WHO             |
-    +-----------------+
+    +--------+--------+
+    | WHO    | SEARCH |
+    +--------+--------+
     | ENROLL (MORE)   |
     +--------+--------+
     | UPDATE | RETIRE |
@@ -32,14 +32,15 @@ def standard(user: User) -> InlineKeyboardMarkup:
     trans = i18n.trans(user)
 
     command_buttons = {trans.gettext("SERVICES_BUTTON_WHO"): const.COMMAND_WHO,
+                       trans.gettext("SERVICES_BUTTON_SEARCH"): const.COMMAND_SEARCH,
                        trans.gettext("SERVICES_BUTTON_ENROLL"): const.COMMAND_ENROLL,
                        trans.gettext("SERVICES_BUTTON_ENROLL_MORE"): const.COMMAND_ENROLL,
                        trans.gettext("SERVICES_BUTTON_UPDATE"): const.COMMAND_UPDATE,
                        trans.gettext("SERVICES_BUTTON_RETIRE"): const.COMMAND_RETIRE}
-    button_who, button_enroll, button_enroll_more, button_update, button_retire = (
+    button_who, button_search, button_enroll, button_enroll_more, button_update, button_retire = (
         InlineKeyboardButton(text, callback_data=command) for text, command in command_buttons.items())
 
-    buttons = [[button_who]]
+    buttons = [[button_who, button_search]]
 
     records = [r for r in state.Service.get_all_by_user(user.id)]
 
@@ -79,7 +80,7 @@ def select_category(categories: Iterable[state.ServiceCategory] = None) -> Inlin
     """
 
     effective_categories = categories if categories is not None else state.ServiceCategory.all()
-    effective_ids = [c.id for c in effective_categories]
+    effective_ids = {c.id for c in effective_categories}
 
     buttons = [(InlineKeyboardButton(c.title, callback_data=c.id),) for c in state.ServiceCategory.all() if
                c.id in effective_ids]
@@ -89,6 +90,42 @@ def select_category(categories: Iterable[state.ServiceCategory] = None) -> Inlin
     return InlineKeyboardMarkup(buttons)
 
 
+def directory_page(user: User, category_id: int, previous_cursor: str | None,
+                   next_cursor: str | None) -> InlineKeyboardMarkup:
+    """Build the keyboard shown under a page of a category that does not fit in a single message
+
+    +----------+------+
+    | PREVIOUS | NEXT |
+    +----------+------+
+    | (standard)      |
+    +-----------------+
+
+    The previous and next buttons are only shown when there is a page to go to, that is, when the respective cursor is
+    not None.  Their callback data encodes the category ID, the direction, and the cursor: the sort key of the service
+    that the page to show ends before or starts after (see `directory.sort_key()`).  Buttons of the standard keyboard
+    follow.  If there are no other pages, returns the standard keyboard.
+    """
+
+    trans = i18n.trans(user)
+
+    def button(text: str, direction: str, cursor: str) -> InlineKeyboardButton:
+        return InlineKeyboardButton(text, callback_data=f"{const.DIRECTORY_PAGE}:{category_id}:{direction}:{cursor}")
+
+    navigation_buttons = []
+    if previous_cursor is not None:
+        navigation_buttons.append(button(trans.gettext("SERVICES_BUTTON_PREVIOUS_PAGE"), const.DIRECTORY_PAGE_BEFORE,
+                                         previous_cursor))
+    if next_cursor is not None:
+        navigation_buttons.append(button(trans.gettext("SERVICES_BUTTON_NEXT_PAGE"), const.DIRECTORY_PAGE_AFTER,
+                                         next_cursor))
+
+    standard_keyboard = standard(user)
+    if not navigation_buttons:
+        return standard_keyboard
+
+    return InlineKeyboardMarkup([navigation_buttons, *standard_keyboard.inline_keyboard])
+
+
 def yes_no(trans: gettext.GNUTranslations) -> InlineKeyboardMarkup:
     """Build the YES/NO keyboard used in the step where the user confirms legality of their service
 
@@ -18,22 +18,15 @@ class TestKeyboards(unittest.TestCase):
 
     def tearDown(self):
         load_test_categories(0)
+        load_test_services([])
 
     def test_standard(self):
         user = create_test_user(1)
         trans = i18n.default()
 
-        def return_single_service_default_category(_query: str, parameters: tuple[int, int]) -> Iterator[dict]:
-            yield data_row_for_service(parameters[0], 0)
-
-        def return_single_service_category_1(_query: str, parameters: tuple[int, int]) -> Iterator[dict]:
-            yield data_row_for_service(parameters[0], 1)
-
-        def return_all_categories_with_default(_query: str, parameters: tuple[int, int]) -> Iterator[dict]:
-            for c in state.ServiceCategory.all():
-                yield data_row_for_service(parameters[0], c.id)
-
         who_button = InlineKeyboardButton(trans.gettext("SERVICES_BUTTON_WHO"), callback_data=const.COMMAND_WHO)
+        search_button = InlineKeyboardButton(trans.gettext("SERVICES_BUTTON_SEARCH"),
+                                             callback_data=const.COMMAND_SEARCH)
         enroll_button = InlineKeyboardButton(trans.gettext("SERVICES_BUTTON_ENROLL"),
                                              callback_data=const.COMMAND_ENROLL)
         enroll_more_button = InlineKeyboardButton(trans.gettext("SERVICES_BUTTON_ENROLL_MORE"),
@@ -47,14 +40,14 @@ class TestKeyboards(unittest.TestCase):
             keyboard = keyboards.standard(user)
             button_container = keyboard.inline_keyboard
             self.assertEqual(len(button_container), 2)
-            self.assertIn((who_button,), button_container)
+            self.assertIn((who_button, search_button), button_container)
             self.assertIn((enroll_button,), button_container)
 
         def assert_who_enroll_more_update_retire() -> None:
             keyboard = keyboards.standard(user)
             button_container = keyboard.inline_keyboard
             self.assertEqual(len(button_container), 3)
-            self.assertIn((who_button,), button_container)
+            self.assertIn((who_button, search_button), button_container)
             self.assertIn((enroll_more_button,), button_container)
             self.assertIn((update_button, retire_button), button_container)
 
@@ -62,17 +55,17 @@ class TestKeyboards(unittest.TestCase):
             keyboard = keyboards.standard(user)
             button_container = keyboard.inline_keyboard
             self.assertEqual(len(button_container), 2)
-            self.assertIn((who_button,), button_container)
+            self.assertIn((who_button, search_button), button_container)
             self.assertIn((update_button, retire_button), button_container)
 
         # When no categories are registered, all services belong to the "default" category that does not actually exist.
         # A user can create only a single service, and when they have it, they can either update it or delete.
 
-        with patch_service__do_select_query_return_nothing():
-            assert_who_enroll()
+        load_test_services([])
+        assert_who_enroll()
 
-        with patch("features.services.state.Service._do_select_query", return_single_service_default_category):
-            assert_who_update_retire()
+        load_test_services([data_row_for_service(user.id, 0)])
+        assert_who_update_retire()
 
         # Load some real categories.
         load_test_categories(5)
@@ -80,17 +73,40 @@ class TestKeyboards(unittest.TestCase):
         # When there are real categories, users can register services until they have a service in each category,
         # including the default one.
 
-        with patch_service__do_select_query_return_nothing():
-            assert_who_enroll()
+        load_test_services([])
+        assert_who_enroll()
+
+        load_test_services([data_row_for_service(user.id, 0)])
+        assert_who_enroll_more_update_retire()
+
+        load_test_services([data_row_for_service(user.id, 1)])
+        assert_who_enroll_more_update_retire()
+
+        load_test_services(data_row_for_service(user.id, c.id) for c in state.ServiceCategory.all())
+        assert_who_update_retire()
+
+    def test_directory_page(self):
+        user = create_test_user(1)
+        trans = i18n.default()
+
+        load_test_services([])
+
+        previous_button = InlineKeyboardButton(
+            trans.gettext("SERVICES_BUTTON_PREVIOUS_PAGE"),
+            callback_data=f"{const.DIRECTORY_PAGE}:5:{const.DIRECTORY_PAGE_BEFORE}:b")
+        next_button = InlineKeyboardButton(trans.gettext("SERVICES_BUTTON_NEXT_PAGE"),
+                                           callback_data=f"{const.DIRECTORY_PAGE}:5:{const.DIRECTORY_PAGE_AFTER}:c")
+        standard_buttons = keyboards.standard(user).inline_keyboard
 
-        with patch("features.services.state.Service._do_select_query", return_single_service_default_category):
-            assert_who_enroll_more_update_retire()
+        self.assertEqual(keyboards.directory_page(user, 5, None, None), keyboards.standard(user))
+        self.assertSequenceEqual(keyboards.directory_page(user, 5, "b", "c").inline_keyboard,
+                                 ((previous_button, next_button), *standard_buttons))
 
-        with patch("features.services.state.Service._do_select_query", return_single_service_category_1):
-            assert_who_enroll_more_update_retire()
+        first_page_buttons = keyboards.directory_page(user, 5, None, "c").inline_keyboard
+        self.assertSequenceEqual(first_page_buttons[0], (next_button,))
 
-        with patch("features.services.state.Service._do_select_query", return_all_categories_with_default):
-            assert_who_update_retire()
+        last_page_buttons = keyboards.directory_page(user, 5, "b", None).inline_keyboard
+        self.assertSequenceEqual(last_page_buttons[0], (previous_button,))
 
     def test_select_category(self):
         trans = i18n.default()
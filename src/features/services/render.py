@@ -30,6 +30,29 @@ def category_with_services(category: state.ServiceCategory, services: Iterable[s
     return "\n".join([service_description_for_public(service) for service in services])
 
 
+def category_page(trans: gettext.GNUTranslations, category: state.ServiceCategory, lines: list[str], first: int,
+                  last: int, count: int) -> str:
+    """Render one page of a category that is too long to fit in a single message
+
+    @param lines: service descriptions shown on this page, see `service_description_for_public()`
+    @param first: one-based position of the first service shown on this page
+    @param last: one-based position of the last service shown on this page
+    @param count: total number of services in the category
+    """
+
+    return append_disclaimer(trans, "\n".join([f"<b>{category.title}</b>", *lines, "", trans.gettext(
+        "SERVICES_DM_WHO_PAGE {first} {last} {count}").format(first=first, last=last, count=count)]))
+
+
+def search_results(trans: gettext.GNUTranslations, services: list[state.Service]) -> str:
+    if not services:
+        return trans.gettext("SERVICES_DM_SEARCH_NOTHING_FOUND")
+
+    lines = [trans.gettext("SERVICES_DM_SEARCH_RESULTS"), ""]
+    lines.extend(f"{service_description_for_public(service)} — {service.category.title}" for service in services)
+    return append_disclaimer(trans, "\n".join(lines))
+
+
 def append_disclaimer(trans: gettext.GNUTranslations, message: str) -> str:
     return "\n\n".join([message, trans.gettext("SERVICES_DM_WHO_DISCLAIMER")])
 
@@ -3,22 +3,37 @@ Persistent state of the services feature
 """
 
 import datetime
+import heapq
+import json
 import logging
-from collections.abc import Iterator
-from typing import Self
+import re
+import sqlite3
+from collections.abc import Callable, Iterator
+from typing import Self, TextIO
 
 from common import db, i18n, util
+from common.log import LogTime
 from common.settings import settings
 
 _CATEGORIES = "services_categories"
 _PROVIDERS = "services_providers"
 _SERVICES = "services_services"
+_SEARCH = "services_search"
+
+# View events waiting to be written to the DB by `flush_stats()`, as tuples of values for the INSERT queries
+_pending_category_views: list[tuple] = []
+_pending_service_views: list[tuple] = []
 
 
 class Provider:
     """Wraps a service provider database record
 
     Caches objects to minimise DB operations.
+
+    Upcoming pings are kept in a min-heap of (next ping date, Telegram ID) pairs, so that the earliest one is found
+    without going through all providers.  When the date changes or the provider is deleted, the old entry stays in the
+    heap and is skipped when it comes to the top.  A listener set with `set_ping_listener()` is called with every new
+    date, so that the caller can wake up earlier if needed.
     """
 
     class NotFound(Exception):
@@ -27,6 +42,9 @@ class Provider:
     _id_index = {}
     _username_index = {}
 
+    _ping_heap: list[tuple[datetime.datetime, int]] = []
+    _ping_listener: Callable[[datetime.datetime], None] | None = None
+
     def __init__(self, **kwargs):
         self._tg_id = kwargs["tg_id"]
         self._tg_username = kwargs["tg_username"]
@@ -38,12 +56,12 @@ class Provider:
 
     @staticmethod
     def get_next_ping_date() -> datetime.datetime:
-        return (util.rounded_now().replace(hour=0, minute=0, second=0) +
+        return (util.rounded_utc_now().replace(hour=settings.SERVICES_PROVIDER_PING_HOUR, minute=0, second=0) +
                 datetime.timedelta(days=settings.SERVICES_PROVIDER_PING_PERIOD_DAYS))
 
     @staticmethod
     def get_next_ping_reminder_date() -> datetime.datetime:
-        return (util.rounded_now().replace(hour=0, minute=0, second=0) +
+        return (util.rounded_utc_now().replace(hour=settings.SERVICES_PROVIDER_PING_HOUR, minute=0, second=0) +
                 datetime.timedelta(days=settings.SERVICES_PING_ATTEMPTS_INTERVAL_DAYS))
 
     @property
@@ -61,7 +79,10 @@ class Provider:
         if self._tg_username == value:
             return
         db.sql_exec(f"UPDATE {_PROVIDERS} SET tg_username=? WHERE tg_id=?", (value, self._tg_id))
+        Provider._username_index.pop(self._tg_username, None)
         self._tg_username = value
+        Provider._username_index[value] = self
+        Service.invalidate_directory()
 
     @property
     def next_ping(self) -> datetime.datetime:
@@ -80,6 +101,7 @@ class Provider:
                     (util.db_format(next_attempt_date), self._remaining_ping_count - 1, self._tg_id))
         self._remaining_ping_count -= 1
         self._next_ping = next_attempt_date
+        self._push_ping()
 
     def reset_ping_attempts_and_schedule_next_ping(self) -> None:
         full_ping_count = settings.SERVICES_PING_ATTEMPT_COUNT
@@ -88,6 +110,33 @@ class Provider:
                     (util.db_format(next_ping_date), full_ping_count, self._tg_id))
         self._remaining_ping_count = full_ping_count
         self._next_ping = next_ping_date
+        self._push_ping()
+
+    def postpone_ping(self) -> None:
+        """Schedule the ping that could not be sent for the next reminder date, keeping the remaining ping count
+
+        The date is updated in memory first, so that the provider stays in the ping schedule even if the DB cannot be
+        written.
+        """
+
+        self._next_ping = Provider.get_next_ping_reminder_date()
+        self._push_ping()
+
+        db.sql_exec(f"UPDATE {_PROVIDERS} SET next_ping=? WHERE tg_id=?",
+                    (util.db_format(self._next_ping), self._tg_id))
+
+    def _push_ping(self) -> None:
+        """Register the next ping date in the heap of upcoming pings and notify the listener"""
+
+        # Stale entries are dropped once they outnumber the providers, so that the heap does not grow indefinitely.
+        if len(Provider._ping_heap) > 2 * len(Provider._id_index):
+            Provider._ping_heap = [(p.next_ping, p.tg_id) for p in Provider._id_index.values() if p is not self]
+            heapq.heapify(Provider._ping_heap)
+
+        heapq.heappush(Provider._ping_heap, (self._next_ping, self._tg_id))
+
+        if Provider._ping_listener is not None:
+            Provider._ping_listener(self._next_ping)
 
     @classmethod
     def load(cls) -> None:
@@ -96,9 +145,62 @@ class Provider:
         cls._id_index = {}
         cls._username_index = {}
 
-        for row in Provider._do_select_query(f"SELECT * FROM {_PROVIDERS}"):
+        for row in Provider._do_select_query(f"SELECT * FROM {_PROVIDERS} ORDER BY next_ping"):
             cls._cache(row)
 
+        cls._ping_heap = [(provider.next_ping, provider.tg_id) for provider in cls._id_index.values()]
+        heapq.heapify(cls._ping_heap)
+
+        if cls._ping_listener is not None and cls._ping_heap:
+            cls._ping_listener(cls._ping_heap[0][0])
+
+        Service.invalidate_directory()
+
+    @classmethod
+    def set_ping_listener(cls, listener: Callable[[datetime.datetime], None] | None) -> None:
+        """Set a function to be called with the new date every time a ping is scheduled"""
+
+        cls._ping_listener = listener
+
+    @classmethod
+    def _drop_stale_pings(cls) -> None:
+        """Remove entries from the top of the ping heap until the top one is up to date"""
+
+        while cls._ping_heap:
+            next_ping, tg_id = cls._ping_heap[0]
+            provider = cls._id_index.get(tg_id)
+            if provider is not None and provider.next_ping == next_ping:
+                return
+            heapq.heappop(cls._ping_heap)
+
+    @classmethod
+    def get_earliest_ping(cls) -> datetime.datetime | None:
+        """Return the earliest date when a provider should be pinged, or None if there are no providers"""
+
+        cls._drop_stale_pings()
+
+        return cls._ping_heap[0][0] if cls._ping_heap else None
+
+    @classmethod
+    def pop_due_pings(cls, now: datetime.datetime) -> list[Self]:
+        """Return providers whose next ping date is not later than `now`, earliest first
+
+        The providers are removed from the heap of upcoming pings, and get back there when their next ping date is
+        updated.  The caller should either delete every provider returned or update its next ping date, see
+        `postpone_ping()`.
+        """
+
+        # The same date can be pushed more than once, so the providers are deduplicated.
+        result = {}
+
+        cls._drop_stale_pings()
+        while cls._ping_heap and cls._ping_heap[0][0] <= now:
+            tg_id = heapq.heappop(cls._ping_heap)[1]
+            result[tg_id] = cls._id_index[tg_id]
+            cls._drop_stale_pings()
+
+        return list(result.values())
+
     @classmethod
     def get_all(cls) -> Iterator[Self]:
         for provider in cls._id_index.values():
@@ -144,14 +246,17 @@ class Provider:
 
         cls._id_index[tg_id] = new_provider
         cls._username_index[tg_username] = new_provider
+        new_provider._push_ping()
+
+        Service.invalidate_directory()
 
     @classmethod
     def delete(cls, tg_id: int) -> None:
         db.sql_exec(f"DELETE FROM {_PROVIDERS} WHERE tg_id=?", (tg_id,))
 
-        existing_provider = cls._id_index[tg_id]
-        del cls._username_index[existing_provider.tg_username]
-        del cls._id_index[tg_id]
+        cls._uncache(tg_id)
+
+        Service.invalidate_directory()
 
     @classmethod
     def _cache(cls, data):
@@ -160,6 +265,11 @@ class Provider:
         cls._username_index[provider.tg_username] = provider
         return provider
 
+    @classmethod
+    def _uncache(cls, tg_id: int) -> None:
+        existing_provider = cls._id_index.pop(tg_id)
+        del cls._username_index[existing_provider.tg_username]
+
     @staticmethod
     def _do_select_query(query: str, parameters: tuple = ()) -> Iterator[dict]:
         for row in db.sql_query(query, parameters):
@@ -215,6 +325,8 @@ class ServiceCategory:
 
         cls._order = [c.id for c in sorted(cls._categories.values(), key=lambda v: v.title)]
 
+        Service.invalidate_directory()
+
     @classmethod
     def count(cls) -> int:
         """Return number of non-default categories"""
@@ -238,13 +350,29 @@ class ServiceCategory:
 
 
 class Service:
-    """Wraps a service database record"""
+    """Wraps a service database record
+
+    The class caches the entire `services_services` table, so that reading services never queries the DB.  Services are
+    indexed by Telegram ID of their provider and by category ID.  Active services sorted by usernames of their providers
+    are kept in a separate list that is rebuilt on the next request after a change.  Methods that modify services update
+    both the DB and the cache, and increment the directory version that tells when messages rendered from the cache
+    become outdated.
+
+    The storage must be initialised by calling the `load()` class method.
+    """
 
     class NotFound(Exception):
         pass
 
     _bot_username: str
 
+    # Maps Telegram ID of a provider to a dictionary that maps category ID to a service
+    _provider_index: dict[int, dict[int, Self]] = {}
+    # Active services of existing providers sorted by usernames of the providers, or `None` if it needs to be rebuilt
+    _active_order: list[Self] | None = None
+    # Incremented by `invalidate_directory()`
+    _directory_version = 0
+
     def __init__(self, **kwargs):
         self._tg_id = kwargs["provider_tg_id"]
         self._category_id = kwargs["category_id"]
@@ -296,49 +424,140 @@ class Service:
     @classmethod
     def set_bot_username(cls, bot_username: str) -> None:
         Service._bot_username = bot_username
+        cls.invalidate_directory()
+
+    @classmethod
+    def load(cls) -> None:
+        """Load all service records from the DB and store them in class attributes"""
+
+        cls._provider_index = {}
+        cls.invalidate_directory()
+
+        for row in Service._do_select_query(f"SELECT * FROM {_SERVICES}"):
+            cls._cache(row)
+
+    @classmethod
+    def directory_version(cls) -> int:
+        """Return a number that changes every time the directory of active services may have changed"""
+
+        return cls._directory_version
+
+    @classmethod
+    def invalidate_directory(cls) -> None:
+        """Make the next call to `get_all_active()` sort the services again, and increment the directory version
+
+        Must be called on every change that affects the directory, like when a provider is deleted or changes their
+        username.
+        """
+
+        cls._active_order = None
+        cls._directory_version += 1
 
     @classmethod
     def get(cls, tg_id: int, category_id: int) -> Self:
-        for row in Service._do_select_query(f"SELECT * FROM {_SERVICES} "
-                                            f"WHERE provider_tg_id=? AND category_id=?", (tg_id, category_id)):
-            return Service(**row)
-        raise Service.NotFound
+        try:
+            return cls._provider_index[tg_id][category_id]
+        except KeyError:
+            raise Service.NotFound
 
     @classmethod
     def get_all_active(cls) -> Iterator[Self]:
-        for row in Service._do_select_query(f"SELECT s.* "
-                                            f"FROM {_SERVICES} s, {_PROVIDERS} p "
-                                            f"WHERE s.provider_tg_id=p.tg_id AND s.is_suspended=? "
-                                            f"ORDER BY p.tg_username COLLATE NOCASE", (0,)):
-            yield Service(**row)
+        """Return services that are not suspended, sorted by usernames of their providers (case-insensitive)"""
+
+        if cls._active_order is None:
+            active_services = [service for services in cls._provider_index.values() for service in services.values()
+                               if not service.is_suspended and Provider.exists(service.tg_id)]
+            cls._active_order = sorted(active_services, key=lambda s: s.provider.tg_username.lower())
+
+        yield from cls._active_order
+
+    @classmethod
+    def search(cls, text: str, limit: int) -> list[Self]:
+        """Find active services that have all words of `text` in their occupation, description, or location
+
+        @param text: words to look for, any characters other than letters and digits separate words
+        @param limit: maximum number of services to return
+
+        Every word matches the beginning of a word in the service, ignoring case and diacritics, so that "munch" finds
+        "München".  Services are ordered by relevance, matches in the occupation weigh more than ones in the location,
+        and those weigh more than matches in the description.
+
+        Uses the full-text index in the `services_search` table that triggers keep in sync with the services table.
+        """
+
+        words = re.findall(r"\w+", text)
+        if not words:
+            return []
+
+        query = " ".join(f"\"{word}\"*" for word in words)
+
+        result = []
+        for row in db.sql_query(f"SELECT s.provider_tg_id, s.category_id "
+                                f"FROM {_SEARCH} JOIN {_SERVICES} s "
+                                f"ON s.provider_tg_id={_SEARCH}.provider_tg_id AND s.category_id={_SEARCH}.category_id "
+                                f"WHERE {_SEARCH} MATCH ? AND s.is_suspended=0 "
+                                f"ORDER BY bm25({_SEARCH}, 0, 0, 4, 1, 2) LIMIT ?", (query, limit)):
+            service = cls._provider_index.get(row["provider_tg_id"], {}).get(row["category_id"])
+            if service is not None and Provider.exists(service.tg_id):
+                result.append(service)
+
+        return result
+
+    @classmethod
+    def set(cls, tg_id: int, occupation: str, description: str, location: str, is_suspended: bool,
+            category_id: int) -> None:
+        # Same as CURRENT_TIMESTAMP that is the default value of the column
+        last_modified = datetime.datetime.now(datetime.UTC).replace(tzinfo=None, microsecond=0)
 
-    @staticmethod
-    def set(tg_id: int, occupation: str, description: str, location: str, is_suspended: bool, category_id: int) -> None:
         db.sql_exec(f"INSERT OR REPLACE INTO {_SERVICES} "
-                    f"(provider_tg_id, occupation, description, location, is_suspended, category_id) "
-                    f"VALUES(?, ?, ?, ?, ?, ?)",
-                    (tg_id, occupation, description, location, 1 if is_suspended else 0, category_id))
+                    f"(provider_tg_id, occupation, description, location, is_suspended, category_id, last_modified) "
+                    f"VALUES(?, ?, ?, ?, ?, ?, ?)",
+                    (tg_id, occupation, description, location, 1 if is_suspended else 0, category_id,
+                     util.db_format(last_modified)))
 
-    @staticmethod
-    def set_is_suspended(tg_id: int, category_id: int, is_suspended: bool):
+        cls._cache({"provider_tg_id": tg_id, "category_id": category_id, "occupation": occupation,
+                    "description": description, "location": location, "is_suspended": bool(is_suspended),
+                    "last_modified": last_modified})
+
+    @classmethod
+    def set_is_suspended(cls, tg_id: int, category_id: int, is_suspended: bool):
         db.sql_exec(f"UPDATE {_SERVICES} SET is_suspended=? WHERE provider_tg_id=? AND category_id=?",
                     (is_suspended, tg_id, category_id))
 
-    @staticmethod
-    def delete(tg_id: int, category_id: int) -> None:
+        if category_id in cls._provider_index.get(tg_id, {}):
+            cls._provider_index[tg_id][category_id]._is_suspended = bool(is_suspended)
+            cls.invalidate_directory()
+
+    @classmethod
+    def delete(cls, tg_id: int, category_id: int) -> None:
         """Delete the service record identified by `tg_id` and `category_id`"""
 
         db.sql_exec(f"DELETE FROM {_SERVICES} WHERE provider_tg_id=? AND category_id=?", (tg_id, category_id))
 
+        cls._uncache(tg_id, category_id)
+
     @classmethod
     def get_all_by_user(cls, tg_id) -> Iterator[Self]:
-        for row in Service._do_select_query(f"SELECT * FROM {_SERVICES} WHERE provider_tg_id=?", (tg_id,)):
-            yield Service(**row)
+        yield from cls._provider_index.get(tg_id, {}).values()
 
     @classmethod
     def get_count_by_user(cls, tg_id) -> int:
-        for row in db.sql_query(f"SELECT COUNT(1) AS count FROM {_SERVICES} WHERE provider_tg_id=?", (tg_id,)):
-            return int(row["count"])
+        return len(cls._provider_index.get(tg_id, {}))
+
+    @classmethod
+    def _cache(cls, data: dict) -> Self:
+        service = Service(**data)
+        cls._provider_index.setdefault(service.tg_id, {})[service._category_id] = service
+        cls.invalidate_directory()
+        return service
+
+    @classmethod
+    def _uncache(cls, tg_id: int, category_id: int) -> None:
+        services = cls._provider_index.get(tg_id, {})
+        if services.pop(category_id, None) is not None:
+            if not services:
+                del cls._provider_index[tg_id]
+            cls.invalidate_directory()
 
     @staticmethod
     def _do_select_query(query: str, params: tuple = ()) -> Iterator[dict]:
@@ -383,12 +602,13 @@ class ServiceCategoryStats:
     def register(cls, viewer_tg_id: int, category_id: int) -> None:
         """Register a single event of a user browsing a category
 
+        The event is kept in memory until `flush_stats()` writes it to the DB.
+
         @param viewer_tg_id: Telegram ID of a user that requests the information.
         @param category_id: ID of a category being viewed, -1 for the general view (no specific category was requested).
         """
 
-        db.sql_exec(f"INSERT INTO {cls._DB_TABLE} (viewer_tg_id, category_id) VALUES(?, ?)",
-                    (viewer_tg_id, category_id))
+        _pending_category_views.append((viewer_tg_id, category_id, _stats_timestamp()))
 
     @classmethod
     def report(cls, from_date: datetime.datetime) -> Iterator[Self]:
@@ -398,6 +618,8 @@ class ServiceCategoryStats:
         @return: iterator for a sequence of stats entries
         """
 
+        flush_stats()
+
         parameters = (from_date.strftime("%Y-%m-%d"),)
         additional_where_clause = ""
         if not settings.SERVICES_STATS_INCLUDE_ADMINISTRATORS:
@@ -426,89 +648,218 @@ class ServiceStats:
     def register(cls, viewer_tg_id: int, tg_id: int, category_id: int) -> None:
         """Register a single event of a user viewing a service description
 
+        The event is kept in memory until `flush_stats()` writes it to the DB.
+
         @param viewer_tg_id: Telegram ID of a user that requests the information.
         @param tg_id: Telegram ID of a user whose service is being viewed.
         @param category_id: ID of a category of the service that is being viewed.
         """
 
-        db.sql_exec(f"INSERT INTO {cls._DB_TABLE} (viewer_tg_id, tg_id, category_id) VALUES(?, ?, ?)",
-                    (viewer_tg_id, tg_id, category_id))
+        _pending_service_views.append((viewer_tg_id, tg_id, category_id, _stats_timestamp()))
+
+
+def _stats_timestamp() -> str:
+    """Return the current UTC time in the format of `CURRENT_TIMESTAMP` that is the default for view timestamps"""
+
+    return util.db_format(datetime.datetime.now(datetime.UTC))
+
+
+def flush_stats() -> None:
+    """Write view events registered since the previous call to the DB
+
+    Events are inserted with a single `executemany()` per table and committed in one transaction, so that handlers that
+    register views never wait for the DB.  Does nothing if there are no pending events.  If the DB cannot be written,
+    the transaction is rolled back, and the events are kept for the next call.
+    """
+
+    global _pending_category_views, _pending_service_views
+
+    if not _pending_category_views and not _pending_service_views:
+        return
+
+    category_views, _pending_category_views = _pending_category_views, []
+    service_views, _pending_service_views = _pending_service_views, []
+
+    try:
+        with LogTime(f"INSERT INTO {ServiceCategoryStats._DB_TABLE}, {ServiceStats._DB_TABLE}"):
+            cursor = db.cursor()
+            cursor.executemany(f"INSERT INTO {ServiceCategoryStats._DB_TABLE} (viewer_tg_id, category_id, timestamp) "
+                               f"VALUES(?, ?, ?)", category_views)
+            cursor.executemany(f"INSERT INTO {ServiceStats._DB_TABLE} (viewer_tg_id, tg_id, category_id, timestamp) "
+                               f"VALUES(?, ?, ?, ?)", service_views)
+            db.commit()
+    except sqlite3.Error as e:
+        logging.error("Could not save views, will retry with the next flush", exc_info=e)
+        db.rollback()
+        # Events registered meanwhile are newer than the ones that could not be saved.
+        _pending_category_views = category_views + _pending_category_views
+        _pending_service_views = service_views + _pending_service_views
+        return
+
+    logging.info(f"Saved {len(category_views)} category views and {len(service_views)} service views")
+
+
+class InvalidData(Exception):
+    """Raised by `import_db()` when the data is not consistent"""
+    pass
+
+
+# Sections of the exported data: section name, table, columns in the order they are exported, columns that identify a
+# row, and other columns that must be unique
+_EXPORTED_TABLES = (
+    ("categories", _CATEGORIES, ("id", "title"), ("id",), ()),
+    ("providers", _PROVIDERS, ("tg_id", "tg_username", "next_ping", "remaining_ping_count"), ("tg_id",),
+     ("tg_username",)),
+    ("services", _SERVICES, ("provider_tg_id", "category_id", "is_suspended", "last_modified", "occupation",
+                             "description", "location"), ("provider_tg_id", "category_id"), ()))
+
+
+def _select_exported_rows(table: str, columns: tuple) -> Iterator[dict]:
+    yield from db.sql_query(f"SELECT {', '.join(columns)} FROM {table}")
 
 
 def export_db() -> dict:
-    def all_providers() -> Iterator[dict]:
-        for row in db.sql_query(f"SELECT * FROM {_PROVIDERS}"):
-            yield row
+    """Return all data of the feature as a dictionary that maps a section name to a list of rows
 
-    def service_select_all() -> Iterator:
-        """Query all non-suspended service records from the database table"""
+    `write_db()` produces the same data as JSON without keeping all of it in memory.
+    """
 
-        for row in db.sql_query(f"SELECT * FROM {_SERVICES}"):
-            yield row
+    return {name: list(_select_exported_rows(table, columns))
+            for name, table, columns, _key, _unique in _EXPORTED_TABLES}
 
-    def service_category_select_all() -> Iterator:
-        """Query all non-suspended service records from the database table"""
 
-        for row in db.sql_query(f"SELECT * FROM {_CATEGORIES}"):
-            yield row
+def write_db(output: TextIO) -> None:
+    """Write all data of the feature to `output` as JSON, reading and writing one row at a time
 
-    return {"categories": [category for category in service_category_select_all()],
-            "providers": [provider for provider in all_providers()],
-            "services": [person for person in service_select_all()]}
+    The result is the same as `export_db()` serialised to JSON, with every row on a separate line.
+    """
 
+    output.write("{")
+    for section_index, (name, table, columns, _key, _unique) in enumerate(_EXPORTED_TABLES):
+        output.write(f"{',' if section_index else ''}\n  {json.dumps(name)}: [")
+        separator = ""
+        for row in _select_exported_rows(table, columns):
+            output.write(f"{separator}\n    {json.dumps(row, ensure_ascii=False)}")
+            separator = ","
+        output.write("\n  ]")
+    output.write("\n}\n")
+
+
+def _check_integrity(data: dict) -> None:
+    """Raise `InvalidData` if the data has duplicates, invalid dates, or services that refer to missing records"""
+
+    for name, _table, _columns, key, unique in _EXPORTED_TABLES:
+        for unique_columns in (key, *((column,) for column in unique)):
+            values = set()
+            for row in data[name]:
+                value = tuple(row[column] for column in unique_columns)
+                if value in values:
+                    raise InvalidData(f"Duplicate {', '.join(unique_columns)} {value} in {name}")
+                values.add(value)
+
+    category_ids = {category["id"] for category in data["categories"]}
+    provider_ids = {provider["tg_id"] for provider in data["providers"]}
+    for service in data["services"]:
+        if service["category_id"] != 0 and service["category_id"] not in category_ids:
+            raise InvalidData(f"Service of provider {service['provider_tg_id']} refers to a missing category "
+                              f"{service['category_id']}")
+        if service["provider_tg_id"] not in provider_ids:
+            raise InvalidData(f"Service in category {service['category_id']} refers to a missing provider "
+                              f"{service['provider_tg_id']}")
+
+    try:
+        for provider in data["providers"]:
+            datetime.datetime.fromisoformat(provider["next_ping"])
+        for service in data["services"]:
+            datetime.datetime.fromisoformat(service["last_modified"])
+    except ValueError as e:
+        raise InvalidData(str(e))
+
+
+def _diff_rows(table: str, columns: tuple, key: tuple, unique: tuple, new_rows: list[dict]) -> tuple[list, list, list]:
+    """Compare `new_rows` with the rows in the table
+
+    @return: rows to insert, rows to update, and keys of rows to delete.
+
+    A row where any of the `unique` columns changes is deleted and inserted again rather than updated, so that the
+    values never clash with ones that are not updated yet.
+    """
 
-def import_db(new_data) -> None:
-    cursor = db.cursor()
+    current = {tuple(row[column] for column in key): row for row in _select_exported_rows(table, columns)}
 
-    import_timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%Z")
-    categories_backup = f"{_CATEGORIES}_{import_timestamp}"
-    providers_backup = f"{_PROVIDERS}_{import_timestamp}"
-    services_backup = f"{_SERVICES}_{import_timestamp}"
+    inserted, updated = [], []
+    for new_row in new_rows:
+        new_row = {column: new_row[column] for column in columns}
+        old_row = current.pop(tuple(new_row[column] for column in key), None)
+        if old_row is None:
+            inserted.append(new_row)
+        elif any(old_row[column] != new_row[column] for column in unique):
+            current[tuple(new_row[column] for column in key)] = old_row
+            inserted.append(new_row)
+        elif old_row != new_row:
+            updated.append(new_row)
 
-    for query in (f"CREATE TABLE {categories_backup} AS SELECT * FROM {_CATEGORIES}",
-                  f"CREATE TABLE {providers_backup} AS SELECT * FROM {_PROVIDERS}",
-                  f"CREATE TABLE {services_backup} AS SELECT * FROM {_SERVICES}"):
-        db.sql_exec(query)
+    return inserted, updated, list(current)
 
-    db.commit()
 
-    logging.info(f"Saved current data into {categories_backup}, {providers_backup} and {services_backup}")
+def import_db(new_data: dict) -> None:
+    """Replace all data of the feature with `new_data` that has the format returned by `export_db()`
 
-    cursor.execute(f"DELETE FROM {_CATEGORIES}")
-    for c in new_data["categories"]:
-        cursor.execute(f"INSERT INTO {_CATEGORIES} (id, title) "
-                       f"VALUES(?, ?)", (c["id"], c["title"]))
+    Raises `InvalidData` if the data is not consistent.  Otherwise, compares the data with what is in the DB, and only
+    inserts, updates, and deletes rows that differ, with a single `executemany()` per table and operation.  All changes
+    are applied in one transaction, and cached objects are only replaced for the rows that have changed.
+    """
 
-    cursor.execute(f"DELETE FROM {_PROVIDERS}")
-    for p in new_data["providers"]:
-        cursor.execute(f"INSERT INTO {_PROVIDERS} (tg_id, tg_username, next_ping, remaining_ping_count) "
-                       f"VALUES(?, ?, ?, ?)", (p["tg_id"], p["tg_username"], p["next_ping"], p["remaining_ping_count"]))
+    _check_integrity(new_data)
 
-    cursor.execute(f"DELETE FROM {_SERVICES}")
-    for p in new_data["services"]:
-        cursor.execute(
-            f"INSERT INTO {_SERVICES} (provider_tg_id, category_id, is_suspended, last_modified, occupation, "
-            f"description, location) "
-            f"VALUES(?, ?, ?, ?, ?, ?, ?)", (
-                p["provider_tg_id"], p["category_id"], p["is_suspended"], p["last_modified"],
-                p["occupation"], p["description"], p["location"]))
+    changes = {name: _diff_rows(table, columns, key, unique, new_data[name])
+               for name, table, columns, key, unique in _EXPORTED_TABLES}
 
+    cursor = db.cursor()
+    try:
+        # Services are deleted first and inserted last, so that they never refer to missing records.
+        for name, table, _columns, key, _unique in reversed(_EXPORTED_TABLES):
+            cursor.executemany(f"DELETE FROM {table} WHERE {' AND '.join(f'{column}=?' for column in key)}",
+                               changes[name][2])
+        for name, table, columns, key, _unique in _EXPORTED_TABLES:
+            inserted, updated, _deleted = changes[name]
+            cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) "
+                               f"VALUES({', '.join('?' for _ in columns)})",
+                               [tuple(row[column] for column in columns) for row in inserted])
+            values = [column for column in columns if column not in key]
+            cursor.executemany(f"UPDATE {table} SET {', '.join(f'{column}=?' for column in values)} "
+                               f"WHERE {' AND '.join(f'{column}=?' for column in key)}",
+                               [tuple(row[column] for column in (*values, *key)) for row in updated])
+    except Exception:
+        db.rollback()
+        raise
     db.commit()
 
-    logging.info("Loaded new data")
+    for name, (inserted, updated, deleted) in changes.items():
+        logging.info(f"Imported {name}: {len(inserted)} inserted, {len(updated)} updated, {len(deleted)} deleted")
 
-    cursor.execute(f"DROP TABLE {categories_backup}")
-    cursor.execute(f"DROP TABLE {providers_backup}")
-    cursor.execute(f"DROP TABLE {services_backup}")
+    if any(changes["categories"]):
+        ServiceCategory.load()
 
-    db.commit()
+    inserted, updated, deleted = changes["providers"]
+    for tg_id, in deleted:
+        Provider._uncache(tg_id)
+    for row in updated:
+        Provider._uncache(row["tg_id"])
+    for row in inserted + updated:
+        Provider._cache({**row, "next_ping": datetime.datetime.fromisoformat(row["next_ping"])})._push_ping()
 
-    logging.info("Dropped data snapshots")
+    inserted, updated, deleted = changes["services"]
+    for tg_id, category_id in deleted:
+        Service._uncache(tg_id, category_id)
+    for row in inserted + updated:
+        Service._cache({**row, "last_modified": datetime.datetime.fromisoformat(row["last_modified"]),
+                        "is_suspended": bool(row["is_suspended"])})
 
-    Provider.load()
-    ServiceCategory.load()
+    Service.invalidate_directory()
 
 
 def init():
     Provider.load()
     ServiceCategory.load()
+    Service.load()
@@ -2,9 +2,16 @@
 Tests for state.py
 """
 
+import copy
+import io
+import json
+import logging
+import pathlib
+import tempfile
 import unittest
+from unittest.mock import MagicMock
 
-from common import i18n
+from common import db, i18n
 from .test_util import *
 
 
@@ -17,7 +24,7 @@ class TestProvider(unittest.TestCase):
 
     @staticmethod
     def _next_ping_from_tg_id(tg_id: int) -> datetime.datetime:
-        return util.rounded_now() + datetime.timedelta(minutes=tg_id)
+        return util.rounded_utc_now() + datetime.timedelta(minutes=tg_id)
 
     @patch("features.services.state.db.sql_exec")
     def test_tg_username_setter(self, mock_sql_exec):
@@ -83,6 +90,51 @@ class TestProvider(unittest.TestCase):
         self.assertEqual(mock_sql_exec.call_args[0][1],
                          (util.db_format(provider.next_ping), provider.remaining_ping_count, provider.tg_id))
 
+    def test_ping_dates_are_in_utc(self):
+        utc_now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+        next_ping = state.Provider.get_next_ping_date()
+        self.assertEqual(next_ping.hour, settings.SERVICES_PROVIDER_PING_HOUR)
+        self.assertEqual(next_ping.date(),
+                         (utc_now + datetime.timedelta(days=settings.SERVICES_PROVIDER_PING_PERIOD_DAYS)).date())
+
+    @patch("features.services.state.db.sql_exec")
+    def test_upcoming_pings(self, _mock_sql_exec):
+        self.assertIsNone(state.Provider.get_earliest_ping())
+
+        # Test providers are due in as many minutes as their Telegram ID.
+        load_test_providers([5, 1, 3])
+        now = util.rounded_utc_now()
+
+        self.assertEqual(state.Provider.get_earliest_ping(), self._next_ping_from_tg_id(1))
+        self.assertListEqual(state.Provider.pop_due_pings(now), [])
+
+        listener = MagicMock()
+        state.Provider.set_ping_listener(listener)
+        try:
+            # A provider whose ping was rescheduled is not due anymore.
+            state.Provider.get_by_tg_id(1).reset_ping_attempts_and_schedule_next_ping()
+            listener.assert_called_once_with(state.Provider.get_next_ping_date())
+
+            # A deleted provider is not due either.
+            state.Provider.delete(3)
+
+            self.assertEqual(state.Provider.get_earliest_ping(), self._next_ping_from_tg_id(5))
+            self.assertListEqual([p.tg_id for p in state.Provider.pop_due_pings(now + datetime.timedelta(minutes=5))],
+                                 [5])
+
+            # Popped providers come back once their ping is rescheduled.
+            self.assertEqual(state.Provider.get_earliest_ping(), state.Provider.get_next_ping_date())
+            state.Provider.get_by_tg_id(5).consume_ping_attempt_and_schedule_next_attempt()
+            state.Provider.get_by_tg_id(5).consume_ping_attempt_and_schedule_next_attempt()
+            self.assertEqual(state.Provider.get_earliest_ping(), state.Provider.get_next_ping_reminder_date())
+
+            self.assertListEqual([p.tg_id for p in state.Provider.pop_due_pings(state.Provider.get_next_ping_date())],
+                                 [5, 1])
+            self.assertIsNone(state.Provider.get_earliest_ping())
+        finally:
+            state.Provider.set_ping_listener(None)
+
     def test_get(self):
         tg_id = 1273
         tg_username = test_tg_username(tg_id)
@@ -176,29 +228,320 @@ class TestService(unittest.TestCase):
 
     def tearDown(self):
         load_test_categories(0)
+        load_test_providers([])
+        load_test_services([])
 
     def test_get(self):
-        def return_no_service(_query: str, _parameters: tuple[int, int]) -> Iterator[dict]:
-            yield from ()
+        load_test_services([])
+
+        with self.assertRaises(state.Service.NotFound):
+            state.Service.get(1, 1)
+
+        service_id = 123214
+        category_id = 1
+
+        load_test_services([data_row_for_service(service_id, category_id)])
+
+        service = state.Service.get(service_id, category_id)
+
+        self.assertIs(service.category, state.ServiceCategory.get(category_id))
+
+        self.assertEqual(service.tg_id, service_id)
+        self.assertEqual(service.occupation, test_occupation(service_id))
+        self.assertEqual(service.description, test_description(service_id))
+        self.assertEqual(service.location, test_location(service_id))
+        self.assertEqual(service.is_suspended, test_is_suspended(service_id))
+        self.assertEqual(service.last_modified, test_last_modified(service_id))
+
+        with self.assertRaises(state.Service.NotFound):
+            state.Service.get(service_id, 0)
+
+    @patch("features.services.state.db.sql_exec")
+    def test_get_all_active(self, _mock_sql_exec):
+        # Odd IDs are not suspended.
+        load_test_providers([1, 2, 3, 5])
+        load_test_services(data_row_for_service(tg_id, category_id)
+                           for tg_id in (5, 4, 3, 2, 1) for category_id in (0, 1))
+
+        # Services of suspended providers and of providers that do not exist are skipped.
+        self.assertListEqual([(s.tg_id, s.category.id) for s in state.Service.get_all_active()],
+                             [(1, 0), (1, 1), (3, 0), (3, 1), (5, 0), (5, 1)])
+
+        # The order follows usernames of providers, ignoring the case.
+        state.Provider.get_by_tg_id(5).tg_username = "A"
+        state.Provider.get_by_tg_id(3).tg_username = "b"
+        self.assertListEqual([s.tg_id for s in state.Service.get_all_active()], [5, 5, 3, 3, 1, 1])
+
+        state.Provider.delete(3)
+        self.assertListEqual([s.tg_id for s in state.Service.get_all_active()], [5, 5, 1, 1])
+
+    @patch("features.services.state.db.sql_exec")
+    def test_write_through(self, mock_sql_exec):
+        tg_id = 1
+        load_test_providers([tg_id])
+        load_test_services([])
+
+        state.Service.set(tg_id, "Occupation", "Description", "Location", False, 1)
+        mock_sql_exec.assert_called_once()
+        mock_sql_exec.reset_mock()
+
+        service = state.Service.get(tg_id, 1)
+        self.assertEqual(service.occupation, "Occupation")
+        self.assertEqual(state.Service.get_count_by_user(tg_id), 1)
+        self.assertListEqual(list(state.Service.get_all_active()), [service])
+
+        state.Service.set(tg_id, "New occupation", "Description", "Location", False, 1)
+        self.assertEqual(state.Service.get(tg_id, 1).occupation, "New occupation")
+        self.assertEqual(state.Service.get_count_by_user(tg_id), 1)
+
+        state.Service.set(tg_id, "Occupation", "Description", "Location", True, 0)
+        self.assertEqual(state.Service.get_count_by_user(tg_id), 2)
+        self.assertEqual(len(list(state.Service.get_all_active())), 1)
+
+        state.Service.set_is_suspended(tg_id, 0, False)
+        self.assertFalse(state.Service.get(tg_id, 0).is_suspended)
+        self.assertEqual(len(list(state.Service.get_all_active())), 2)
+
+        mock_sql_exec.reset_mock()
+        state.Service.delete(tg_id, 1)
+        mock_sql_exec.assert_called_once()
+        self.assertEqual(mock_sql_exec.call_args[0][1], (tg_id, 1))
+
+        with self.assertRaises(state.Service.NotFound):
+            state.Service.get(tg_id, 1)
+        self.assertListEqual([s.category.id for s in state.Service.get_all_by_user(tg_id)], [0])
+
+        state.Service.delete(tg_id, 0)
+        self.assertEqual(state.Service.get_count_by_user(tg_id), 0)
+        self.assertListEqual(list(state.Service.get_all_active()), [])
+
+
+class TestServiceSearch(unittest.TestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+        state.init()
+
+        for tg_id, occupation, description, location in (
+                (1, "Übersetzerin", "Deutsch, English, Русский", "München"),
+                (3, "Fotograf", "Hochzeiten und Porträts", "Munich"),
+                (5, "Photographer", "Weddings", "Berlin"),
+                (7, "Translator", "Documents, München and around", "Augsburg")):
+            state.Provider.create(tg_id, test_tg_username(tg_id))
+            state.Service.set(tg_id, occupation, description, location, False, 0)
+
+    def tearDown(self):
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+        load_test_providers([])
+        load_test_services([])
+
+    def _search(self, text: str, limit: int = 10) -> list[int]:
+        return [service.tg_id for service in state.Service.search(text, limit)]
+
+    def test_prefix_and_diacritics(self):
+        self.assertListEqual(self._search("ubersetz"), [1])
+        self.assertListEqual(self._search("FOTO"), [3])
+        self.assertListEqual(self._search("portrat"), [3])
+        self.assertListEqual(self._search("русск"), [1])
+        self.assertListEqual(self._search("photo berlin"), [5])
+        self.assertListEqual(self._search("photo munich"), [])
+        self.assertListEqual(self._search("nothing"), [])
+        self.assertListEqual(self._search("  ,.\"*  "), [])
+
+    def test_ranking_and_limit(self):
+        # A match in the location weighs more than one in the description.
+        self.assertListEqual(self._search("munchen"), [1, 7])
+        self.assertListEqual(self._search("munchen", 1), [1])
+
+    def test_changes(self):
+        state.Service.set(5, "Photographer", "Weddings", "Potsdam", False, 0)
+        self.assertListEqual(self._search("berlin"), [])
+        self.assertListEqual(self._search("potsdam"), [5])
+
+        state.Service.set_is_suspended(5, 0, True)
+        self.assertListEqual(self._search("potsdam"), [])
+
+        state.Service.set(5, "Photographer", "Weddings", "Potsdam", False, 1)
+        self.assertListEqual(self._search("potsdam"), [5])
+
+        state.Service.delete(5, 1)
+        self.assertListEqual(self._search("potsdam"), [])
+
+        state.import_db(state.export_db())
+        self.assertListEqual(self._search("munchen"), [1, 7])
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+
+    def tearDown(self):
+        state.flush_stats()
+
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+    @staticmethod
+    def _count(table: str) -> int:
+        for row in db.sql_query(f"SELECT COUNT(1) AS count FROM {table}"):
+            return row["count"]
+
+    def test_flush(self):
+        for viewer_tg_id in (1, 3, 3):
+            state.ServiceCategoryStats.register(viewer_tg_id, 1)
+        state.ServiceCategoryStats.register(5, -1)
+        state.ServiceStats.register(3, 1, 1)
+
+        # Views are not written until flushed.
+        self.assertEqual(self._count("services_category_views"), 0)
+        self.assertEqual(self._count("services_service_views"), 0)
+
+        state.flush_stats()
+        self.assertEqual(self._count("services_category_views"), 4)
+        self.assertEqual(self._count("services_service_views"), 1)
+
+        # Flushing again does not duplicate anything.
+        state.flush_stats()
+        self.assertEqual(self._count("services_category_views"), 4)
+
+        for row in db.sql_query("SELECT timestamp FROM services_service_views"):
+            timestamp = datetime.datetime.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S")
+            now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+            self.assertLess(abs(now - timestamp), datetime.timedelta(minutes=1))
+
+    def test_flush_failure(self):
+        state.ServiceCategoryStats.register(1, 1)
+        state.ServiceStats.register(3, 1, 1)
+
+        db.sql_exec("ALTER TABLE services_service_views RENAME TO services_service_views_")
+        with self.assertLogs(level=logging.ERROR):
+            state.flush_stats()
+        db.sql_exec("ALTER TABLE services_service_views_ RENAME TO services_service_views")
+
+        # Nothing is written in part, and the views are saved with the next flush.
+        self.assertEqual(self._count("services_category_views"), 0)
+        state.ServiceCategoryStats.register(5, 1)
+        state.flush_stats()
+        self.assertEqual(self._count("services_category_views"), 2)
+        self.assertEqual(self._count("services_service_views"), 1)
+
+    def test_report_includes_pending_views(self):
+        for viewer_tg_id in (1, 3, 3):
+            state.ServiceCategoryStats.register(viewer_tg_id, 1)
+
+        yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+        report = list(state.ServiceCategoryStats.report(yesterday))
+        self.assertEqual(len(report), 1)
+        self.assertEqual(report[0].view_count, 3)
+        self.assertEqual(report[0].viewer_count, 2)
+
+
+class TestExportImport(unittest.TestCase):
+    def setUp(self):
+        self.test_db_file = tempfile.NamedTemporaryFile(delete_on_close=False)
+        self.test_db_file.close()
+
+        db.connect(pathlib.Path(self.test_db_file.name))
+        state.init()
+
+        state.import_db({"categories": [data_row_for_service_category(1), data_row_for_service_category(2)],
+                         "providers": [], "services": []})
+        for tg_id in (1, 3, 5):
+            state.Provider.create(tg_id, test_tg_username(tg_id))
+            state.Service.set(tg_id, test_occupation(tg_id), test_description(tg_id), test_location(tg_id), False, 1)
+
+    def tearDown(self):
+        db.disconnect()
+
+        self.test_db_file.__exit__(None, None, None)
+
+        load_test_categories(0)
+        load_test_providers([])
+        load_test_services([])
+
+    def test_write_db(self):
+        output = io.StringIO()
+        state.write_db(output)
+
+        self.assertDictEqual(json.loads(output.getvalue()), state.export_db())
+
+    def test_import_changes_only(self):
+        data = state.export_db()
+
+        unchanged_provider = state.Provider.get_by_tg_id(1)
+        unchanged_service = state.Service.get(1, 1)
+
+        # Rename a provider, edit a service, delete another provider with their service, and add a new one.
+        data["providers"][1]["tg_username"] = "renamed"
+        data["services"][1]["occupation"] = "New occupation"
+        data["providers"] = [p for p in data["providers"] if p["tg_id"] != 5]
+        data["services"] = [s for s in data["services"] if s["provider_tg_id"] != 5]
+        data["providers"].append({"tg_id": 7, "tg_username": test_tg_username(7), "next_ping": "2026-01-01 12:00:00",
+                                  "remaining_ping_count": 3})
+        data["services"].append({"provider_tg_id": 7, "category_id": 2, "is_suspended": 0,
+                                 "last_modified": "2025-12-01 10:00:00", "occupation": "Plumber",
+                                 "description": "Pipes", "location": "Berlin"})
+
+        state.import_db(data)
+
+        self.assertDictEqual(state.export_db(), data)
+
+        # Objects of unchanged records are kept.
+        self.assertIs(state.Provider.get_by_tg_id(1), unchanged_provider)
+        self.assertIs(state.Service.get(1, 1), unchanged_service)
+
+        self.assertEqual(state.Provider.get_by_tg_id(3).tg_username, "renamed")
+        self.assertEqual(state.Service.get(3, 1).occupation, "New occupation")
+        self.assertFalse(state.Provider.exists(5))
+        self.assertEqual(state.Service.get_count_by_user(5), 0)
+        self.assertEqual(state.Service.get(7, 2).occupation, "Plumber")
+        self.assertEqual(state.Provider.get_earliest_ping(), datetime.datetime(2026, 1, 1, 12))
+
+        self.assertListEqual([s.tg_id for s in state.Service.search("plumber", 10)], [7])
+
+    def test_swap_usernames(self):
+        data = state.export_db()
+        data["providers"][0]["tg_username"], data["providers"][1]["tg_username"] = (
+            data["providers"][1]["tg_username"], data["providers"][0]["tg_username"])
+
+        state.import_db(data)
+
+        self.assertEqual(state.Provider.get_by_tg_username(test_tg_username(1)).tg_id, 3)
+        self.assertEqual(state.Provider.get_by_tg_username(test_tg_username(3)).tg_id, 1)
+
+    def test_invalid_data(self):
+        original_data = state.export_db()
 
-        with patch("features.services.state.Service._do_select_query", return_no_service):
-            with self.assertRaises(state.Service.NotFound):
-                state.Service.get(1, 1)
+        def check_rejected(data: dict) -> None:
+            with self.assertRaises(state.InvalidData):
+                state.import_db(data)
+            self.assertDictEqual(state.export_db(), original_data)
 
-        def return_single_service(_query: str, parameters: tuple[int, int]) -> Iterator[dict]:
-            yield data_row_for_service(*parameters)
+        data = copy.deepcopy(original_data)
+        data["services"][0]["category_id"] = 10
+        check_rejected(data)
 
-        with patch("features.services.state.Service._do_select_query", return_single_service):
-            service_id = 123214
-            category_id = 1
+        data = copy.deepcopy(original_data)
+        data["providers"].pop(0)
+        check_rejected(data)
 
-            service = state.Service.get(service_id, category_id)
+        data = copy.deepcopy(original_data)
+        data["providers"][0]["tg_username"] = data["providers"][1]["tg_username"]
+        check_rejected(data)
 
-            self.assertIs(service.category, state.ServiceCategory.get(category_id))
+        data = copy.deepcopy(original_data)
+        data["services"].append(data["services"][0])
+        check_rejected(data)
 
-            self.assertEqual(service.tg_id, service_id)
-            self.assertEqual(service.occupation, test_occupation(service_id))
-            self.assertEqual(service.description, test_description(service_id))
-            self.assertEqual(service.location, test_location(service_id))
-            self.assertEqual(service.is_suspended, test_is_suspended(service_id))
-            self.assertEqual(service.last_modified, test_last_modified(service_id))
+        data = copy.deepcopy(original_data)
+        data["providers"][0]["next_ping"] = "tomorrow"
+        check_rejected(data)
@@ -3,7 +3,7 @@ Helper functions and constants used in tests
 """
 
 import datetime
-from collections.abc import Iterator
+from collections.abc import Iterable, Iterator
 from unittest.mock import patch
 
 from telegram import User
@@ -45,7 +45,7 @@ def test_last_modified(tg_id: int) -> datetime:
     return datetime.datetime.fromisoformat("2026-01-14 12:00:00") - datetime.timedelta(minutes=tg_id)
 
 def test_next_ping(tg_id: int) -> datetime.datetime:
-    return util.rounded_now() + datetime.timedelta(minutes=tg_id)
+    return util.rounded_utc_now() + datetime.timedelta(minutes=tg_id)
 
 
 def test_username_to_tg_id(tg_username: str) -> int:
@@ -86,18 +86,6 @@ def data_row_for_service_category(category_id: int) -> dict:
     return {"id": category_id, "title": test_category_title(category_id)}
 
 
-def patch_service__do_select_query_return_nothing():
-    """Patch features.services.state.Service._do_select_query so that it would return an empty sequence
-
-    @return: Context manager returned from a call to unittest.mock.patch()
-    """
-
-    def return_no_services(_query: str = "", _parameters: tuple = ()) -> Iterator[dict]:
-        yield from ()
-
-    return patch("features.services.state.Service._do_select_query", return_no_services)
-
-
 def load_test_categories(category_count: int) -> None:
     """Load `category_count` test categories
 
@@ -122,3 +110,21 @@ def load_test_providers(tg_ids: list[int]) -> None:
 
     with patch("features.services.state.Provider._do_select_query", yield_data_rows):
         state.Provider.load()
+
+
+def load_test_services(rows: Iterable[dict]) -> None:
+    """Load test services made of `rows`
+
+    @param rows: data rows like ones returned by `data_row_for_service()`
+
+    Resets the cache in the `Service` class so that it would have exactly the services given.
+    """
+
+    rows = list(rows)
+
+    def yield_data_rows(*_args, **_kwargs) -> Iterator[dict]:
+        for row in rows:
+            yield dict(row)
+
+    with patch("features.services.state.Service._do_select_query", yield_data_rows):
+        state.Service.load()
@@ -0,0 +1,349 @@
+"""
+Train and evaluate the embedding-based antispam model (the `openai` antispam layer)
+
+Reads labelled texts from CSV files that have `text` and `label` columns (like the ones in
+`antispam_model_examples/sample_data`) and optionally from the `spam` table of the bot's database, where every record is
+treated as spam.  Embeddings are requested in batches, with a limited number of concurrent requests, and are kept in a
+persistent cache, so that repeated runs only request texts that have not been seen before.  The script then trains the
+classifier, prints its precision, recall and prediction latency, and saves the model to a file that the bot can load
+directly.
+
+Train on the sample data and write the model to the data directory of the bot:
+
+    python trainantispam.py --train-csv ../antispam_model_examples/sample_data/train.csv \\
+                            --test-csv ../antispam_model_examples/sample_data/test.csv
+
+Add spam collected by the bot to the training data:
+
+    python trainantispam.py --train-csv ../antispam_model_examples/sample_data/train.csv --use-spam-table
+
+For offline runs, start the stub embedding server and point the script at it.  The stub returns deterministic embeddings
+computed locally from character trigrams, which is enough for testing the pipeline but not for training a real model:
+
+    python trainantispam.py --serve-stub 8765
+    python trainantispam.py --base-url http://127.0.0.1:8765/v1 --train-csv ...
+
+The API key is taken from the `--api-key` argument, the `OPENAI_API_KEY` environment variable, or the
+`ANTISPAM_OPENAI_API_KEY` setting of the bot, in that order.
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import math
+import os
+import pathlib
+import sqlite3
+import sys
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+import joblib
+import numpy as np
+from openai import AsyncOpenAI
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import precision_recall_fscore_support
+from sklearn.model_selection import train_test_split
+from sklearn.svm import SVC
+
+# Configure logging before importing project modules to have messages that may be rendered during initialisation logged
+# correctly.
+logging.basicConfig(format="[%(asctime)s %(levelname)s] %(message)s", level=logging.INFO)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+from common import db
+from common.settings import settings
+from features.antispam.core import OPENAI_EMBEDDING_MODEL, OPENAI_FILE_PATH
+
+_CACHE_PATH = settings.data_dir / "antispam_embeddings_cache.db"
+
+_STUB_DIMENSIONS = 1536
+
+
+class EmbeddingCache:
+    """Persistent cache of embeddings, stored in an SQLite file and keyed by the model name and hash of the text"""
+
+    def __init__(self, path: pathlib.Path):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                                 "model TEXT NOT NULL, "
+                                 "text_hash TEXT NOT NULL, "
+                                 "embedding BLOB NOT NULL, "
+                                 "PRIMARY KEY (model, text_hash))")
+        self._connection.commit()
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: list[str]) -> dict[str, np.ndarray]:
+        """Return cached embeddings for those of `texts` that are in the cache"""
+
+        result = {}
+        for text in texts:
+            for (blob,) in self._connection.execute("SELECT embedding FROM embeddings WHERE model=? AND text_hash=?",
+                                                    (model, self._hash(text))):
+                result[text] = np.frombuffer(blob, dtype=np.float32)
+        return result
+
+    def put_many(self, model: str, embeddings: dict[str, np.ndarray]) -> None:
+        self._connection.executemany("INSERT OR REPLACE INTO embeddings (model, text_hash, embedding) VALUES(?, ?, ?)",
+                                     ((model, self._hash(text), np.asarray(embedding, dtype=np.float32).tobytes())
+                                      for text, embedding in embeddings.items()))
+        self._connection.commit()
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+async def embed(client: AsyncOpenAI, cache: EmbeddingCache, texts: list[str], batch_size: int,
+                concurrency: int) -> dict[str, np.ndarray]:
+    """Return embeddings for all `texts`, requesting the ones missing in the cache in batches
+
+    At most `concurrency` requests are in flight at any moment.  Every completed batch is written to the cache
+    immediately, so an interrupted run does not lose the embeddings that were already paid for.
+    """
+
+    unique_texts = list(dict.fromkeys(texts))
+    result = cache.get_many(OPENAI_EMBEDDING_MODEL, unique_texts)
+    missing = [text for text in unique_texts if text not in result]
+
+    logging.info(f"{len(unique_texts)} unique texts, {len(result)} found in the cache, {len(missing)} to request")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed_batch(batch: list[str]) -> None:
+        async with semaphore:
+            response = await client.embeddings.create(input=batch, model=OPENAI_EMBEDDING_MODEL)
+        batch_result = {}
+        for item in response.data:
+            batch_result[batch[item.index]] = np.asarray(item.embedding, dtype=np.float32)
+        cache.put_many(OPENAI_EMBEDDING_MODEL, batch_result)
+        result.update(batch_result)
+
+    await asyncio.gather(*(embed_batch(missing[i:i + batch_size]) for i in range(0, len(missing), batch_size)))
+
+    return result
+
+
+def read_csv(path: pathlib.Path) -> tuple[list[str], list[int]]:
+    """Read texts and labels from a CSV file with `text` and `label` columns"""
+
+    texts, labels = [], []
+    with open(path, encoding="utf-8-sig", newline="") as inp:
+        for row in csv.DictReader(inp):
+            text = row["text"].strip()
+            if not text:
+                continue
+            texts.append(text)
+            labels.append(int(row["label"]))
+    logging.info(f"Read {len(texts)} texts from {path}")
+    return texts, labels
+
+
+def read_spam_table(path: pathlib.Path) -> tuple[list[str], list[int]]:
+    """Read texts from the `spam` table of the bot's database and label them all as spam"""
+
+    db.connect(path)
+    texts = [record["text"].strip() for record in db.spam_select_all() if record["text"] and record["text"].strip()]
+    db.disconnect()
+    logging.info(f"Read {len(texts)} texts from the spam table in {path}")
+    return texts, [1] * len(texts)
+
+
+def create_model(kind: str):
+    if kind == "svm":
+        return SVC(probability=True)
+    if kind == "logistic":
+        return LogisticRegression(max_iter=1000)
+    raise ValueError(f"Unknown model kind: {kind}")
+
+
+def evaluate(model, x_test: np.ndarray, y_test: np.ndarray, threshold: float) -> None:
+    """Print quality and latency figures of `model` measured on the test set"""
+
+    started_at = perf_counter()
+    confidence = model.predict_proba(x_test)[:, 1]
+    batch_elapsed = perf_counter() - started_at
+
+    # The bot classifies a message as spam when the confidence is strictly above the threshold.
+    predicted = (confidence > threshold).astype(int)
+    precision, recall, f1, _ = precision_recall_fscore_support(y_test, predicted, average="binary", pos_label=1,
+                                                               zero_division=0)
+
+    single_count = min(len(x_test), 200)
+    started_at = perf_counter()
+    for i in range(single_count):
+        model.predict_proba(x_test[i:i + 1])
+    single_elapsed = perf_counter() - started_at
+
+    print(f"Test samples:                  {len(y_test)} ({int(y_test.sum())} spam)")
+    print(f"Threshold:                     {threshold}")
+    print(f"Precision:                     {precision:.4f}")
+    print(f"Recall:                        {recall:.4f}")
+    print(f"F1:                            {f1:.4f}")
+    print(f"Latency, single prediction:    {single_elapsed / single_count * 1000:.3f} ms")
+    print(f"Latency, batched per sample:   {batch_elapsed / len(x_test) * 1000:.3f} ms")
+
+
+def stub_embedding(text: str) -> list[float]:
+    """Compute a deterministic pseudo-embedding of `text` from hashed character trigrams"""
+
+    vector = np.zeros(_STUB_DIMENSIONS, dtype=np.float32)
+    padded = f"  {text.lower()} "
+    for i in range(len(padded) - 2):
+        vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % _STUB_DIMENSIONS] += 1
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm if norm else vector).tolist()
+
+
+class _StubEmbeddingHandler(BaseHTTPRequestHandler):
+    """Minimal implementation of the OpenAI `/embeddings` endpoint"""
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self.send_error(404)
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+
+        body = json.dumps({"object": "list", "model": request.get("model", OPENAI_EMBEDDING_MODEL),
+                           "data": [{"object": "embedding", "index": i, "embedding": stub_embedding(text)} for i, text
+                                    in enumerate(inputs)],
+                           "usage": {"prompt_tokens": 0, "total_tokens": 0}}).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(format % args)
+
+
+def serve_stub(port: int) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", port), _StubEmbeddingHandler)
+    logging.info(f"Stub embedding server listening at http://127.0.0.1:{port}/v1, press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train and evaluate the embedding-based antispam model")
+    parser.add_argument("--train-csv", type=pathlib.Path, action="append", default=[],
+                        help="CSV file with `text` and `label` columns, can be given multiple times")
+    parser.add_argument("--test-csv", type=pathlib.Path, action="append", default=[],
+                        help="CSV file with test data, can be given multiple times.  If omitted, part of the training "
+                             "data is held out for testing")
+    parser.add_argument("--use-spam-table", action="store_true",
+                        help="add records from the `spam` table of the bot's database to the training data")
+    parser.add_argument("--db", type=pathlib.Path, default=settings.data_dir / "people.db",
+                        help="path to the bot's database (default: %(default)s)")
+    parser.add_argument("--test-fraction", type=float, default=0.2,
+                        help="fraction of the training data held out for testing when no test CSV is given "
+                             "(default: %(default)s)")
+    parser.add_argument("--model", choices=("svm", "logistic"), default="svm",
+                        help="kind of the classifier (default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=settings.ANTISPAM_OPENAI_CONFIDENCE_THRESHOLD,
+                        help="confidence threshold used for evaluation (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=256,
+                        help="number of texts in one embedding request (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="maximum number of embedding requests in flight (default: %(default)s)")
+    parser.add_argument("--cache", type=pathlib.Path, default=_CACHE_PATH,
+                        help="path to the persistent embedding cache (default: %(default)s)")
+    parser.add_argument("--base-url", help="base URL of the embedding API, e.g. the one of the stub server")
+    parser.add_argument("--api-key", help="API key for the embedding API")
+    parser.add_argument("--output", type=pathlib.Path, default=OPENAI_FILE_PATH,
+                        help="where to save the trained model (default: %(default)s)")
+    parser.add_argument("--serve-stub", type=int, metavar="PORT",
+                        help="do not train anything, run the stub embedding server on PORT instead")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_arguments()
+
+    if args.serve_stub:
+        serve_stub(args.serve_stub)
+        return 0
+
+    train_texts, train_labels = [], []
+    for path in args.train_csv:
+        texts, labels = read_csv(path)
+        train_texts += texts
+        train_labels += labels
+    if args.use_spam_table:
+        texts, labels = read_spam_table(args.db)
+        train_texts += texts
+        train_labels += labels
+
+    test_texts, test_labels = [], []
+    for path in args.test_csv:
+        texts, labels = read_csv(path)
+        test_texts += texts
+        test_labels += labels
+
+    if not train_texts:
+        logging.error("No training data, use --train-csv and/or --use-spam-table")
+        return 1
+    if len(set(train_labels)) < 2:
+        logging.error("Training data must contain both spam and non-spam texts")
+        return 1
+
+    api_key = args.api_key or os.getenv("OPENAI_API_KEY") or settings.ANTISPAM_OPENAI_API_KEY
+    if not api_key and args.base_url:
+        # The stub server does not check the key, but the client refuses to work without one.
+        api_key = "stub"
+    if not api_key:
+        logging.error("No API key, use --api-key or set OPENAI_API_KEY")
+        return 1
+
+    client = AsyncOpenAI(api_key=api_key, base_url=args.base_url)
+    cache = EmbeddingCache(args.cache)
+    try:
+        started_at = perf_counter()
+        embeddings = asyncio.run(embed(client, cache, train_texts + test_texts, args.batch_size, args.concurrency))
+        logging.info(f"Embeddings ready in {perf_counter() - started_at:.1f} s")
+    finally:
+        cache.close()
+
+    x = np.vstack([embeddings[text] for text in train_texts]).astype(np.float64)
+    y = np.array(train_labels)
+
+    if test_texts:
+        x_train, y_train = x, y
+        x_test = np.vstack([embeddings[text] for text in test_texts]).astype(np.float64)
+        y_test = np.array(test_labels)
+    else:
+        x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=args.test_fraction, random_state=0,
+                                                            stratify=y)
+
+    model = create_model(args.model)
+    started_at = perf_counter()
+    model.fit(x_train, y_train)
+    logging.info(f"Trained {args.model} on {len(y_train)} samples in {perf_counter() - started_at:.1f} s")
+
+    evaluate(model, x_test, y_test, args.threshold)
+
+    # Write to a temporary file first so that a reader never sees a partially written model.
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = args.output.with_suffix(".new")
+    joblib.dump(model, temporary_path)
+    os.replace(temporary_path, args.output)
+    logging.info(f"Saved the model to {args.output} ({math.ceil(args.output.stat().st_size / 1024)} KB)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())